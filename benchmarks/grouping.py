@@ -0,0 +1,102 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Compare `mpm.generalize.grouping` with string_grouper.
+
+Usage: python -m benchmarks.grouping [SIZE...]
+
+Groups synthetic paths the same way as `generalize_mupltiple_runs` does and
+prints the time of both implementations and whether they produced the same
+groups. string_grouper (and pandas) is optional, only the new implementation
+is measured without it.
+"""
+
+from mpm.generalize.grouping import group_similar_strings
+import random
+import sys
+import time
+
+MIN_SIMILARITY = 0.425
+REPEAT = 5
+
+WORDS = [
+    'usr', 'lib', 'share', 'etc', 'var', 'spool', 'postfix', 'maildrop',
+    'queue', 'active', 'defer', 'ssl', 'certs', 'proc', 'status', 'cmdline',
+]  # fmt: skip
+
+
+def random_paths(n: int, seed: int = 1) -> list[str]:
+    """Return `n` unique paths, most of them with a random numeric part."""
+    rng = random.Random(seed)
+    paths: set[str] = set()
+    while len(paths) < n:
+        components = [rng.choice(WORDS) for _ in range(rng.randint(1, 4))]
+        name = rng.choice(WORDS)
+        if rng.random() < 0.7:
+            name += str(rng.randint(0, 99999))
+        name += rng.choice(['', '.db', '.log', '.pid'])
+        paths.add('/' + '/'.join(components + [name]))
+    return sorted(paths)
+
+
+def _measure(f, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        ret = f(*args)
+    return (time.perf_counter() - start) / REPEAT, ret
+
+
+def _string_grouper(paths: list[str]) -> list[list[str]]:
+    from pandas import Series
+    from string_grouper import group_similar_strings as sg_group
+
+    reps = sg_group(
+        Series(paths),
+        ignore_case=False,
+        min_similarity=MIN_SIMILARITY,
+        max_n_matches=len(paths),
+    )
+    groups: dict[str, list[str]] = {}
+    for path, rep in zip(paths, reps.iloc[:, 0]):
+        groups.setdefault(rep, []).append(path)
+    return list(groups.values())
+
+
+def main(sizes: list[int]) -> None:
+    try:
+        start = time.perf_counter()
+        import string_grouper  # noqa: F401
+
+        print(f'string_grouper import: {time.perf_counter() - start:.3f} s')
+    except ImportError:
+        string_grouper = None
+        print('string_grouper is not installed', file=sys.stderr)
+
+    print('size\tgrouping [s]\tstring_grouper [s]\tsame groups')
+    for size in sizes:
+        paths = random_paths(size)
+        t, groups = _measure(
+            group_similar_strings, paths, MIN_SIMILARITY, False
+        )
+        if string_grouper is None:
+            print(f'{size}\t{t:.4f}\t-\t-')
+            continue
+        t_sg, groups_sg = _measure(_string_grouper, paths)
+        same = sorted(map(sorted, groups)) == sorted(map(sorted, groups_sg))
+        print(f'{size}\t{t:.4f}\t{t_sg:.4f}\t{same}')
+
+
+if __name__ == '__main__':
+    main([int(s) for s in sys.argv[1:]] or [20, 100, 300, 1000, 3000])
@@ -0,0 +1,61 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Measure `mpm.generalize.lcs.prefix_postfix_regexp`.
+
+Usage: python -m benchmarks.lcs [SIZE...]
+
+Prints time and peak memory (traced by `tracemalloc`) of
+`prefix_postfix_regexp` for groups of synthetic paths.
+"""
+
+from mpm.generalize.lcs import prefix_postfix_regexp
+import random
+import sys
+import time
+import tracemalloc
+
+
+def random_paths(n: int, seed: int = 1) -> list[str]:
+    """Return `n` paths in the same directory with a common infix."""
+    rng = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789_-.'
+    return [
+        '/var/spool/postfix/'
+        + ''.join(rng.choices(alphabet, k=rng.randint(5, 40)))
+        + 'queue'
+        + ''.join(rng.choices(alphabet, k=rng.randint(0, 20)))
+        + '.db'
+        for _ in range(n)
+    ]
+
+
+def main(sizes: list[int]) -> None:
+    print('size\ttime [s]\tpeak memory [MiB]\tregexp')
+    for size in sizes:
+        paths = random_paths(size)
+        start = time.perf_counter()
+        regexp = prefix_postfix_regexp(paths)
+        t = time.perf_counter() - start
+        # Tracing slows everything down, so memory is measured separately
+        tracemalloc.start()
+        prefix_postfix_regexp(paths)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{size}\t{t:.3f}\t{peak / 2**20:.1f}\t{regexp}')
+
+
+if __name__ == '__main__':
+    main([int(s) for s in sys.argv[1:]] or [100, 1000])
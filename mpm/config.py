@@ -14,6 +14,8 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from enum import Flag, auto, Enum
+from pathlib import Path
+import os
 
 
 class OwnerGeneralizationStrategy(Flag):
@@ -73,3 +75,11 @@ OWNER_GENERALIZATION_STRATEGY = (
 """Which generalization strategies will be used for UGO generalization."""
 
 MULTIPLE_RUNS_STRATEGY = MultipleRunsSingleton.NUMERICAL_GENERALIZATION
+
+FHS_CACHE_DIR = str(
+    Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache')
+    / 'mpm'
+    / 'fhs'
+)
+"""Directory where parsed FHS rule files are cached (see `mpm.fhs`). `None`
+disables the cache."""
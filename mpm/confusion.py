@@ -0,0 +1,208 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Confusion of all evaluation cases computed at once.
+
+Reference results and Medusa results of all evaluation cases of a case are
+loaded with a single query. Reference results are stored in a boolean array
+with one item per result (access and operation) and Medusa results in a matrix
+with one row per evaluation case. Confusion counts of all evaluation cases and
+their breakdown by the directory of the accessed file are then computed with
+array operations. `Confusion.result` converts the counts of an evaluation case
+to the `Result` of fs2json used by summaries.
+"""
+
+from dataclasses import dataclass
+from collections.abc import Iterable, Sequence
+from fs2json.db import DatabaseWriter
+from fs2json.evaluation import Result
+from pathlib import Path
+import json
+import mpm.db
+import numpy as np
+
+CATEGORIES = ('tp', 'underpermission', 'overpermission', 'tn')
+"""Confusion categories in the same order as returned by
+`NpmTree.test_accesses`."""
+
+NULL = -1
+"""Value of missing (`NULL`) results in the arrays."""
+
+SELECT_RESULTS = """SELECT results.rowid,
+       fs.parent,
+       coalesce(results.reference_result, -1),
+       coalesce(medusa_results.eval_case_id, -1),
+       coalesce(medusa_results.medusa_result, -1)
+FROM accesses
+JOIN results ON accesses.rowid = results.access_id
+JOIN fs ON accesses.node_rowid = fs.rowid
+LEFT JOIN medusa_results ON results.rowid = medusa_results.result_id
+  AND medusa_results.eval_case_id IN (SELECT value FROM json_each(?3))
+WHERE accesses.case_id = ?1
+  AND accesses.subject_cid IN (SELECT value FROM json_each(?2))"""
+
+SELECT_PATHS = """SELECT rowid, path
+FROM fs_paths
+WHERE rowid IN (SELECT value FROM json_each(?))"""
+
+
+@dataclass
+class Confusion:
+    """Confusion counts of evaluation cases.
+
+    :param eval_cases: Names of evaluation cases.
+    :param counts: Array of shape `(len(eval_cases), len(CATEGORIES))`.
+    :param directories: Paths of directories that contain accessed files.
+    :param directory_counts: Array of shape `(len(eval_cases),
+    len(directories), len(CATEGORIES))` with counts of results in every
+    directory.
+    """
+
+    eval_cases: list[str]
+    counts: np.ndarray
+    directories: list[str]
+    directory_counts: np.ndarray
+
+    def result(self, eval_case: str) -> Result:
+        """Return confusion of `eval_case` as a `Result` of fs2json."""
+        tp, underpermission, overpermission, tn = map(
+            int, self.counts[self.eval_cases.index(eval_case)]
+        )
+        return Result(tp=tp, fp=overpermission, fn=underpermission, tn=tn)
+
+    def write_csv(self, result_dir: Path) -> None:
+        """Write `confusion.csv` with counts of all evaluation cases and
+        `directories.csv` with counts of directories in `result_dir`.
+
+        Directories without any result in an evaluation case are left out.
+        """
+        header = ','.join(CATEGORIES)
+        with open(result_dir / 'confusion.csv', 'w') as f:
+            f.write(f'eval_case,{header}\n')
+            for eval_case, counts in zip(self.eval_cases, self.counts):
+                f.write(f'{eval_case},{",".join(map(str, counts))}\n')
+        with open(result_dir / 'directories.csv', 'w') as f:
+            f.write(f'eval_case,directory,{header}\n')
+            for eval_case, directory_counts in zip(
+                self.eval_cases, self.directory_counts
+            ):
+                for i in np.flatnonzero(directory_counts.any(axis=1)):
+                    counts = ','.join(map(str, directory_counts[i]))
+                    f.write(f'{eval_case},{self.directories[i]},{counts}\n')
+
+
+def confusion_counts(
+    reference: np.ndarray, medusa: np.ndarray, groups: np.ndarray | None = None
+) -> np.ndarray:
+    """Count results in every confusion category.
+
+    :param reference: Array of reference results, `NULL` for missing ones.
+    :param medusa: Matrix of Medusa results with a row for every evaluation
+    case and a column for every reference result. Missing results are `NULL`.
+    :param groups: If set, results are counted separately in groups. Contains
+    a group index (from 0) for every reference result.
+    :returns: Array of shape `(evaluation cases, len(CATEGORIES))` or
+    `(evaluation cases, groups, len(CATEGORIES))` if `groups` is set. Results
+    with missing reference or Medusa result aren't counted.
+    """
+    valid = (reference != NULL) & (medusa != NULL)
+    allowed = reference == 1
+    medusa_allowed = medusa == 1
+    categories = (
+        valid & allowed & medusa_allowed,
+        valid & allowed & ~medusa_allowed,
+        valid & ~allowed & medusa_allowed,
+        valid & ~allowed & ~medusa_allowed,
+    )
+    if groups is None:
+        return np.stack([c.sum(axis=1) for c in categories], axis=-1)
+
+    groups_count = int(groups.max(initial=-1)) + 1
+    eval_cases_count = medusa.shape[0]
+    # Index of the evaluation case and group of every item of the matrix
+    index = np.arange(eval_cases_count)[:, np.newaxis] * groups_count + groups
+    return np.stack(
+        [
+            np.bincount(
+                index[c], minlength=eval_cases_count * groups_count
+            ).reshape(eval_cases_count, groups_count)
+            for c in categories
+        ],
+        axis=-1,
+    )
+
+
+def load_confusion(
+    db: DatabaseWriter,
+    case_name: str,
+    subject_context_groups: Iterable[Iterable[str]],
+    eval_cases: Sequence[str],
+) -> Confusion:
+    """Compute confusion of all `eval_cases` of `case_name`.
+
+    Medusa results of the evaluation cases have to be inserted into the
+    database already.
+    """
+    case_id = db.get_case_id(case_name)
+    subject_cids = [
+        db.get_context_id(subject_context)
+        for subject_contexts in subject_context_groups
+        for subject_context in subject_contexts
+    ]
+    eval_case_ids = np.array(
+        [db.insert_or_select_eval_case(e) for e in eval_cases], dtype=np.int64
+    )
+    rows = np.array(
+        db.cur.execute(
+            SELECT_RESULTS,
+            (
+                case_id,
+                json.dumps(subject_cids),
+                json.dumps(eval_case_ids.tolist()),
+            ),
+        ).fetchall(),
+        dtype=np.int64,
+    ).reshape(-1, 5)
+    result_ids, parents, references, row_eval_case_ids, medusa_results = rows.T
+
+    # Result rows are repeated for every evaluation case
+    _, results = np.unique(result_ids, return_inverse=True)
+    results_count = int(results.max(initial=-1)) + 1
+    reference = np.full(results_count, NULL, dtype=np.int8)
+    reference[results] = references
+    parent = np.zeros(results_count, dtype=np.int64)
+    parent[results] = parents
+
+    medusa = np.full((len(eval_cases), results_count), NULL, dtype=np.int8)
+    present = row_eval_case_ids != NULL
+    order = np.argsort(eval_case_ids)
+    eval_case_rows = order[
+        np.searchsorted(eval_case_ids, row_eval_case_ids[present], sorter=order)
+    ]
+    medusa[eval_case_rows, results[present]] = medusa_results[present]
+
+    directory_ids, groups = np.unique(parent, return_inverse=True)
+    mpm.db.create_path_table(db)
+    paths = dict(
+        db.cur.execute(
+            SELECT_PATHS, (json.dumps(directory_ids.tolist()),)
+        ).fetchall()
+    )
+    return Confusion(
+        list(eval_cases),
+        confusion_counts(reference, medusa),
+        [paths.get(int(rowid), str(rowid)) for rowid in directory_ids],
+        confusion_counts(reference, medusa, groups),
+    )
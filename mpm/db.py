@@ -0,0 +1,209 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Bulk operations on the evaluation database.
+
+`DatabaseWriter` from fs2json inserts one row per call. This is fine for the
+reference accesses, but Medusa results are inserted for every evaluation case
+and there can be hundreds of thousands of them. Functions in this module compute
+everything in memory first and write it with `executemany` inside a single
+transaction (or in the open transaction of `mpm.session.DatabaseSession`).
+
+SQL statements are module-level constants, so the statement cache of the
+`sqlite3` connection reuses the prepared statements across evaluation cases.
+"""
+
+from fs2json.db import DatabaseWriter
+from mpm.session import transaction
+from collections.abc import Iterable
+import json
+
+INSERT_ACCESS = """INSERT INTO accesses (case_id, subject_cid, node_rowid)
+SELECT ?1, ?2, ?3
+WHERE NOT EXISTS
+    (SELECT 1 FROM accesses
+     WHERE case_id = ?1 AND subject_cid = ?2 AND node_rowid = ?3)"""
+
+SELECT_ACCESSES = """SELECT node_rowid, rowid
+FROM accesses
+WHERE case_id = ? AND subject_cid = ?"""
+
+INSERT_RESULT = """INSERT INTO results (access_id, operation_id, reference_result)
+SELECT ?1, ?2, NULL
+WHERE NOT EXISTS
+    (SELECT 1 FROM results WHERE access_id = ?1 AND operation_id = ?2)"""
+
+UPDATE_MEDUSA_RESULT = """UPDATE medusa_results
+SET medusa_result = ?3
+WHERE eval_case_id = ?2
+  AND result_id IN
+    (SELECT rowid FROM results WHERE access_id = ?4 AND operation_id = ?1)"""
+
+INSERT_MEDUSA_RESULT = """INSERT INTO medusa_results (result_id, eval_case_id, medusa_result)
+SELECT results.rowid, ?2, ?3
+FROM results
+WHERE access_id = ?4 AND operation_id = ?1
+  AND NOT EXISTS
+    (SELECT 1 FROM medusa_results
+     WHERE result_id = results.rowid AND eval_case_id = ?2)"""
+
+CREATE_PATH_TABLE = """CREATE TABLE IF NOT EXISTS fs_paths (
+    rowid INTEGER PRIMARY KEY,
+    path TEXT NOT NULL
+)"""
+
+CREATE_PATH_TABLE_INFO = """CREATE TABLE IF NOT EXISTS fs_paths_info (
+    fs_count INTEGER NOT NULL,
+    fs_max_rowid INTEGER
+)"""
+
+SELECT_FS_SNAPSHOT = 'SELECT count(*), max(rowid) FROM fs'
+
+FILL_PATH_TABLE = """INSERT INTO fs_paths (rowid, path)
+WITH RECURSIVE child (rowid, path) AS
+  (SELECT rowid, '' FROM fs WHERE rowid = 1
+   UNION ALL SELECT fs.rowid, child.path || '/' || fs.name
+   FROM fs
+   JOIN child ON fs.parent = child.rowid
+   WHERE fs.rowid != 1)
+SELECT rowid, CASE path WHEN '' THEN '/' ELSE path END
+FROM child"""
+
+SELECT_MISSING_MEDUSA_ACCESSES = """SELECT DISTINCT accesses.rowid, fs_paths.path
+FROM accesses
+JOIN fs_paths ON accesses.node_rowid = fs_paths.rowid
+LEFT JOIN results ON accesses.rowid = results.access_id
+LEFT JOIN medusa_results ON results.rowid = medusa_results.result_id
+  AND medusa_results.eval_case_id = ?
+WHERE accesses.case_id = ?
+  AND accesses.subject_cid IN (SELECT value FROM json_each(?))
+  AND medusa_results.medusa_result IS NULL"""
+
+
+def create_path_table(db: DatabaseWriter) -> None:
+    """Create table `fs_paths` that maps rowids from `fs` to full paths.
+
+    Reconstructing paths by walking `fs.parent` is expensive, so it's done only
+    once for every filesystem snapshot. A snapshot is identified by the number
+    of rows and the maximal rowid of the `fs` table.
+    """
+    with transaction(db):
+        db.cur.execute(CREATE_PATH_TABLE)
+        db.cur.execute(CREATE_PATH_TABLE_INFO)
+        snapshot = db.cur.execute(SELECT_FS_SNAPSHOT).fetchone()
+        if db.cur.execute('SELECT * FROM fs_paths_info').fetchone() == snapshot:
+            return
+        db.cur.execute('DELETE FROM fs_paths')
+        db.cur.execute(FILL_PATH_TABLE)
+        db.cur.execute('DELETE FROM fs_paths_info')
+        db.cur.execute('INSERT INTO fs_paths_info VALUES (?, ?)', snapshot)
+
+
+def get_missing_medusa_accesses(
+    db: DatabaseWriter,
+    case_id: int,
+    subject_cids: Iterable[int],
+    eval_case_id: int,
+) -> list[tuple[int, str]]:
+    """Return accesses that don't have a Medusa result for `eval_case_id` yet.
+
+    `create_path_table` has to be called before this function.
+
+    :returns: List of `(access_id, path)` tuples.
+    """
+    return db.cur.execute(
+        SELECT_MISSING_MEDUSA_ACCESSES,
+        (eval_case_id, case_id, json.dumps(list(subject_cids))),
+    ).fetchall()
+
+
+def _medusa_result_rows(
+    operation_ids: Iterable[int],
+    eval_case_id: int,
+    results: Iterable[tuple[int, tuple[int, ...]]],
+) -> list[tuple[int, int, int, int]]:
+    """Unfold `(access_id, (result1, result2...))` into rows for the
+    `*_MEDUSA_RESULT` statements."""
+    operation_ids = tuple(operation_ids)
+    return [
+        (operation_id, eval_case_id, result, access_id)
+        for access_id, access_results in results
+        for operation_id, result in zip(operation_ids, access_results)
+    ]
+
+
+def _write_medusa_results(db: DatabaseWriter, rows: list[tuple]) -> None:
+    # Result rows are shared by all evaluation cases, create them only once.
+    db.cur.executemany(
+        INSERT_RESULT, ((access_id, op) for op, _, _, access_id in rows)
+    )
+    db.cur.executemany(UPDATE_MEDUSA_RESULT, rows)
+    db.cur.executemany(INSERT_MEDUSA_RESULT, rows)
+
+
+def insert_medusa_results(
+    db: DatabaseWriter,
+    operation_ids: Iterable[int],
+    eval_case_id: int,
+    results: Iterable[tuple[int, tuple[int, ...]]],
+) -> None:
+    """Insert Medusa results for already existing accesses.
+
+    Existing results for `eval_case_id` are overwritten.
+
+    :param operation_ids: Rowids of operations, in the same order as results.
+    :param results: Iterable of `(access_id, (result1, result2...))` tuples.
+    """
+    rows = _medusa_result_rows(operation_ids, eval_case_id, results)
+    with transaction(db):
+        _write_medusa_results(db, rows)
+
+
+def insert_medusa_accesses(
+    db: DatabaseWriter,
+    case_id: int,
+    subject_cids: Iterable[int],
+    operation_ids: Iterable[int],
+    eval_case_id: int,
+    results: dict[int, tuple[int, ...]],
+) -> None:
+    """Insert accesses together with Medusa results in one transaction.
+
+    Accesses are created for every subject context, if they don't exist yet.
+
+    :param results: Dictionary that maps rowid of a path in the `fs` table to
+    results of the operations (in the same order as `operation_ids`).
+    """
+    subject_cids = list(subject_cids)
+    with transaction(db):
+        db.cur.executemany(
+            INSERT_ACCESS,
+            (
+                (case_id, subject_cid, path_rowid)
+                for subject_cid in subject_cids
+                for path_rowid in results
+            ),
+        )
+        access_results = []
+        for subject_cid in subject_cids:
+            for path_rowid, access_id in db.cur.execute(
+                SELECT_ACCESSES, (case_id, subject_cid)
+            ).fetchall():
+                if (result := results.get(path_rowid)) is not None:
+                    access_results.append((access_id, result))
+        _write_medusa_results(
+            db,
+            _medusa_result_rows(operation_ids, eval_case_id, access_results),
+        )
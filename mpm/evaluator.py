@@ -0,0 +1,221 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Evaluation of accesses against a tree compiled into a trie.
+
+`NpmTree.get_node_at_path` scans all children of every directory on the path
+and the permissions of the found node are then searched linearly for the
+evaluated domains. `CompiledTree` is created once for a tree: literal children
+are stored in dictionaries, regexps are compiled and accesses of every node are
+grouped by domain. Domains are replaced by small integers (see `DomainIds`), so
+a set of evaluated domains is a `frozenset` of integers.
+
+Accesses of recursive markers (see `NpmTree.get_recursive_marker`) are copied
+to all compiled nodes under the marked node.
+
+Permissions of a path are the union of permissions of all accesses of the
+evaluated domains in the matched node and in recursive markers above it. The
+original evaluation by `get_node_at_path` took permissions of the first access
+of an evaluated domain in the matched node (in the iteration order of its
+accesses) and didn't apply recursive markers to nodes under them. Results are
+the same unless the node has accesses of more evaluated domains with different
+permissions or there is a recursive marker above it.
+"""
+
+from __future__ import annotations
+from bitarray import bitarray as Bitarray
+from collections.abc import Iterable, Sequence
+from re import Pattern, compile
+from typing import TYPE_CHECKING
+from mpm.permission import Permission
+
+if TYPE_CHECKING:
+    from treelib.node import Node
+    from mpm.tree import Access, NpmTree
+
+
+class DomainIds:
+    """Intern domains as integers."""
+
+    def __init__(self):
+        self._ids: dict[tuple, int] = {}
+
+    def get(self, domain: tuple) -> int:
+        """Return ID of `domain`, a new one if `domain` wasn't seen yet."""
+        return self._ids.setdefault(domain, len(self._ids))
+
+    def ids(self, domains: Iterable[tuple]) -> frozenset[int]:
+        """Return IDs of all `domains`."""
+        return frozenset(self.get(domain) for domain in domains)
+
+
+class CompiledNode:
+    """Node of `CompiledTree`."""
+
+    __slots__ = ('children', 'regexps', 'recursive', 'permissions', 'fallback')
+
+    def __init__(self):
+        # Literal (non-regexp) children by their tag
+        self.children: dict[str, CompiledNode] = {}
+        # Regexp children in the order in which they are tried
+        self.regexps: list[tuple[Pattern, CompiledNode]] = []
+        self.recursive = False
+        # Permissions of all accesses of the node (including accesses of
+        # recursive markers above it) grouped by domain ID
+        self.permissions: dict[int, Permission] = {}
+        # Nearest recursive marker that covers paths under this node that are
+        # not in the tree
+        self.fallback: CompiledNode | None = None
+
+    def domain_permissions(self, domains: frozenset[int]) -> Permission:
+        """Return permissions allowed to at least one of `domains`."""
+        ret = Permission(0)
+        # Iterate over the smaller collection
+        if len(domains) < len(self.permissions):
+            for domain in domains:
+                ret |= self.permissions.get(domain, 0)
+        else:
+            for domain, permissions in self.permissions.items():
+                if domain in domains:
+                    ret |= permissions
+        return ret
+
+
+class CompiledTree:
+    """`NpmTree` compiled for fast evaluation of accesses.
+
+    Paths are resolved the same way as by `NpmTree.get_node_at_path` with
+    `search_regexp=True`. The compiled tree is a snapshot, it has to be
+    compiled again if the tree changes.
+    """
+
+    def __init__(self, tree: NpmTree, domain_ids: DomainIds | None = None):
+        """
+        :param domain_ids: IDs of domains, can be shared by multiple compiled
+        trees. A new one is created if `None`.
+        """
+        self.domain_ids = DomainIds() if domain_ids is None else domain_ids
+        self.root = CompiledNode()
+        # Node, its compiled node, permissions inherited from recursive markers
+        # and the nearest recursive marker
+        stack: list[
+            tuple[Node, CompiledNode, dict[int, Permission], CompiledNode | None]
+        ] = [(tree.npm_root, self.root, {}, None)]
+        while stack:
+            node, compiled, inherited, fallback = stack.pop()
+            if data := node.data:
+                compiled.recursive = data.is_recursive
+                compiled.permissions = self._add_permissions(inherited, data)
+            else:
+                # Inherited permissions are never modified, they can be shared
+                compiled.permissions = inherited
+
+            children = [tree[nid] for nid in node.successors(tree.identifier)]
+            compiled_children = [CompiledNode() for _ in children]
+            for child, compiled_child in zip(children, compiled_children):
+                if (data := child.data) and data.is_regexp:
+                    compiled.regexps.append((compile(child.tag), compiled_child))
+                    if data.is_recursive:
+                        # Recursive marker, its accesses apply to everything
+                        # under `node`
+                        inherited = self._add_permissions(inherited, data)
+                        fallback = compiled_child
+                else:
+                    # The first child with the tag wins
+                    compiled.children.setdefault(child.tag, compiled_child)
+            compiled.fallback = fallback
+            stack.extend(
+                (child, compiled_child, inherited, fallback)
+                for child, compiled_child in zip(children, compiled_children)
+            )
+
+    def _add_permissions(
+        self, permissions: dict[int, Permission], accesses: Iterable[Access]
+    ) -> dict[int, Permission]:
+        """Return copy of `permissions` with added permissions of
+        `accesses`."""
+        ret = dict(permissions)
+        for access in accesses:
+            domain = self.domain_ids.get(access.domain)
+            ret[domain] = ret.get(domain, Permission(0)) | access.permissions
+        return ret
+
+    def find(self, path: str) -> CompiledNode | None:
+        """Return node that matches `path` or `None` if there is no such
+        node."""
+        node = self.root
+        for e in path.split('/'):
+            if not e:
+                continue
+            if (child := node.children.get(e)) is None:
+                for regexp, c in node.regexps:
+                    if regexp.fullmatch(e):
+                        child = c
+                        break
+                else:
+                    # Recursive nodes match everything below them
+                    return node if node.recursive else node.fallback
+            node = child
+        return node
+
+    def evaluate(
+        self, paths: Iterable[str], domains: Iterable[tuple] | frozenset[int]
+    ) -> tuple[Bitarray, Bitarray]:
+        """Evaluate read and write accesses of `domains` to `paths`.
+
+        :param domains: Domains or their IDs from `domain_ids`. If *at least
+        one* domain enables the operation, the access is considered allowed.
+        :returns: Bitarrays of read and write results, one bit for every path.
+        """
+        if not isinstance(domains, frozenset):
+            domains = self.domain_ids.ids(domains)
+        read = Bitarray()
+        write = Bitarray()
+        # Permissions of already evaluated nodes
+        cache: dict[int, Permission] = {}
+        for path in paths:
+            node = self.find(path)
+            if node is None:
+                permissions = Permission(0)
+            elif (permissions := cache.get(id(node))) is None:
+                permissions = cache[id(node)] = node.domain_permissions(domains)
+            read.append(bool(permissions & Permission.READ))
+            write.append(bool(permissions & Permission.WRITE))
+        return read, write
+
+    def test_accesses(
+        self,
+        b: Sequence[tuple[str, int, int]],
+        domains: Iterable[tuple] | frozenset[int],
+    ) -> tuple[int, int, int, int]:
+        """Compare accesses of `domains` with reference accesses `b`.
+
+        :param b: Reference table of accesses with tuples in the form of (path,
+        read, write).
+        :returns: Numbers of true positives, underpermissions (false negatives),
+        overpermissions (false positives) and true negatives.
+        """
+        read, write = self.evaluate((path for path, _, _ in b), domains)
+        medusa_results = read + write
+
+        reference_results = Bitarray((read for _, read, _ in b))
+        reference_results.extend((write for _, _, write in b))
+
+        tp = (reference_results & medusa_results).count()
+        tn = (~reference_results & ~medusa_results).count()
+        overpermission = (~reference_results & medusa_results).count()
+        underpermission = (reference_results & ~medusa_results).count()
+
+        return (tp, underpermission, overpermission, tn)
@@ -0,0 +1,308 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Loader of FHS rule files.
+
+Every line of a rule file contains a rule with tab-separated fields: path,
+permissions and optionally `reg` if components of the path are regexps.
+Permissions are a combination of `R`, `W` and `S`, `r` makes the rule
+recursive. A rule with just a path doesn't allow anything, it can be used to
+exclude a path from a regexp rule. Lines starting with `#` are comments.
+
+Other rule files can be included with an `include<TAB>path` line. Relative
+paths are relative to the directory of the including file. A file can be
+included more than once, but cyclic includes are an error.
+
+Rules are validated and compiled when they are loaded. Parsed rules are
+cached in `FHS_CACHE_DIR` as JSON under the hash of the paths and contents of
+the loaded files, so unchanged files aren't parsed again in the next run.
+"""
+
+from collections import namedtuple
+from collections.abc import Iterable
+from hashlib import sha256
+from pathlib import Path
+from re import compile, error as RegexpError
+from tempfile import NamedTemporaryFile
+import json
+import os
+from mpm.config import FHS_CACHE_DIR
+from mpm.mpm_types import FHSConfigRule
+from mpm.permission import Permission
+
+CACHE_VERSION = 2
+"""Version of the cache file format, increment it if the format changes."""
+
+# `components` are components of the rule's path, `patterns` are compiled
+# components of regexp rules (empty for other rules)
+CompiledFHSRule = namedtuple(
+    'CompiledFHSRule', ['rule', 'components', 'patterns']
+)
+
+
+class FHSConfigError(RuntimeError):
+    """Invalid FHS rule file."""
+
+    def __init__(self, message: str, filename: str, line: int):
+        super().__init__(f'{filename}:{line}: {message}')
+        self.filename = filename
+        self.line = line
+
+
+# Compiled rule sets by their rules
+_compiled: dict[tuple[FHSConfigRule, ...], tuple[CompiledFHSRule, ...]] = {}
+# Loaded rules and their dependencies (see `_parse_file`) by the cache key
+# of the loaded files
+_loaded: dict[str, tuple[dict[str, str], tuple[FHSConfigRule, ...]]] = {}
+
+
+def parse_permissions(raw_perms: str) -> tuple[Permission, bool]:
+    """Parse permissions field of a rule.
+
+    :returns: Permissions and whether the rule is recursive.
+    :raises ValueError: if `raw_perms` contains an unknown character.
+    """
+    perms = Permission(0)
+    recursive = False
+    for c in raw_perms:
+        match c:
+            case 'r':
+                recursive = True
+            case 'R':
+                perms |= Permission.READ
+            case 'W':
+                perms |= Permission.WRITE
+            case 'S':
+                perms |= Permission.SEE
+            case _:
+                raise ValueError(f'Invalid permission: {c}')
+    return perms, recursive
+
+
+def compile_rule(rule: FHSConfigRule) -> CompiledFHSRule:
+    """Validate `rule`, split its path into components and compile them if
+    it's a regexp rule.
+
+    :raises ValueError: if the rule is invalid.
+    """
+    path = rule.path
+    if not path.startswith('/'):
+        raise ValueError(f'Path is not absolute: {path}')
+    components = tuple(path.split('/')[1:]) if path != '/' else ()
+    if '' in components:
+        raise ValueError(f'Empty path component: {path}')
+    patterns = ()
+    if rule.regexp:
+        try:
+            patterns = tuple(compile(e) for e in components)
+        except RegexpError as e:
+            raise ValueError(f'Invalid regexp {path}: {e}') from None
+    return CompiledFHSRule(rule, components, patterns)
+
+
+def compile_fhs_rules(
+    rules: Iterable[FHSConfigRule],
+) -> tuple[CompiledFHSRule, ...]:
+    """Compile `rules`, every rule set is compiled only once."""
+    rules = tuple(rules)
+    if (ret := _compiled.get(rules)) is None:
+        ret = _compiled[rules] = tuple(compile_rule(rule) for rule in rules)
+    return ret
+
+
+def parse_fhs_rules(
+    lines: Iterable[str],
+    filename: str = '<string>',
+    dependencies: dict[str, str] | None = None,
+    includes: tuple[str, ...] = (),
+) -> list[CompiledFHSRule]:
+    """Parse and compile rules from `lines` of a rule file.
+
+    :param filename: Name of the file for error messages. Relative includes
+    are resolved against its directory.
+    :param dependencies: If set, paths of included files are added to it with
+    hashes of their contents.
+    :param includes: Resolved paths of files that include `lines`, directly or
+    indirectly. A file can be included multiple times, but not by itself.
+    :raises FHSConfigError: if a rule is invalid or an include is cyclic.
+    """
+    if dependencies is None:
+        dependencies = {}
+    ret: list[CompiledFHSRule] = []
+    for i, line in enumerate(lines, 1):
+        if line.startswith('#'):
+            continue
+        match [field for field in line.rstrip().split('\t') if field]:
+            case []:
+                # Empty line
+                continue
+            case ['include', included]:
+                path = (Path(filename).parent / included).resolve()
+                if str(path) in includes:
+                    raise FHSConfigError(
+                        f'File includes itself: {path}', filename, i
+                    )
+                ret.extend(_parse_file(path, dependencies, includes))
+                continue
+            case [path]:
+                raw_perms = ''
+                regexp = False
+            case [path, raw_perms]:
+                regexp = False
+            case [path, raw_perms, 'reg']:
+                regexp = True
+            case [path, raw_perms, regexp]:
+                raise FHSConfigError(f'Invalid value: {regexp}', filename, i)
+            case _:
+                raise FHSConfigError('Too many fields', filename, i)
+        try:
+            perms, recursive = parse_permissions(raw_perms)
+            ret.append(
+                compile_rule(FHSConfigRule(path, perms, recursive, regexp))
+            )
+        except ValueError as e:
+            raise FHSConfigError(str(e), filename, i) from None
+    return ret
+
+
+def _hash_file(path: str) -> str | None:
+    """Return hash of the contents of file at `path`, `None` if it can't be
+    read."""
+    try:
+        with open(path, 'rb') as f:
+            return sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _parse_file(
+    path: Path, dependencies: dict[str, str], includes: tuple[str, ...] = ()
+) -> list[CompiledFHSRule]:
+    """Parse rule file at resolved `path` and add it to `dependencies`.
+
+    :param includes: Resolved paths of files that include `path`.
+    """
+    content = path.read_bytes()
+    dependencies[str(path)] = sha256(content).hexdigest()
+    return parse_fhs_rules(
+        content.decode().splitlines(),
+        str(path),
+        dependencies,
+        includes + (str(path),),
+    )
+
+
+def _is_fresh(dependencies: dict[str, str]) -> bool:
+    """Return `True` if no file from `dependencies` changed."""
+    return all(
+        _hash_file(path) == digest for path, digest in dependencies.items()
+    )
+
+
+def _read_cache(
+    cache_file: Path,
+) -> tuple[dict[str, str], tuple[CompiledFHSRule, ...]] | None:
+    """Return dependencies and rules from `cache_file` if all files they were
+    parsed from are unchanged, `None` otherwise."""
+    try:
+        with open(cache_file) as f:
+            data = json.load(f)
+        dependencies = data['dependencies']
+        if not all(
+            isinstance(path, str) and isinstance(digest, str)
+            for path, digest in dependencies.items()
+        ):
+            return None
+        if not _is_fresh(dependencies):
+            return None
+        rules = tuple(
+            compile_rule(
+                FHSConfigRule(
+                    str(path), Permission(perms), bool(recursive), bool(regexp)
+                )
+            )
+            for path, perms, recursive, regexp in data['rules']
+        )
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        # Missing or corrupted cache file, it will be (re)created
+        return None
+    return dependencies, rules
+
+
+def _write_cache(
+    cache_file: Path,
+    dependencies: dict[str, str],
+    rules: tuple[CompiledFHSRule, ...],
+) -> None:
+    """Atomically write `rules` to `cache_file`, so that parallel runs never
+    read a partially written file."""
+    data = {
+        'dependencies': dependencies,
+        'rules': [
+            (r.path, int(r.permissions), r.recursive, r.regexp)
+            for r in (c.rule for c in rules)
+        ],
+    }
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile(
+        'w', dir=cache_file.parent, suffix='.tmp', delete=False
+    ) as f:
+        json.dump(data, f)
+    os.replace(f.name, cache_file)
+
+
+def load_fhs_rules(
+    *paths: str, cache_dir: str | None = FHS_CACHE_DIR
+) -> tuple[FHSConfigRule, ...]:
+    """Load rules from files at `paths`, in this order.
+
+    Files are parsed only once per run. Compiled rules are also stored in
+    `cache_dir` (if not `None`) and reused as long as contents of the files
+    and files included by them don't change.
+
+    :raises FHSConfigError: if a rule is invalid.
+    """
+    resolved = tuple(str(Path(path).resolve()) for path in paths)
+    key = sha256(str(CACHE_VERSION).encode())
+    for path in resolved:
+        key.update(path.encode())
+        with open(path, 'rb') as f:
+            key.update(sha256(f.read()).digest())
+    key = key.hexdigest()
+    # Included files are checked by their hashes
+    if (loaded := _loaded.get(key)) is not None and _is_fresh(loaded[0]):
+        return loaded[1]
+
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = Path(cache_dir) / f'{key}.json'
+
+    cached = None if cache_file is None else _read_cache(cache_file)
+    if cached is None:
+        dependencies: dict[str, str] = {}
+        compiled = tuple(
+            rule
+            for path in resolved
+            for rule in _parse_file(Path(path), dependencies)
+        )
+        if cache_file is not None:
+            _write_cache(cache_file, dependencies, compiled)
+    else:
+        dependencies, compiled = cached
+
+    ret = tuple(c.rule for c in compiled)
+    _loaded[key] = (dependencies, ret)
+    _compiled.setdefault(ret, compiled)
+    return ret
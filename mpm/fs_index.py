@@ -0,0 +1,238 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""In-memory index of the filesystem snapshot.
+
+Generalizers and the evaluation query the `fs` table one path component at a
+time. `FsIndex` loads the whole table once into flat arrays and answers the
+same queries from memory. Methods that are not implemented by the index are
+forwarded to the wrapped database, so `FsIndex` can be used everywhere a
+`DatabaseRead` or `DatabaseWriter` is expected.
+
+Queries of the owner generalization (`get_children_inodes`, `can_read` and
+`can_write`) are answered from memory too. Permissions are checked by the mode
+bits of the owner and of others. Group bits are not checked, since membership
+of users in groups is not in the `fs` table.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable, Iterator
+from fs2json.db import DatabaseRead
+from mpm.utils import path_components
+from re import fullmatch
+from typing import NamedTuple
+import stat
+
+ROOT = 1
+"""Rowid of the root directory in the `fs` table."""
+
+
+class Inode(NamedTuple):
+    """Attributes of a file returned by `FsIndex.get_children_inodes`."""
+
+    rowid: int
+    uid: int
+    gid: int
+    mode: int
+
+
+class FsIndex:
+    """Read-only trie of the `fs` table.
+
+    Every row is stored at the index of its rowid in arrays `parent`, `name`,
+    `type`, `uid`, `gid` and `mode`. Names and types are stored as indices into
+    the string table `strings`. Children of a directory are stored in the
+    `children` array sorted by their names. Children of directory `rowid` start
+    at `children_start[rowid]` and end before `children_start[rowid + 1]`.
+    """
+
+    def __init__(self, db: DatabaseRead):
+        self.db = db
+        rows = db.cur.execute(
+            'SELECT rowid, parent, name, type, uid, gid, mode FROM fs'
+        ).fetchall()
+        size = max((row[0] for row in rows), default=ROOT) + 1
+
+        self.strings: list[str] = []
+        string_ids: dict[str, int] = {}
+
+        def intern(s: str | None) -> int:
+            if s is None:
+                s = ''
+            if (i := string_ids.get(s)) is None:
+                i = string_ids[s] = len(self.strings)
+                self.strings.append(s)
+            return i
+
+        intern('')
+        self.parent = array('q', [0]) * size
+        self.name = array('q', [0]) * size
+        self.type = array('q', [0]) * size
+        self.uid = array('q', [-1]) * size
+        self.gid = array('q', [-1]) * size
+        self.mode = array('q', [0]) * size
+        self.exists = array('b', [0]) * size
+
+        counts = array('q', [0]) * (size + 1)
+        for rowid, parent, name, _type, uid, gid, mode in rows:
+            self.exists[rowid] = 1
+            self.parent[rowid] = parent or 0
+            self.name[rowid] = intern(name)
+            self.type[rowid] = intern(_type)
+            if uid is not None:
+                self.uid[rowid] = uid
+            if gid is not None:
+                self.gid[rowid] = gid
+            self.mode[rowid] = mode or 0
+            if rowid != ROOT and parent is not None and 0 <= parent < size:
+                counts[parent] += 1
+
+        # Prefix sums of children counts
+        self.children_start = array('q', [0]) * (size + 1)
+        for i in range(size):
+            self.children_start[i + 1] = self.children_start[i] + counts[i]
+
+        children = sorted(
+            (
+                row[0]
+                for row in rows
+                if row[0] != ROOT
+                and row[1] is not None
+                and 0 <= row[1] < size
+            ),
+            key=lambda x: (self.parent[x], self.strings[self.name[x]]),
+        )
+        self.children = array('q', children)
+
+    def __getattr__(self, name):
+        # Everything that is not implemented here is handled by the database
+        if name == 'db':
+            raise AttributeError(name)
+        return getattr(self.db, name)
+
+    def _children_range(self, rowid: int) -> tuple[int, int]:
+        if not 0 <= rowid < len(self.exists):
+            return 0, 0
+        return self.children_start[rowid], self.children_start[rowid + 1]
+
+    def get_name(self, rowid: int) -> str:
+        return self.strings[self.name[rowid]]
+
+    def get_specific_child(self, parent: int, name: str) -> int | None:
+        """Return rowid of child `name` of directory `parent` or `None`."""
+        lo, hi = self._children_range(parent)
+        i = bisect_left(self.children, name, lo, hi, key=self.get_name)
+        if i < hi and self.get_name(self.children[i]) == name:
+            return self.children[i]
+        return None
+
+    def iter_children(self, parent: int) -> Iterator[int]:
+        lo, hi = self._children_range(parent)
+        return iter(self.children[lo:hi])
+
+    def get_children_rowids_and_names(
+        self, parent: int
+    ) -> list[tuple[int, str]]:
+        return [(c, self.get_name(c)) for c in self.iter_children(parent)]
+
+    def get_matching_children(self, parent: int, pattern: str) -> list[int]:
+        """Return rowids of children of `parent` that match regexp
+        `pattern`."""
+        return [
+            c
+            for c in self.iter_children(parent)
+            if fullmatch(pattern, self.get_name(c))
+        ]
+
+    def resolve(self, path: str) -> int | None:
+        """Return rowid of `path` or `None` if it doesn't exist."""
+        rowid = ROOT
+        for e in path_components(path):
+            rowid = self.get_specific_child(rowid, e)
+            if rowid is None:
+                return None
+        return rowid
+
+    def get_path(self, rowid: int) -> str:
+        """Return full path of `rowid`."""
+        components = []
+        while rowid != ROOT and rowid:
+            components.append(self.get_name(rowid))
+            rowid = self.parent[rowid]
+        return '/' + '/'.join(reversed(components))
+
+    def search_path(self, path: str) -> bool:
+        return self.resolve(path) is not None
+
+    def is_directory(self, path: str) -> bool:
+        if (rowid := self.resolve(path)) is None:
+            return False
+        return stat.S_ISDIR(self.mode[rowid])
+
+    def get_owner(self, path: str) -> int | None:
+        if (rowid := self.resolve(path)) is None:
+            return None
+        return self.uid[rowid]
+
+    def get_num_children(self, path: str) -> int:
+        if (rowid := self.resolve(path)) is None:
+            return 0
+        lo, hi = self._children_range(rowid)
+        return hi - lo
+
+    def get_directories_by_id(
+        self, uids: Iterable[int], gids: Iterable[int]
+    ) -> list[tuple[str, int]]:
+        """Return `(path, mode)` of directories owned by one of `uids` or by
+        one of `gids`."""
+        uids = set(uids)
+        gids = set(gids)
+        return [
+            (self.get_path(rowid), self.mode[rowid])
+            for rowid in range(len(self.exists))
+            if self.exists[rowid]
+            and stat.S_ISDIR(self.mode[rowid])
+            and (self.uid[rowid] in uids or self.gid[rowid] in gids)
+        ]
+
+    def get_children_inodes(self, path: str) -> list[Inode]:
+        """Return inodes of children of directory `path`, an empty list if
+        `path` doesn't exist."""
+        if (rowid := self.resolve(path)) is None:
+            return []
+        return [
+            Inode(c, self.uid[c], self.gid[c], self.mode[c])
+            for c in self.iter_children(rowid)
+        ]
+
+    @staticmethod
+    def _is_allowed(
+        ino: Inode, uid: int, owner_bit: int, other_bit: int
+    ) -> bool:
+        if uid == 0:
+            # root
+            return True
+        if ino.uid == uid:
+            return bool(ino.mode & owner_bit)
+        return bool(ino.mode & other_bit)
+
+    def can_read(self, ino: Inode, uid: int) -> bool:
+        """Return `True` if user `uid` can read file `ino`."""
+        return self._is_allowed(ino, uid, stat.S_IRUSR, stat.S_IROTH)
+
+    def can_write(self, ino: Inode, uid: int) -> bool:
+        """Return `True` if user `uid` can write to file `ino`."""
+        return self._is_allowed(ino, uid, stat.S_IWUSR, stat.S_IWOTH)
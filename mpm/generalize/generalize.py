@@ -18,11 +18,12 @@ import re
 from pathlib import PurePosixPath
 from fs2json.db import DatabaseRead
 from mpm.config import GENERALIZE_PROC
+from mpm.fhs import load_fhs_rules
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from mpm.tree import NpmTree
-from collections.abc import Iterable
+from collections.abc import Iterable, Sequence
 
 
 def generalize_proc(path: str) -> str:
@@ -60,7 +61,7 @@ def generalize_nonexistent(path: str, db: DatabaseRead):
 
 
 def generalize_from_fhs_rules(
-    rules_path: str,
+    rules_path: str | Sequence[str],
     tree: NpmTree,
     medusa_domain_groups: Iterable[Iterable[tuple[tuple]]],
 ) -> None:
@@ -81,7 +82,8 @@ def generalize_from_fhs_rules(
     `generalize_from_fhs_rules` can use different rules for every
     generalization, but ideally, one rule list should be used.
 
-    :param rules_path: path to the rules file.
+    :param rules_path: path to the rules file or paths to multiple rule files
+    that are applied in the given order.
     :param tree: tree that the generalization will be applied to.
     :param medusa_domains: domains that will be used as subjects for the newly
     created rules.
@@ -91,7 +93,6 @@ def generalize_from_fhs_rules(
         for d in medusa_domains:
             access_info.append((d[-1][1], d))
 
-    with open(rules_path) as f:
-        rules = tree.load_fhs_config(f)
-    for rule in rules:
-        tree.generalize_fhs_rule(rule, access_info)
+    if isinstance(rules_path, str):
+        rules_path = [rules_path]
+    tree.generalize_fhs_rules(load_fhs_rules(*rules_path), access_info)
@@ -0,0 +1,210 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Grouping of similar strings (paths).
+
+This is a replacement of `string_grouper.group_similar_strings` that doesn't
+need pandas. Strings are compared the same way, by cosine similarity of TF-IDF
+weighted character n-grams, and groups are connected components of strings
+whose similarity reaches the threshold.
+
+Small inputs (the usual size of a group of paths) are compared in Python.
+Instead of multiplying the whole TF-IDF matrix, candidate pairs are found using
+an inverted index of rare n-grams (prefix filtering). Only a prefix of every
+vector is indexed, such that two strings with similarity at least
+`min_similarity` always share an indexed n-gram. Candidates are then compared
+exactly. Large inputs are multiplied as sparse matrices in blocks of rows,
+which is as fast as string_grouper. Both ways are exact, so the result doesn't
+depend on randomness or on the size of the input.
+"""
+
+from collections import Counter, defaultdict
+from collections.abc import Sequence
+from math import log, sqrt
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from unicodedata import normalize
+import numpy as np
+import re
+
+NGRAM_SIZE = 3
+
+_IGNORED_CHARACTERS = re.compile(r'[,-./]|\s')
+"""Characters removed before n-grams are created (same as in
+string_grouper)."""
+
+_EPSILON = 1e-9
+
+SPARSE_MIN_STRINGS = 50
+"""Inputs with at least this many strings are grouped with sparse matrices."""
+
+_BLOCK_ROWS = 2000
+"""Number of rows of the TF-IDF matrix multiplied at once, it limits the size
+of the (sparse) similarity matrix in memory."""
+
+
+def ngrams(s: str, ignore_case: bool = True) -> Counter[str]:
+    """Return counts of character n-grams of `s`."""
+    if ignore_case:
+        s = s.lower()
+    s = normalize('NFKD', s).encode('ASCII', 'ignore').decode()
+    s = _IGNORED_CHARACTERS.sub('', s)
+    return Counter(s[i : i + NGRAM_SIZE] for i in range(len(s) - NGRAM_SIZE + 1))
+
+
+def _tf_idf_vectors(
+    strings: Sequence[str], ignore_case: bool
+) -> tuple[list[dict[str, float]], Counter[str]]:
+    """Return L2-normalized TF-IDF vectors of `strings` and document
+    frequencies of n-grams."""
+    counts = [ngrams(s, ignore_case) for s in strings]
+    df = Counter(g for c in counts for g in c)
+    n = len(strings)
+    # Smoothed idf, the same as sklearn's `TfidfVectorizer`
+    idf = {g: log((1 + n) / (1 + d)) + 1 for g, d in df.items()}
+    vectors = []
+    for c in counts:
+        v = {g: tf * idf[g] for g, tf in c.items()}
+        if norm := sqrt(sum(w * w for w in v.values())):
+            v = {g: w / norm for g, w in v.items()}
+        vectors.append(v)
+    return vectors, df
+
+
+def _cosine(u: dict[str, float], v: dict[str, float]) -> float:
+    return sum([u[g] * v[g] for g in u.keys() & v.keys()])
+
+
+class _DisjointSet:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x: int, y: int) -> None:
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            # Smaller index is the representative
+            if y < x:
+                x, y = y, x
+            self.parent[y] = x
+
+
+def group_similar_strings(
+    strings: Sequence[str],
+    min_similarity: float = 0.8,
+    ignore_case: bool = True,
+) -> list[list[str]]:
+    """Group strings that are similar.
+
+    Two strings are in the same group if there is a chain of strings between
+    them, where every two adjacent strings have cosine similarity at least
+    `min_similarity`.
+
+    :returns: List of groups. Strings in a group and groups themselves are in
+    the same order as in `strings` (groups are ordered by their first string).
+    """
+    vectors, df = _tf_idf_vectors(strings, ignore_case)
+    if len(strings) >= SPARSE_MIN_STRINGS:
+        labels = _sparse_components(vectors, min_similarity)
+    else:
+        labels = _indexed_components(vectors, df, min_similarity)
+
+    ret: dict[int, list[str]] = {}
+    for label, s in zip(labels, strings):
+        ret.setdefault(label, []).append(s)
+    return list(ret.values())
+
+
+def _indexed_components(
+    vectors: list[dict[str, float]],
+    df: Counter[str],
+    min_similarity: float,
+) -> list[int]:
+    """Return component label of every vector, similar vectors are found with
+    an inverted index of their rare n-grams."""
+    groups = _DisjointSet(len(vectors))
+
+    # Index n-grams of a vector starting with the rare ones until the norm of
+    # the rest is lower than sqrt(min_similarity). Similarity of two strings
+    # that share only unindexed n-grams is then lower than `min_similarity`.
+    index: defaultdict[str, list[int]] = defaultdict(list)
+    prefixes: list[frozenset[str]] = []
+    for i, v in enumerate(vectors):
+        remaining = sum(w * w for w in v.values())
+        prefix = []
+        for g in sorted(v, key=lambda g: (df[g], g)):
+            if remaining < min_similarity - _EPSILON:
+                break
+            index[g].append(i)
+            prefix.append(g)
+            remaining -= v[g] * v[g]
+        prefixes.append(frozenset(prefix))
+
+    for i, v in enumerate(vectors):
+        # Strings that share an n-gram with `v`, which is indexed for them
+        candidates = set()
+        for g in v:
+            candidates.update(index.get(g, ()))
+        candidates.discard(i)
+        root = groups.find(i)
+        for j in candidates:
+            if j < i and not prefixes[i].isdisjoint(vectors[j]):
+                # `j` shares an n-gram indexed for `v` and it was already
+                # compared with `v`
+                continue
+            if root == groups.find(j):
+                continue
+            if _cosine(v, vectors[j]) >= min_similarity - _EPSILON:
+                groups.union(i, j)
+                root = groups.find(i)
+
+    return [groups.find(i) for i in range(len(vectors))]
+
+
+def _sparse_components(
+    vectors: list[dict[str, float]], min_similarity: float
+) -> np.ndarray:
+    """Return component label of every vector, similarities of all pairs are
+    computed by multiplication of sparse matrices."""
+    columns: dict[str, int] = {}
+    indices = [columns.setdefault(g, len(columns)) for v in vectors for g in v]
+    indptr = np.cumsum([0] + [len(v) for v in vectors])
+    data = [w for v in vectors for w in v.values()]
+    m = csr_matrix(
+        (data, indices, indptr), shape=(len(vectors), len(columns))
+    )
+    mt = m.T.tocsr()
+
+    # Adjacency matrix of similar strings, built from blocks of rows
+    rows = []
+    cols = []
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        similarity = (m[start : start + _BLOCK_ROWS] @ mt).tocoo()
+        similar = similarity.data >= min_similarity - _EPSILON
+        rows.append(similarity.row[similar] + start)
+        cols.append(similarity.col[similar])
+    n = len(vectors)
+    rows = np.concatenate(rows)
+    graph = csr_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, np.concatenate(cols))),
+        shape=(n, n),
+    )
+    return connected_components(graph, directed=False)[1]
@@ -9,110 +9,119 @@ Author: Ilya Stepanov <code at ilyastepanov.com>
 
 
 import sys
-import re
+from array import array
 from os.path import commonprefix
-from collections.abc import Iterable
+from collections.abc import Iterable, Sequence
+from re import escape
 
 END_OF_STRING = 1_000_000_000
 
+ROOT = 0
+"""Index of the root node."""
 
-class SuffixTreeNode:
+NO_NODE = -1
+
+_NODE_BITS = 32
+_NODE_MASK = (1 << _NODE_BITS) - 1
+
+
+def _terminator(string_index: int) -> int:
+    """Return unique end-of-string symbol of string `string_index`.
+
+    Characters are stored as their code points, so negative numbers can't
+    collide with them.
     """
-    Suffix tree node class. Actually, it also respresents a tree edge that points to this node.
+    return -1 - string_index
+
+
+class SuffixTree:
     """
+    Generalized suffix tree
 
-    new_identifier = 0
+    Nodes are indices into parallel arrays. A node also represents the edge
+    that points to it: the edge label is `text[start[node]:end[node]]`. Edges
+    of all nodes are stored in a single dictionary keyed by the first symbol of
+    the edge and the parent node, see `_edge_key`.
+    """
 
-    def __init__(self, start=0, end=END_OF_STRING):
-        self.identifier = SuffixTreeNode.new_identifier
-        SuffixTreeNode.new_identifier += 1
+    def __init__(self):
+        # all strings are concatenated together as code points, every string
+        # is followed by its unique terminator. Tree's nodes store only indices
+        self.text = array('q')
 
+        # edge info: start index and end index
+        self.start = array('q', [0])
+        self.end = array('q', [END_OF_STRING])
+        self.parent = array('q', [NO_NODE])
         # suffix link is required by Ukkonen's algorithm
-        self.suffix_link = None
+        self.suffix_link = array('q', [NO_NODE])
+        # index of the string to which a leaf belongs, `NO_NODE` for inner
+        # nodes
+        self.string_index = array('q', [NO_NODE])
 
-        # child edges/nodes, each dict key represents the first letter of an edge
-        self.edges = {}
+        # child edges of all nodes, see `_edge_key`
+        self.edges: dict[int, int] = {}
+
+        # number of strings stored by this tree
+        self.strings_count = 0
 
-        # stores reference to parent
-        self.parent = None
+        # list of tree leaves
+        self.leaves = array('q')
 
-        # bit vector shows to which strings this node belongs
-        self.bit_vector = 0
+    @staticmethod
+    def _edge_key(node: int, symbol: int) -> int:
+        return symbol << _NODE_BITS | node
 
-        # edge info: start index and end index
-        self.start = start
-        self.end = end
+    def __len__(self) -> int:
+        """Return number of nodes."""
+        return len(self.start)
 
-    def add_child(self, key, start, end):
+    def _add_node(self, parent: int, start: int, end: int) -> int:
         """
         Create a new child node
-        Agrs:
-            key: a char that will be used during active edge searching
+        Args:
+            parent: parent node
             start, end: node's edge start and end indices
         Returns:
             created child node
         """
-        child = SuffixTreeNode(start=start, end=end)
-        child.parent = self
-        self.edges[key] = child
-        return child
-
-    def add_exisiting_node_as_child(self, key, node):
+        node = len(self.start)
+        self.start.append(start)
+        self.end.append(end)
+        self.parent.append(parent)
+        self.suffix_link.append(NO_NODE)
+        self.string_index.append(NO_NODE)
+        self.edges[self._edge_key(parent, self.text[start])] = node
+        return node
+
+    def _edge_length(self, node: int, current_index: int) -> int:
         """
-        Add an existing node as a child
+        Get length of an edge that points to `node`
         Args:
-            key: a char that will be used during active edge searching
-            node: a node that will be added as a child
+            current_index: index of current processing symbol (usefull for leaf
+            nodes that have "infinity" end index)
         """
-        node.parent = self
-        self.edges[key] = node
+        return min(self.end[node], current_index + 1) - self.start[node]
 
-    def get_edge_length(self, current_index):
-        """
-        Get length of an edge that points to this node
-        Args:
-            current_index: index of current processing symbol (usefull for leaf nodes that have "infinity" end index)
-        """
-        return min(self.end, current_index + 1) - self.start
-
-    def __str__(self):
-        return 'id=' + str(self.identifier)
-
-
-class SuffixTree:
-    """
-    Generalized suffix tree
-    """
-
-    def __init__(self):
-        # the root node
-        self.root = SuffixTreeNode()
-
-        # all strings are concatenaited together. Tree's nodes stores only indices
-        self.input_string = ''
-
-        # number of strings stored by this tree
-        self.strings_count = 0
-
-        # list of tree leaves
-        self.leaves = []
-
-    def append_string(self, input_string):
+    def append_string(self, input_string: str) -> None:
         """
         Add new string to the suffix tree
         """
-        start_index = len(self.input_string)
+        text = self.text
+        start = self.start
+        suffix_link = self.suffix_link
+        edges = self.edges
+
+        start_index = len(text)
         current_string_index = self.strings_count
 
         # each sting should have a unique ending
-        input_string += '$' + str(current_string_index)
-
-        # gathering 'em all together
-        self.input_string += input_string
+        text.extend(map(ord, input_string))
+        text.append(_terminator(current_string_index))
         self.strings_count += 1
 
         # these 3 variables represents current "active point"
-        active_node = self.root
+        active_node = ROOT
         active_edge = 0
         active_length = 0
 
@@ -123,182 +132,208 @@ class SuffixTree:
         new_leaves = []
 
         # main circle
-        for index in range(start_index, len(self.input_string)):
-            previous_node = None
+        for index in range(start_index, len(text)):
+            previous_node = NO_NODE
             remainder += 1
             while remainder > 0:
                 if active_length == 0:
                     active_edge = index
 
-                if self.input_string[active_edge] not in active_node.edges:
-                    # no edge starting with current char, so creating a new leaf node
-                    leaf_node = active_node.add_child(
-                        self.input_string[active_edge], index, END_OF_STRING
-                    )
-
-                    # a leaf node will always be leaf node belonging to only one string
-                    # (because each string has different termination)
-                    leaf_node.bit_vector = 1 << current_string_index
+                next_node = edges.get(
+                    self._edge_key(active_node, text[active_edge])
+                )
+                if next_node is None:
+                    # no edge starting with current char, so creating a new
+                    # leaf node
+                    leaf_node = self._add_node(active_node, index, END_OF_STRING)
+
+                    # a leaf node will always be leaf node belonging to only
+                    # one string (because each string has different
+                    # termination)
+                    self.string_index[leaf_node] = current_string_index
                     new_leaves.append(leaf_node)
 
                     # doing suffix link magic
-                    if previous_node is not None:
-                        previous_node.suffix_link = active_node
+                    if previous_node != NO_NODE:
+                        suffix_link[previous_node] = active_node
                     previous_node = active_node
                 else:
                     # ok, we've got an active edge
-                    next_node = active_node.edges[
-                        self.input_string[active_edge]
-                    ]
 
-                    # walking down through edges (if active_length is bigger than edge length)
-                    next_edge_length = next_node.get_edge_length(index)
-                    if active_length >= next_node.get_edge_length(index):
+                    # walking down through edges (if active_length is bigger
+                    # than edge length)
+                    next_edge_length = self._edge_length(next_node, index)
+                    if active_length >= next_edge_length:
                         active_edge += next_edge_length
                         active_length -= next_edge_length
                         active_node = next_node
                         continue
 
-                    # current edge already contains the suffix we need to insert.
-                    # Increase the active_length and go forward
-                    if (
-                        self.input_string[next_node.start + active_length]
-                        == self.input_string[index]
-                    ):
+                    # current edge already contains the suffix we need to
+                    # insert. Increase the active_length and go forward
+                    if text[start[next_node] + active_length] == text[index]:
                         active_length += 1
-                        if previous_node is not None:
-                            previous_node.suffix_link = active_node
+                        if previous_node != NO_NODE:
+                            suffix_link[previous_node] = active_node
                         previous_node = active_node
                         break
 
                     # splitting edge
-                    split_node = active_node.add_child(
-                        self.input_string[active_edge],
-                        next_node.start,
-                        next_node.start + active_length,
+                    split_node = self._add_node(
+                        active_node,
+                        start[next_node],
+                        start[next_node] + active_length,
                     )
-                    next_node.start += active_length
-                    split_node.add_exisiting_node_as_child(
-                        self.input_string[next_node.start], next_node
-                    )
-                    leaf_node = split_node.add_child(
-                        self.input_string[index], index, END_OF_STRING
-                    )
-                    leaf_node.bit_vector = 1 << current_string_index
+                    start[next_node] += active_length
+                    self.parent[next_node] = split_node
+                    edges[
+                        self._edge_key(split_node, text[start[next_node]])
+                    ] = next_node
+                    leaf_node = self._add_node(split_node, index, END_OF_STRING)
+                    self.string_index[leaf_node] = current_string_index
                     new_leaves.append(leaf_node)
 
                     # suffix link magic again
-                    if previous_node is not None:
-                        previous_node.suffix_link = split_node
+                    if previous_node != NO_NODE:
+                        suffix_link[previous_node] = split_node
                     previous_node = split_node
 
                 remainder -= 1
 
                 # follow suffix link (if exists) or go to root
-                if active_node == self.root and active_length > 0:
+                if active_node == ROOT and active_length > 0:
                     active_length -= 1
                     active_edge = index - remainder + 1
                 else:
                     active_node = (
-                        active_node.suffix_link
-                        if active_node.suffix_link is not None
-                        else self.root
+                        suffix_link[active_node]
+                        if suffix_link[active_node] != NO_NODE
+                        else ROOT
                     )
 
         # update leaves ends from "infinity" to actual string end
         for leaf in new_leaves:
-            leaf.end = len(self.input_string)
+            self.end[leaf] = len(text)
         self.leaves.extend(new_leaves)
 
-    def find_longest_common_substrings(self):
-        """
-        Search longest common substrings in the tree by locating lowest common ancestors what belong to all strings
+    def _leaf_depth(self, leaf: int, depth: list[int]) -> int:
+        """Return length of the path label of `leaf` (with its terminator)."""
+        return depth[self.parent[leaf]] + self.end[leaf] - self.start[leaf]
+
+    def find_longest_common_substrings(self) -> list[str]:
         """
+        Search longest common substrings in the tree by locating the deepest
+        nodes that belong to all strings
 
-        # all bits are set
-        success_bit_vector = 2**self.strings_count - 1
+        String depth (length of the path label) of every inner node is computed
+        on the way down and bit vectors of strings are propagated from leaves to
+        the root in a single pass over the inner nodes in post-order. Labels are
+        then sliced from the text without walking up to the root.
 
-        lowest_common_ancestors = []
+        :returns: Longest common substrings ordered by their first occurrence
+        in the first string or `['']` if there is no common substring.
+        """
+        start = self.start
+        end = self.end
+        parent = self.parent
+        string_index = self.string_index
+
+        # Leaves are handled separately, they are the majority of nodes
+        children: list[list[int]] = [[] for _ in range(len(self))]
+        leaves: list[list[int]] = [[] for _ in range(len(self))]
+        for node in range(1, len(self)):
+            if string_index[node] == NO_NODE:
+                children[parent[node]].append(node)
+            else:
+                leaves[parent[node]].append(node)
+
+        # Inner nodes in preorder and lengths of their path labels
+        order = []
+        depth = [0] * len(self)
+        stack = [ROOT]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            d = depth[node]
+            for child in children[node]:
+                depth[child] = d + end[child] - start[child]
+            stack.extend(children[node])
 
-        # going up to the root
+        # all bits are set
+        success_bit_vector = (1 << self.strings_count) - 1
+        # bit vector shows to which strings a node belongs
+        bit_vector = [0] * len(self)
         for leaf in self.leaves:
-            node = leaf
-            while node.parent is not None:
-                if node.bit_vector != success_bit_vector:
-                    # updating parent's bit vector
-                    node.parent.bit_vector |= node.bit_vector
-                    node = node.parent
-                else:
-                    # hey, we've found a lowest common ancestor!
-                    lowest_common_ancestors.append(node)
-                    break
+            bit_vector[parent[leaf]] |= 1 << string_index[leaf]
 
-        longest_common_substrings = ['']
         longest_length = 0
+        longest_nodes = []
+        if self.strings_count == 1:
+            # Only leaves of a single string belong to all strings. Their labels
+            # end with the terminator.
+            for leaf in self.leaves:
+                if (length := self._leaf_depth(leaf, depth) - 1) > longest_length:
+                    longest_length = length
+                    longest_nodes = [leaf]
+
+        order.reverse()
+        # Root is the last node and it's not a substring
+        order.pop()
+        for node in order:
+            bits = bit_vector[node]
+            bit_vector[parent[node]] |= bits
+            if bits != success_bit_vector:
+                continue
+            if depth[node] > longest_length:
+                longest_length = depth[node]
+                longest_nodes = [node]
+            elif depth[node] == longest_length:
+                longest_nodes.append(node)
+
+        if not longest_nodes:
+            return ['']
+
+        # Suffixes of leaves of a node start with the label of the node. Longest
+        # nodes don't contain each other, so their subtrees are walked only
+        # once.
+        def first_suffix(node: int) -> int:
+            """Return start of the first suffix that passes through `node`."""
+            if string_index[node] != NO_NODE:
+                return end[node] - self._leaf_depth(node, depth)
+            ret = END_OF_STRING
+            stack = [node]
+            while stack:
+                n = stack.pop()
+                for leaf in leaves[n]:
+                    ret = min(ret, end[leaf] - self._leaf_depth(leaf, depth))
+                stack.extend(children[n])
+            return ret
+
+        # Labels of the nodes are sliced from their first occurrences
+        first = sorted(first_suffix(node) for node in longest_nodes)
+        return [
+            ''.join(map(chr, self.text[f : f + longest_length])) for f in first
+        ]
+
+    def _edge_label(self, node: int) -> str:
+        return ''.join(
+            chr(s) if s >= 0 else '$' + str(_terminator(s))
+            for s in self.text[self.start[node] : self.end[node]]
+        )
 
-        # need to filter the result array and get the longest common strings
-        for common_ancestor in lowest_common_ancestors:
-            common_substring = ''
-            node = common_ancestor
-            while node.parent is not None:
-                label = self.input_string[node.start : node.end]
-                common_substring = label + common_substring
-                node = node.parent
-            # remove unique endings ($<number>), we don't need them anymore
-            common_substring = re.sub(r'(.*?)\$?\d*$', r'\1', common_substring)
-            if len(common_substring) > longest_length:
-                longest_length = len(common_substring)
-                longest_common_substrings = [common_substring]
-            elif (
-                len(common_substring) == longest_length
-                and common_substring not in longest_common_substrings
-            ):
-                longest_common_substrings.append(common_substring)
-
-        return longest_common_substrings
-
-    def to_graphviz(self, node=None, output=''):
+    def to_graphviz(self) -> str:
         """
         Show the tree as graphviz string. For debugging purposes only
         """
-        if node is None:
-            node = self.root
-            output = 'digraph G {edge [arrowsize=0.4,fontsize=10];'
-
-        output += (
-            str(node.identifier)
-            + '[label="'
-            + str(node.identifier)
-            + '\\n'
-            + '{0:b}'.format(node.bit_vector).zfill(self.strings_count)
-            + '"'
-        )
-        if node.bit_vector == 2**self.strings_count - 1:
-            output += ',style="filled",fillcolor="red"'
-        output += '];'
-        if node.suffix_link is not None:
-            output += (
-                str(node.identifier)
-                + '->'
-                + str(node.suffix_link.identifier)
-                + '[style="dashed"];'
-            )
-
-        for child in node.edges.values():
-            label = self.input_string[child.start : child.end]
-            output += (
-                str(node.identifier)
-                + '->'
-                + str(child.identifier)
-                + '[label="'
-                + label
-                + '"];'
-            )
-            output = self.to_graphviz(child, output)
-
-        if node == self.root:
-            output += '}'
-
+        output = 'digraph G {edge [arrowsize=0.4,fontsize=10];'
+        for node in range(len(self)):
+            output += f'{node}[label="{node}"];'
+            if self.suffix_link[node] != NO_NODE:
+                output += f'{node}->{self.suffix_link[node]}[style="dashed"];'
+        for key, child in self.edges.items():
+            label = self._edge_label(child)
+            output += f'{key & _NODE_MASK}->{child}[label="{label}"];'
+        output += '}'
         return output
 
     def __str__(self):
@@ -310,11 +345,23 @@ def commonpostfix(l: Iterable[str]):
     return commonprefix(l)[::-1]
 
 
-def prefix_postfix_regexp(l: Iterable[str]):
+def common_affixes(l: Sequence[str]) -> tuple[str, str]:
+    """Return common prefix and common postfix of strings in `l` that don't
+    overlap in any string."""
     prefix = commonprefix(l)
     postfix = commonpostfix(l)
+    # Length of the shortest string without the prefix
+    shortest = min(len(s) for s in l) - len(prefix)
+    return prefix, postfix[max(len(postfix) - shortest, 0) :]
+
+
+def prefix_postfix_regexp(l: Sequence[str]):
+    """Return regexp that keeps the common prefix, the common postfix and the
+    longest common substring of the rest of strings in `l` and replaces
+    everything else by `.*?`."""
+    prefix, postfix = common_affixes(l)
 
-    new_l = [s.removeprefix(prefix).removesuffix(postfix) for s in l]
+    new_l = [s[len(prefix) : len(s) - len(postfix)] for s in l]
 
     suffix_tree = SuffixTree()
 
@@ -326,4 +373,6 @@ def prefix_postfix_regexp(l: Iterable[str]):
             f'WARNING, multiple longest common substrings found: {lcs}',
             file=sys.stderr,
         )
-    return prefix + '.*?' + lcs[0] + '.*?' + postfix
+    if not lcs[0]:
+        return escape(prefix) + '.*?' + escape(postfix)
+    return escape(prefix) + '.*?' + escape(lcs[0]) + '.*?' + escape(postfix)
@@ -14,49 +14,15 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from fs2json.db import DatabaseRead
-from mpm.tree import NpmTree
+from mpm.tree import Access, NpmNode, NpmTree
 from treelib import Node
-from itertools import groupby, chain
-from functools import reduce
-from operator import xor
-from string_grouper import group_similar_strings
-from pandas import DataFrame
-from diff_match_patch import diff_match_patch as DiffMatchPatch
-from collections.abc import Iterable
-from re import escape, fullmatch
-from collections import Counter
-from copy import deepcopy, copy
+from itertools import groupby
+from re import escape
+from collections import defaultdict
+from collections.abc import Iterable, Mapping, Sequence
 from mpm.config import MULTIPLE_RUNS_STRATEGY, MultipleRunsSingleton
-import sys
-from mpm.generalize.lcs import prefix_postfix_regexp
-
-
-def regex_from_diff(diff: Iterable[tuple[int, str]]) -> str:
-    """Convert diff provided by diff_match_patch into regexp."""
-    regex = ''
-    modifications = []
-    for op, change in diff:
-        match op:
-            case DiffMatchPatch.DIFF_EQUAL:
-                if modifications:
-                    # TODO: Regexp can be improved by including character types,
-                    # string lengths, but make sure to take into account the law
-                    # of dominishing returns
-                    regex += r'.*?'
-                    modifications.clear()
-                regex += escape(change)
-            case DiffMatchPatch.DIFF_INSERT:
-                modifications.append((op, change))
-            case DiffMatchPatch.DIFF_DELETE:
-                modifications.append((op, change))
-    if modifications:
-        # TODO: Regexp can be improved by including character types,
-        # string lengths, but make sure to take into account the law
-        # of dominishing returns
-        regex += r'.*?'
-        # Not needed as returning from the function anyway
-        # modifications.clear()
-    return regex
+from mpm.generalize.grouping import group_similar_strings
+from mpm.generalize.template import template_regexp
 
 
 def _get_numeric_regexp(name: str) -> str:
@@ -85,47 +51,61 @@ def _get_numeric_regexp(name: str) -> str:
     return ret
 
 
-def construct_regex_and_delete_originals(
-    all_paths, paths, regex_tree, reg, verbose=False
-):
-    # 1. Get original accesses and delete them from original tree
-    accesses: set[Access] = set()
-    for row in all_paths:
-        node = None
-        for tree in paths:
-            try:
-                node = tree[row.path]
-            except KeyError:
-                print(f"couldn't find {row.path}")
-                continue
-            if node is None:
-                raise RuntimeError(f'Unexpected: {row.path} not in the tree.')
-            accesses.update(node.data)
+def _unique_paths(trees: Sequence[NpmTree]) -> dict[str, Node]:
+    """Return accessed paths that are present in exactly one of `trees`.
 
-            # Clearing original accesses without additional processing is not a
-            # good idea. This leaves a node without any permissions, causing the
-            # decision algorithm to deny any access to that node. Correct
-            # solution would be to remove the whole node altogether, but also
-            # remove that same node from other trees.
-            #
-            # As this would be more complicated to implement, an easier solution
-            # is here: just don't remove the original accesses. When accessing
-            # this file, the original access will be used and for any other
-            # access, the regexp will be used. So ot removing the access won't
-            # break anything.
-            # node.data.clear()
-            break
+    All trees are walked at once like a single trie: children of nodes with the
+    same path are merged by their tags. Every merged node has a bitmask of runs
+    (trees) in which it was accessed, only paths with a single bit set are
+    returned.
 
-    # print(f'{accesses=} for {control.path}')
-    if verbose:
-        print('Generated multiple runs regexp:', reg)
+    :returns: Dictionary that maps unique path to the node in its tree.
+    """
+    ret = {}
+    # Path and nodes of all trees with that path as `(run, node)` tuples
+    stack = [('', [(run, tree.npm_root) for run, tree in enumerate(trees)])]
+    while stack:
+        path, nodes = stack.pop()
+        mask = 0
+        children: defaultdict[str, list[tuple[int, Node]]] = defaultdict(list)
+        for run, node in nodes:
+            if node.data is not None:
+                mask |= 1 << run
+            tree = trees[run]
+            for nid in node.successors(tree.identifier):
+                child = tree[nid]
+                children[child.tag].append((run, child))
+        if mask and not mask & (mask - 1):
+            owner = mask.bit_length() - 1
+            ret[path] = next(node for run, node in nodes if run == owner)
+        stack.extend((path + '/' + tag, c) for tag, c in children.items())
+    return ret
 
-    # 2. Construct a new path with regex
-    node = regex_tree.add_path_generalization(reg)
 
-    # 3. Add access to the new node
-    for access in accesses:
-        node.data.add_access(access)
+def _gather_accesses(
+    all_paths: Iterable[str], nodes: Mapping[str, Node]
+) -> set[Access]:
+    """Return union of accesses of `all_paths`.
+
+    :param nodes: Maps unique paths to their nodes, see `_unique_paths`.
+    """
+    accesses: set[Access] = set()
+    for path in all_paths:
+        accesses.update(nodes[path].data)
+
+        # Clearing original accesses without additional processing is not a
+        # good idea. This leaves a node without any permissions, causing the
+        # decision algorithm to deny any access to that node. Correct
+        # solution would be to remove the whole node altogether, but also
+        # remove that same node from other trees.
+        #
+        # As this would be more complicated to implement, an easier solution
+        # is here: just don't remove the original accesses. When accessing
+        # this file, the original access will be used and for any other
+        # access, the regexp will be used. So ot removing the access won't
+        # break anything.
+        # node.data.clear()
+    return accesses
 
 
 def generalize_mupltiple_runs(db: DatabaseRead, *trees: NpmTree) -> NpmTree:
@@ -136,153 +116,107 @@ def generalize_mupltiple_runs(db: DatabaseRead, *trees: NpmTree) -> NpmTree:
 
     :returns: `Tree` with generalized accesses (containing regexed paths).
     """
-    paths: list[dict[str, Node]] = []
-    uniq_paths: list[set[str]] = []
-    dmp = DiffMatchPatch()
-
-    # Get list of paths that were accessed
-    for tree in trees:
-        paths.append(p := tree.get_accessed_paths())
-
-    # Construct a list of paths that are unique across all trees
-    # see https://stackoverflow.com/questions/48674775/how-to-add-multiple-sets-in-python-but-only-if-items-are-unique
-    uniq_paths_ = [
-        k
-        for k, count in Counter(chain.from_iterable(paths)).items()
-        if count == 1
-    ]
-    uniq_paths_ = list(reduce(xor, (p.keys() for p in paths)))
+    # Paths that are unique across all trees
+    uniq_paths = _unique_paths(trees)
+    uniq_paths_ = list(uniq_paths)
 
     regex_tree = NpmTree()
+    # Regexps and accesses of paths they cover
+    generalizations: list[tuple[str, set[Access]]] = []
 
     # Create preliminary groups based on number of path components
-    uniq_paths_.sort(key=lambda x: x.count('/'))
+    uniq_paths_.sort(key=lambda x: (x.count('/'), x))
     for key, group in groupby(uniq_paths_, lambda x: x.count('/')):
-        uniq_paths_series = DataFrame(group, columns=['path'])
-
         # Similarity was experimentally deduced:
         # 0.5 was too high
         # 0.45 was too high
         # 0.425 was all right
 
         # Analyse similar paths
-        uniq_paths_series[["group-id", "name_deduped"]] = group_similar_strings(
-            uniq_paths_series['path'],
+        groups = group_similar_strings(
+            list(group),
             ignore_case=False,
             min_similarity=0.425,
         )
-        uniq_paths_series.sort_values(
-            by=[
-                'group-id',
-            ],
-            inplace=True,
-        )
 
-        # print(uniq_paths_series)
-
-        groups = uniq_paths_series.groupby('group-id')
-
-        for name, group in groups:
-            # `control` is the "group leader" row of a DataFrame and `others`
-            # are rows that belong to this group
-            all_paths = list(group.itertuples())
+        for all_paths in groups:
             if len(all_paths) == 1:
                 # We can't search for difference with just one string
                 match MULTIPLE_RUNS_STRATEGY:
                     case MultipleRunsSingleton.NUMERICAL_GENERALIZATION:
-                        reg = _get_numeric_regexp(all_paths[0].path)
-                        construct_regex_and_delete_originals(
-                            all_paths, paths, regex_tree, reg, True
-                        )
+                        reg = _get_numeric_regexp(all_paths[0])
                     case MultipleRunsSingleton.FULL_GENERALIZATION:
                         reg = '.*'
-                        construct_regex_and_delete_originals(
-                            all_paths, paths, regex_tree, reg, True
-                        )
-                continue
-            # TODO: mY recommends to construct diff for all pairs, not just
-            # `control` with paths from `others`.
-            control, *others = all_paths
-            # TOOD: make `regexps` a set
-            regexps = []
-            # print(f'{control.path=}')
-            for row in others:
-                diff = dmp.diff_main(control.path, row.path)
-                dmp.diff_cleanupSemantic(diff)
-                regexp = regex_from_diff(diff)
-                # print(row.path, ':', regexp)
-                regexps.append(regexp)
-            # print('-' * 80)
-
-            # Choose the best one (the one that matches all paths from the
-            # group)
-            # TODO: with the least number of stars
-            if len(others) > 1:
-                for reg in regexps:
-                    # Don't need to check `control` as it was used to construct
-                    # the regex
-                    if all(fullmatch(reg, row.path) for row in others):
-                        break
-                else:
-                    print(
-                        "Regexp that covers all paths doesn't exist. Using alternative regexp generator.",
-                        file=sys.stderr,
-                    )
-                    reg = prefix_postfix_regexp([row.path for row in all_paths])
-                    # This is just sanity check, but who knows.
-                    if not all(fullmatch(reg, row.path) for row in all_paths):
-                        raise RuntimeError(
-                            "Regexp that covers all paths doesn't exist."
-                        )
+                    case MultipleRunsSingleton.NO_ACTION:
+                        continue
             else:
-                try:
-                    reg = regexps[0]
-                except IndexError:
-                    breakpoint()
-
-            construct_regex_and_delete_originals(
-                all_paths, paths, regex_tree, reg, True
+                # One regexp that covers all paths of the group
+                reg = template_regexp(all_paths)
+            print('Generated multiple runs regexp:', reg)
+            generalizations.append(
+                (reg, _gather_accesses(all_paths, uniq_paths))
             )
 
         # print('=' * 80)
+
+    # Construct new paths with regexps and add accesses to them
+    nodes = regex_tree.add_path_generalizations(
+        reg for reg, _ in generalizations
+    )
+    for node, (_, accesses) in zip(nodes, generalizations):
+        for access in accesses:
+            node.data.add_access(access)
     # regex_tree.show()
     return regex_tree
 
 
-def _check_tree(new_tree: NpmTree, new_node: Node, tree: NpmTree, node: Node):
-    """Merge `tree` into `new_tree`."""
-    children_nids = node.successors(tree.identifier)
-    new_children_nids = new_node.successors(new_tree.identifier)
-    new_children_tag_to_node = {
-        new_tree.get_node(n).tag: new_tree.get_node(n)
-        for n in new_children_nids
-    }
-    for child_nid in children_nids:
-        child = tree.get_node(child_nid)
-        if child.tag in new_children_tag_to_node:
-            # This directory is already present in the new tree, no need to move
-            # anything
-            #
-            # Move permissions from child to new_child_node.
-            new_child_node = new_children_tag_to_node[child.tag]
-            if new_child_node.data is None and child.data is not None:
-                # Original node was empty, just copy the `NpmNode`.
-                new_child_node.data = copy(child.data)
-            elif new_child_node.data is not None and child.data is not None:
-                # Original node has some accesses, merge the new one into it.
-                assert new_child_node.data.is_regexp == child.data.is_regexp
-                new_child_node.data.merge(child.data)
+def _merge_data(data: Iterable[NpmNode | None]) -> NpmNode | None:
+    """Merge `NpmNode`s of nodes with the same path from multiple trees.
+
+    Attributes are taken from the first `NpmNode`, accesses of the others are
+    merged into it. `Access` objects are shared with the original trees.
+    """
+    ret = None
+    for d in data:
+        if d is None:
+            continue
+        if ret is None:
+            ret = NpmNode(d)
+            ret.generalized = set(d.generalized)
+            ret.is_regexp = d.is_regexp
+            ret.is_recursive = d.is_recursive
         else:
-            # Copy `child` to the `new_tree` at the same position
-            new_child_node = deepcopy(child)
-            new_tree.add_node(new_child_node, new_node)
-        _check_tree(new_tree, new_child_node, tree, child)
+            assert ret.is_regexp == d.is_regexp
+            ret.merge(d)
+    return ret
 
 
 def merge_tree(*trees: NpmTree) -> NpmTree:
+    """Merge `trees` into a new tree.
+
+    All trees are walked at once. Children of nodes with the same path are
+    merged by their tags and every merged node is created only once. Children
+    keep the order in which they appear in `trees`.
+    """
     # TODO: Implement cleaning function that removes excess nodes that are
     # covered by regexes
     new_tree = NpmTree()
-    for tree in trees:
-        _check_tree(new_tree, new_tree.npm_root, tree, tree.npm_root)
+    # Node of the new tree and nodes of all trees with the same path
+    stack = [(new_tree.npm_root, [(tree, tree.npm_root) for tree in trees])]
+    while stack:
+        new_node, nodes = stack.pop()
+        children: dict[str, list[tuple[NpmTree, Node]]] = {}
+        for tree, node in nodes:
+            for nid in node.successors(tree.identifier):
+                child = tree[nid]
+                children.setdefault(child.tag, []).append((tree, child))
+        for tag, same in children.items():
+            new_child = new_tree.create_node(
+                tag,
+                # Keep identifier of the first node, as if it was copied
+                same[0][1].identifier,
+                parent=new_node.identifier,
+                data=_merge_data(child.data for _, child in same),
+            )
+            stack.append((new_child, same))
     return new_tree
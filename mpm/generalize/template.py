@@ -0,0 +1,114 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Inference of a regexp template that covers a group of similar paths.
+
+Paths are aligned by their components. Every component is split into tokens:
+runs of digits, runs of letters and single other characters. If all paths have
+tokens of the same classes in the same order, tokens are aligned as columns. A
+column with the same token everywhere stays literal and a column of digits
+becomes `\\d+`. A column of letters keeps the common prefix and postfix of its
+tokens and only the rest becomes `[^\\W\\d_]+`, so `postconf` and `postsuper`
+become `post[^\\W\\d_]+`.
+
+Components whose tokens only partly match are generalized by
+`prefix_postfix_regexp`: the common prefix, the common postfix and the longest
+common substring of the rest are kept and everything in between is replaced by
+`.*?`.
+
+Every string is tokenized once and the longest common substring is found by a
+suffix tree, so the whole template is constructed in near-linear time. The
+result always fully matches all input paths.
+"""
+
+from collections.abc import Sequence
+from re import DOTALL, compile, escape
+from mpm.generalize.lcs import common_affixes, prefix_postfix_regexp
+
+_TOKEN = compile(r'\d+|[^\W\d_]+|.', DOTALL)
+
+DIGITS = 'd'
+LETTERS = 'a'
+
+CLASS_REGEXPS = {DIGITS: r'\d+', LETTERS: r'[^\W\d_]+'}
+"""Regexps of columns with different tokens of the same class."""
+
+
+def tokenize(s: str) -> list[str]:
+    """Split `s` into runs of digits, runs of letters and other characters."""
+    return _TOKEN.findall(s)
+
+
+def _token_class(token: str) -> str:
+    if token[0].isdecimal():
+        return DIGITS
+    if token[0].isalpha():
+        return LETTERS
+    # Other characters have to be the same in the whole column
+    return token
+
+
+def _letters_regexp(column: Sequence[str]) -> str:
+    """Return regexp of different runs of letters that keeps their common
+    prefix and postfix."""
+    prefix, postfix = common_affixes(column)
+    if any(len(token) == len(prefix) + len(postfix) for token in column):
+        # One of the tokens is just the prefix and the postfix
+        middle = r'[^\W\d_]*'
+    else:
+        middle = CLASS_REGEXPS[LETTERS]
+    return escape(prefix) + middle + escape(postfix)
+
+
+def _columns_regexp(tokens: Sequence[Sequence[str]]) -> str:
+    """Return regexp of tokens with the same shape aligned as columns."""
+    regexp = ''
+    for column in zip(*tokens):
+        first = column[0]
+        if all(token == first for token in column):
+            regexp += escape(first)
+        elif _token_class(first) == LETTERS:
+            regexp += _letters_regexp(column)
+        else:
+            regexp += CLASS_REGEXPS[_token_class(first)]
+    return regexp
+
+
+def component_regexp(components: Sequence[str]) -> str:
+    """Return regexp that fully matches every string in `components`."""
+    first = components[0]
+    if all(c == first for c in components):
+        return escape(first)
+
+    tokens = [tokenize(c) for c in components]
+    shapes = [[_token_class(token) for token in t] for t in tokens]
+    if all(shape == shapes[0] for shape in shapes):
+        return _columns_regexp(tokens)
+    return prefix_postfix_regexp(components)
+
+
+def template_regexp(paths: Sequence[str]) -> str:
+    """Return regexp that fully matches every path from `paths`.
+
+    :param paths: Non-empty sequence of paths with the same number of path
+    components.
+    :raises ValueError: If paths have different number of components.
+    """
+    components = [p.split('/') for p in paths]
+    if any(len(c) != len(components[0]) for c in components):
+        raise ValueError(
+            'Paths have different number of components: ' + ', '.join(paths)
+        )
+    return '/'.join(component_regexp(column) for column in zip(*components))
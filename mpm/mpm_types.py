@@ -53,7 +53,7 @@ AuditEntry = namedtuple(
 )
 
 FHSConfigRule = namedtuple(
-    'FHSConfgRule',
+    'FHSConfigRule',
     [
         'path',
         'permissions',
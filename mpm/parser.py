@@ -23,6 +23,7 @@ from pprint import pprint
 from treelib import Tree
 from mpm.tree import DomainTree
 from mpm.mpm_types import PathAccess, AuditLogRaw, AuditEntry
+from mpm.profiling import timed
 from typing import DefaultDict, TypeVar, Any, Iterable, Mapping
 
 
@@ -46,6 +47,7 @@ def search_field(
     return None
 
 
+@timed('create_log_entries', items=len)
 def create_log_entries(l: Iterable[AuditLogRaw]) -> list[AuditEntry]:
     """Filter and compress audit entries in the form of `AuditLogRaw` tuples
     into `AuditEntry` tuples
@@ -87,6 +89,7 @@ def initialize_exec_history(
             return exec_histories[pid]
 
 
+@timed('assign_permissions', items=len)
 def assign_permissions(
     entries: list[dict],
     exec_history_tree: DomainTree,
@@ -352,6 +355,7 @@ def get_fields(l: str) -> dict:
     return ret
 
 
+@timed('parse', items=len)
 def parse(path: str) -> list[dict]:
     """Return parsed audit entries as a key-value directory. Entries have the
     same order as in the audit log.
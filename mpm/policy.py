@@ -16,9 +16,16 @@
 from mpm.tree import NpmTree, Access, Permission
 from collections import UserDict, defaultdict
 from itertools import count
+from functools import cache
 from pprint import pprint
-from typing import DefaultDict, Any
-from mpm.generalize.generalize import generalize_proc
+from typing import DefaultDict, Any, TextIO
+from collections.abc import Hashable, Iterator
+from difflib import unified_diff
+from mpm.config import GENERALIZE_PROC
+from mpm import profiling
+from mpm.profiling import timed
+import re
+import sys
 
 STANDARD_TREES = """tree "fs" clone of file by getfile getfile.filename;
 primary tree "fs";
@@ -27,6 +34,9 @@ tree "domain" of process;
 
 DEFAULT_DOMAIN = "domain/init"
 
+_PID = re.compile('[0-9]+')
+"""PID in `/proc/<pid>` paths, see `collect_spaces`."""
+
 STANDARD_SPACES = f"""space all_domains = recursive "domain";
 primary space init = "{DEFAULT_DOMAIN}";
 space all_files = recursive "/";
@@ -104,6 +114,8 @@ class Domain(UserDict):
 def make_unique(name: str, s: dict) -> str:
     """If `name` is in `s`, return a slightly modified version of `name` that is
     not in `s`. Otherwise return `name`.
+
+    See `NameAllocator` for allocating many names with the same base.
     """
     original_name = name
     c = count()
@@ -112,10 +124,41 @@ def make_unique(name: str, s: dict) -> str:
     return name
 
 
+class NameAllocator:
+    """Allocate unique names, the same way as `make_unique`.
+
+    Names are never released, so the first free suffix of a base name can only
+    grow. It is remembered for every base name and the search for the next name
+    starts there instead of at 0.
+    """
+
+    def __init__(self):
+        self.names: set[str] = set()
+        self._next_suffix: dict[str, int] = {}
+
+    def allocate(self, name: str) -> str:
+        """Return `name` or `name` with the smallest numeric suffix that wasn't
+        allocated yet and allocate it."""
+        if name in self.names:
+            suffix = self._next_suffix.get(name, 0)
+            while (unique := name + str(suffix)) in self.names:
+                suffix += 1
+            self._next_suffix[name] = suffix + 1
+            name = unique
+        self.names.add(name)
+        return name
+
+
+@cache
+def _sanitize(name: str) -> str:
+    """Remove spaces and replace slashes, so `name` can be used in a space
+    name."""
+    return name.replace(" ", "").replace('/', '_')
+
+
 def get_access_name(access: Access) -> str:
     """Create a descriptive name for access."""
-    # TODO: replace in one pass
-    domain = access.domain[-1][0].replace(" ", "").replace('/', '_')
+    domain = _sanitize(access.domain[-1][0])
     return f'{domain}{access.uid}_{access.permissions.short_repr()}'
 
 
@@ -129,125 +172,523 @@ def space_name_from_exec_history(exec_history: tuple[str, ...]) -> str:
         # executed by the init process or some other proces for which we don't
         # have more information. Use the default domain for this subject.
         return f'"{DEFAULT_DOMAIN}"'
-    return ''.join(exec_history).replace(" ", "").replace('/', '_')
+    return _sanitize(''.join(exec_history))
 
 
+@cache
 def space_name_from_domain(domain: tuple[tuple, ...]) -> str:
     if not domain:
         # `domain` is an empty tuple. This means that this exec was executed by
         # the init process or some other proces for which we don't have more
         # information. Use the default domain for this subject.
         return f'"{DEFAULT_DOMAIN}"'
-    return (
-        ''.join((f'{filename}{euid}' for filename, euid in domain))
-        .replace(" ", "")
-        .replace('/', '_')
-    )
+    return _sanitize(''.join((f'{filename}{euid}' for filename, euid in domain)))
+
+
+def _domain_transition_handler(
+    transition: tuple[tuple, str, Any], new_domain: tuple
+) -> str | None:
+    """Return handler of a single domain transition or `None` if the
+    transition is not supported."""
+    match transition:
+        case (old_domain, 'exec', exec_file):
+            domain = space_name_from_domain(old_domain)
+            return fexec_handler(
+                domain, exec_file, space_name_from_domain(new_domain)
+            )
+        case (old_domain, 'setresuid', new_euid):
+            domain = space_name_from_domain(old_domain)
+            return setresuid_handler(
+                domain,
+                f'setresuid.euid == {new_euid}',
+                space_name_from_domain(new_domain),
+            )
+    return None
+
+
+def _domain_transition_handlers(
+    domain_transition: dict[tuple[tuple, str, Any], tuple]
+) -> Iterator[str]:
+    # pprint(domain_transition)
+
+    for k, new_domain in domain_transition.items():
+        if (handler := _domain_transition_handler(k, new_domain)) is not None:
+            yield handler
 
 
 def domain_transition_handlers(
     domain_transition: dict[tuple[tuple, str, Any], tuple]
 ) -> str:
-    config = ''
+    return ''.join(_domain_transition_handlers(domain_transition))
 
-    # pprint(domain_transition)
 
-    for k, new_domain in domain_transition.items():
-        match k:
-            case (old_domain, 'exec', exec_file):
-                domain = space_name_from_domain(old_domain)
-                config += fexec_handler(
-                    domain, exec_file, space_name_from_domain(new_domain)
-                )
-            case (old_domain, 'setresuid', new_euid):
-                domain = space_name_from_domain(old_domain)
-                config += setresuid_handler(
-                    domain,
-                    f'setresuid.euid == {new_euid}',
-                    space_name_from_domain(new_domain),
-                )
-
-    return config
+def collect_spaces(t: NpmTree) -> dict[Access, dict[str, bool]]:
+    """Return paths accessed by every `Access` in tree `t`.
 
+    These paths are members of virtual spaces. The tree is walked once
+    depth-first and paths are built on the way down. Common paths are
+    generalized the same way as by `generalize_proc`: PIDs of paths under
+    `/proc/<pid>/` are replaced by a regexp. Every path is included in a space
+    only once.
 
-def create_constable_policy(
-    t: NpmTree, domain_transition: dict[tuple[tuple, str, Any], tuple]
-) -> str:
+    :returns: Dictionary that maps `Access` to paths (keys of the inner
+    dictionary in the order of their first occurrence). Values of the inner
+    dictionary are `True` for recursive members (paths of recursive nodes).
+    """
     # This dictionary contains all paths accessed (values) for a given Access
-    # type (this will be used to create virtual spaces)
-    spaces: DefaultDict[Access, list[str]] = defaultdict(list)
-    for n in t.all_nodes_itr():
-        if n.data is None:
+    # type (this will be used to create virtual spaces). Note that `Access` is
+    # grouped (hashed) by permissions, uid and domain
+    spaces: DefaultDict[Access, dict[str, bool]] = defaultdict(dict)
+    # Node, its path and the path used as a prefix for its children
+    stack = [(t.npm_root, '', '')]
+    while stack:
+        node, path, prefix = stack.pop()
+        if (data := node.data) is not None:
+            recursive = data.is_recursive
+            for access in data:
+                members = spaces[access]
+                members[path] = members.get(path, False) or recursive
+            # Direct child nodes of generalized nodes are removed later by
+            # `minimize_spaces`
+            for access in data.generalized:
+                spaces[access].setdefault(prefix + '/.*', False)
+        children = node.successors(t.identifier)
+        for nid in reversed(children):
+            child = t[nid]
+            child_path = prefix + '/' + child.tag
+            child_prefix = child_path
+            if (
+                GENERALIZE_PROC
+                and prefix == '/proc'
+                and _PID.fullmatch(child.tag)
+            ):
+                # Generalize common paths
+                child_prefix = '/proc/' + _PID.pattern
+            stack.append((child, child_path, child_prefix))
+    return spaces
+
+
+def _is_subsumed(
+    path: str,
+    recursive: bool,
+    recursives: set[str],
+    markers: set[str],
+    stars: set[str],
+) -> bool:
+    """Return `True` if member `path` of a space is already matched by another
+    member of the same space.
+
+    :param recursives: Paths of recursive members of the space.
+    :param markers: Paths of directories with a recursive `<directory>/.*`
+    member (recursive marker), which matches everything under the directory.
+    :param stars: Paths of directories with a `<directory>/.*` member.
+    """
+    if not recursive and path in recursives:
+        return True
+    parent, _, name = path.rpartition('/')
+    if not recursive and name != '.*' and parent in stars:
+        return True
+    if recursive and name == '.*':
+        # Recursive marker of `parent`, only members above it can match it
+        if parent in recursives:
+            return True
+        parent = parent.rpartition('/')[0]
+    while parent:
+        if parent in recursives or parent in markers:
+            return True
+        parent = parent.rpartition('/')[0]
+    return False
+
+
+def _minimize_members(members: dict[str, bool]) -> dict[str, bool]:
+    """Return `members` of one space without the redundant ones, see
+    `minimize_spaces`."""
+    recursives = set()
+    markers = set()
+    for path, recursive in members.items():
+        if not recursive:
             continue
-        path = t.get_path(n)
-        # Create a list of paths or each `Access`. Note that `Access` is grouped
-        # (hashed) by permissions, uid and domain
-        for access in n.data:
-            spaces[access].append(path)
-        # TODO: direct child nodes of generalized nodes should not be included
-        # in the final output policy
-        if n.data.generalized:
-            for access in n.data.generalized:
-                spaces[access].append(path + '/.*')
-
-    config = (
-        STANDARD_TREES
-        + STANDARD_SPACES
-        + STANDARD_ACCESSES
-        + LOG_FUNCTION
-        + GETPROCESS
-        + PEXEC_DEBUG
-        + INIT_FUNCTION
-    )
-
-    # pprint(spaces)
-
-    # Assign file paths to virtual spaces.
-    spaces_names: dict[str, Access] = {}  # name to Access
-    for s, v in spaces.items():
-        name = get_uniq_acess_name(s, spaces_names)
-        spaces_names[name] = s
-
-        config += f'space {name} = '
-        for i, path in enumerate(v):
-            if i != 0:
-                config += ' +\n    '
-            # Generalize common paths
-            path = generalize_proc(path)
-            config += f'"{path}"'
-        config += ';\n'
-
-    config += '\n'
-
-    # Create domains and set permissions
+        if path.endswith('/.*'):
+            markers.add(path[:-3])
+        else:
+            recursives.add(path)
+    stars = {
+        path[:-3]
+        for path, recursive in members.items()
+        if not recursive and path.endswith('/.*')
+    }
+    return {
+        path: recursive
+        for path, recursive in members.items()
+        if not _is_subsumed(path, recursive, recursives, markers, stars)
+    }
+
+
+def minimize_spaces(
+    spaces: dict[Access, dict[str, bool]], verbose: bool = False
+) -> list[tuple[dict[str, bool], list[Access]]]:
+    """Remove redundant members of spaces and merge identical spaces.
+
+    A member is removed if there is a recursive member for one of its parent
+    directories or for the same path, if one of its parent directories has a
+    recursive marker (a recursive `<directory>/.*` member, see
+    `NpmTree.get_recursive_marker`), or if it's a direct child of a directory
+    with a `<directory>/.*` member. Spaces (of different accesses) with the
+    same members are then merged into one.
+
+    :param spaces: Spaces returned by `collect_spaces`.
+    :param verbose: Print numbers of spaces and members before and after the
+    minimization to stderr.
+    :returns: List of spaces, every space is a tuple of its members and
+    accesses that use it.
+    """
+    merged: dict[frozenset, tuple[dict[str, bool], list[Access]]] = {}
+    for access, members in spaces.items():
+        members = _minimize_members(members)
+        key = frozenset(members.items())
+        if key in merged:
+            merged[key][1].append(access)
+        else:
+            merged[key] = (members, [access])
+
+    ret = list(merged.values())
+    if verbose:
+        before = sum(len(members) for members in spaces.values())
+        after = sum(len(members) for members, _ in ret)
+        print(
+            f'Policy spaces: {len(spaces)} -> {len(ret)}, '
+            f'members: {before} -> {after}',
+            file=sys.stderr,
+        )
+    return ret
+
+
+def _space_groups(
+    t: NpmTree, minimize: bool, verbose: bool
+) -> list[tuple[dict[str, bool], list[Access]]]:
+    """Return spaces of tree `t` in the format of `minimize_spaces`."""
+    spaces = collect_spaces(t)
+    if minimize:
+        return minimize_spaces(spaces, verbose)
+    return [(members, [access]) for access, members in spaces.items()]
+
+
+def _name_spaces(
+    groups: list[tuple[dict[str, bool], list[Access]]],
+    names: NameAllocator,
+    previous: dict[Access, str] | None = None,
+) -> dict[str, tuple[dict[str, bool], list[Access]]]:
+    """Assign names to spaces.
+
+    :param names: Allocator of new names.
+    :param previous: Names of spaces from the previous emission. A space gets
+    the previous name of one of its accesses if it's not already used by
+    another space.
+    :returns: Dictionary that maps names to spaces.
+    """
+    if previous is None:
+        previous = {}
+    named = {}
+    for members, accesses in groups:
+        for access in accesses:
+            name = previous.get(access)
+            if name is not None and name not in named:
+                break
+        else:
+            name = names.allocate(get_access_name(accesses[0]))
+        named[name] = (members, accesses)
+    return named
+
+
+def _space_definition(name: str, members: dict[str, bool]) -> Iterator[str]:
+    yield f'space {name} = '
+    for i, (path, recursive) in enumerate(members.items()):
+        if i != 0:
+            yield ' +\n    '
+        if recursive:
+            yield 'recursive '
+        yield f'"{path}"'
+    yield ';\n'
+
+
+def _policy_domains(
+    spaces_names: dict[str, tuple[dict[str, bool], list[Access]]]
+) -> dict[tuple, Domain]:
+    """Create domains and set their permissions to named spaces."""
     # Group accesses based on name and uid with tuple (comm, uid)
     domains: DefaultDict[tuple, Domain] = defaultdict(Domain)
-    for space, access in spaces_names.items():
-        domain = access.domain
-        for permission in access.permissions:
-            domains[domain][permission].add(space)
-            # HACK: Since we "ignore" the SEE permission, we need to add
-            # everything from READ and WRITE to this set.
-            domains[domain][Permission.SEE].add(space)
-
-    for domain_history, domain in domains.items():
-        domain_name = space_name_from_domain(domain_history)
-        config += f'primary space {domain_name} = "domain/{domain_name}";\n'
-        space_name_in_config = f'{domain_name} '
-        config += space_name_in_config
-        # On the first row we don't need a comma
-        ending_comma = ''
-        for i, permission in enumerate(Permission):
-            if not (permission_set := domain[permission]):
-                # This permission type is empty, nothing to include
-                continue
-            config += ending_comma + permission.name + ' '
-            config += ', '.join(permission_set)
-            ending_comma = ',\n' + ' ' * len(space_name_in_config)
-        # Finish the domain permission block here
-        config += ';\n'
+    for space, (_, accesses) in spaces_names.items():
+        for access in accesses:
+            domain = access.domain
+            for permission in access.permissions:
+                domains[domain][permission].add(space)
+                # HACK: Since we "ignore" the SEE permission, we need to add
+                # everything from READ and WRITE to this set.
+                domains[domain][Permission.SEE].add(space)
+    return domains
+
+
+def _domain_block(domain_history: tuple, domain: Domain) -> Iterator[str]:
+    domain_name = space_name_from_domain(domain_history)
+    yield f'primary space {domain_name} = "domain/{domain_name}";\n'
+    space_name_in_config = f'{domain_name} '
+    yield space_name_in_config
+    # On the first row we don't need a comma
+    ending_comma = ''
+    for permission in Permission:
+        if not (permission_set := domain[permission]):
+            # This permission type is empty, nothing to include
+            continue
+        yield ending_comma + permission.name + ' '
+        # Sorted, so unchanged domains are always emitted the same way
+        yield ', '.join(sorted(permission_set))
+        ending_comma = ',\n' + ' ' * len(space_name_in_config)
+    # Finish the domain permission block here
+    yield ';\n'
+
+
+def _policy_header() -> Iterator[str]:
+    yield STANDARD_TREES
+    yield STANDARD_SPACES
+    yield STANDARD_ACCESSES
+    yield LOG_FUNCTION
+    yield GETPROCESS
+    yield PEXEC_DEBUG
+    yield INIT_FUNCTION
+
+
+def constable_policy_chunks(
+    t: NpmTree,
+    domain_transition: dict[tuple[tuple, str, Any], tuple],
+    minimize: bool = True,
+    verbose: bool = False,
+) -> Iterator[str]:
+    """Generate Constable policy for tree `t` in chunks.
+
+    Chunks are small (a path, a keyword...), so the policy can be written to a
+    file without keeping the whole policy in memory. See
+    `create_constable_policy`.
+
+    :param minimize: Remove redundant members and merge identical spaces, see
+    `minimize_spaces`.
+    :param verbose: Report results of the minimization.
+    """
+    groups = _space_groups(t, minimize, verbose)
+
+    yield from _policy_header()
+
+    # Assign file paths to virtual spaces.
+    spaces_names = _name_spaces(groups, NameAllocator())
+    for name, (members, _) in spaces_names.items():
+        yield from _space_definition(name, members)
+
+    yield '\n'
+
+    for domain_history, domain in _policy_domains(spaces_names).items():
+        yield from _domain_block(domain_history, domain)
 
     # Create domain transition handlers
-    config += '\n' + domain_transition_handlers(domain_transition)
+    yield '\n'
+    yield from _domain_transition_handlers(domain_transition)
+
+
+@timed('create_constable_policy')
+def create_constable_policy(
+    t: NpmTree,
+    domain_transition: dict[tuple[tuple, str, Any], tuple],
+    out: TextIO | None = None,
+    minimize: bool = True,
+    verbose: bool = False,
+) -> str | None:
+    """Create Constable policy for tree `t`.
+
+    :param out: If set, the policy is written to this file-like object as it is
+    generated and `None` is returned. Otherwise the whole policy is returned as
+    a string.
+    :param minimize: See `constable_policy_chunks`.
+    :param verbose: See `constable_policy_chunks`.
+    """
+    chunks = constable_policy_chunks(t, domain_transition, minimize, verbose)
+    if out is None:
+        return ''.join(chunks)
+    out.writelines(chunks)
+    return None
+
+
+class IncrementalPolicy:
+    """Constable policy that is regenerated after the tree changes.
+
+    Every `update` collects spaces of the tree again (one walk of the tree).
+    Accesses whose members changed since the previous emission are dirty,
+    only their spaces are minimized again. Space definitions, domain blocks
+    and transition handlers are generated again only if the data they are
+    generated from changed, otherwise the previous text is reused. Spaces keep
+    their names between emissions (as long as they are used by the same
+    accesses), so unchanged parts of the policy stay the same.
+
+    Output of `update` only adds or replaces parts of the policy. If accesses
+    or domain transitions can disappear from the tree, deploy the diff from
+    `patch` instead.
+    """
 
-    return config
+    def __init__(self, minimize: bool = True):
+        self.minimize = minimize
+        self._updated = False
+        self._names = NameAllocator()
+        # Name of the space of every access from the previous emission
+        self._space_names: dict[Access, str] = {}
+        # Collected members of every access and its space (key of the space
+        # and its minimized members) from the previous emission
+        self._members: dict[Access, dict[str, bool]] = {}
+        self._groups: dict[Access, tuple[Hashable, dict[str, bool]]] = {}
+        # Emitted parts of the policy together with the data they were
+        # generated from
+        self._spaces: dict[str, tuple[Hashable, str]] = {}
+        self._domains: dict[str, tuple[tuple, str]] = {}
+        self._handlers: dict[tuple[tuple, str, Any], tuple[tuple, str]] = {}
+
+    @property
+    def policy(self) -> str:
+        """The last full policy, empty before the first `update`."""
+        if not self._updated:
+            return ''
+        return ''.join(
+            [
+                *_policy_header(),
+                *(text for _, text in self._spaces.values()),
+                '\n',
+                *(text for _, text in self._domains.values()),
+                '\n',
+                *(text for _, text in self._handlers.values()),
+            ]
+        )
+
+    def _collect_groups(
+        self, t: NpmTree, verbose: bool
+    ) -> dict[Hashable, tuple[dict[str, bool], list[Access]]]:
+        """Return spaces of tree `t` like `_space_groups` by their keys, only
+        spaces of dirty accesses are minimized again."""
+        spaces = collect_spaces(t)
+        groups: dict[Hashable, tuple[dict[str, bool], list[Access]]] = {}
+        accesses_groups = {}
+        dirty = 0
+        for access, members in spaces.items():
+            if self._members.get(access) == members:
+                key, space = self._groups[access]
+            else:
+                dirty += 1
+                if self.minimize:
+                    space = _minimize_members(members)
+                    key = frozenset(space.items())
+                else:
+                    # Spaces aren't merged
+                    space = members
+                    key = access
+            accesses_groups[access] = (key, space)
+            if key in groups:
+                groups[key][1].append(access)
+            else:
+                groups[key] = (space, [access])
+        profiling.count('dirty policy accesses', dirty)
+        if verbose:
+            print(
+                f'Policy spaces: {len(spaces)} -> {len(groups)}, '
+                f'dirty accesses: {dirty}',
+                file=sys.stderr,
+            )
+        self._members = spaces
+        self._groups = accesses_groups
+        return groups
+
+    @timed('IncrementalPolicy.update')
+    def update(
+        self,
+        t: NpmTree,
+        domain_transition: dict[tuple[tuple, str, Any], tuple],
+        verbose: bool = False,
+    ) -> str:
+        """Regenerate the policy for tree `t`.
+
+        :returns: Space definitions, domain blocks and domain transition
+        handlers that are new or changed since the previous call. Parts of the
+        policy that were removed since the previous call are not included,
+        use `patch` to get them too.
+        """
+        groups = self._collect_groups(t, verbose)
+        spaces_names = _name_spaces(
+            list(groups.values()), self._names, self._space_names
+        )
+        changes = []
+
+        spaces = {}
+        for key, (name, (members, _)) in zip(groups, spaces_names.items()):
+            previous = self._spaces.get(name)
+            if previous is not None and (
+                previous[0] is key or previous[0] == key
+            ):
+                spaces[name] = previous
+                continue
+            text = ''.join(_space_definition(name, members))
+            spaces[name] = (key, text)
+            profiling.count('regenerated policy spaces')
+            if previous is None or previous[1] != text:
+                changes.append(text)
+
+        domains = {}
+        for history, domain in _policy_domains(spaces_names).items():
+            name = space_name_from_domain(history)
+            key = tuple(frozenset(domain[p]) for p in Permission)
+            previous = self._domains.get(name)
+            if previous is not None and previous[0] == key:
+                domains[name] = previous
+                continue
+            text = ''.join(_domain_block(history, domain))
+            domains[name] = (key, text)
+            profiling.count('regenerated policy domains')
+            changes.append(text)
+
+        handlers = {}
+        for k, new_domain in domain_transition.items():
+            previous = self._handlers.get(k)
+            if previous is not None and previous[0] == new_domain:
+                handlers[k] = previous
+                continue
+            handler = _domain_transition_handler(k, new_domain)
+            if handler is not None:
+                handlers[k] = (new_domain, handler)
+                changes.append(handler)
+
+        self._space_names = {
+            access: name
+            for name, (_, accesses) in spaces_names.items()
+            for access in accesses
+        }
+        self._spaces = spaces
+        self._domains = domains
+        self._handlers = handlers
+        self._updated = True
+        return ''.join(changes)
+
+    def patch(
+        self,
+        t: NpmTree,
+        domain_transition: dict[tuple[tuple, str, Any], tuple],
+        filename: str = 'policy',
+        verbose: bool = False,
+    ) -> str:
+        """Regenerate the policy like `update` and return a unified diff
+        against the previous policy. Unlike the output of `update`, the diff
+        also contains removed parts of the policy.
+
+        :param filename: Name of the policy file used in the diff header.
+        """
+        old = self.policy
+        self.update(t, domain_transition, verbose)
+        return ''.join(
+            unified_diff(
+                old.splitlines(keepends=True),
+                self.policy.splitlines(keepends=True),
+                filename,
+                filename,
+            )
+        )
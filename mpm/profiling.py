@@ -0,0 +1,199 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Named timers and counters of the pipeline.
+
+Stages of the pipeline are measured with `timer` or `timed`. Every timer
+records the number of calls, wall time and the number of processed items. Time
+of a timer includes time of timers nested in it. Counters count events that
+are not timed.
+
+Profiling is disabled by default and timers don't measure anything until
+`enable` is called. Worker processes of the pool send their measurements to
+the main process, see `take` and `merge`.
+"""
+
+from collections import Counter
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import wraps
+from pathlib import Path
+import json
+import resource
+import time
+
+_enabled = False
+_start = 0.0
+
+
+@dataclass
+class Timing:
+    """Measurements of one timer."""
+
+    calls: int = 0
+    items: int = 0
+    seconds: float = 0.0
+
+
+timers: dict[str, Timing] = {}
+"""Timings by names of their timers."""
+
+counters: Counter[str] = Counter()
+
+
+def enable() -> None:
+    """Start profiling, previous measurements are discarded."""
+    global _enabled, _start
+    _enabled = True
+    _start = time.perf_counter()
+    timers.clear()
+    counters.clear()
+
+
+def disable() -> None:
+    """Stop profiling, measurements are kept."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class _Measurement:
+    """Items processed by one call of a timer."""
+
+    __slots__ = ('items',)
+
+    def __init__(self):
+        self.items = 0
+
+
+@contextmanager
+def timer(name: str) -> Iterator[_Measurement]:
+    """Measure the block as a call of timer `name`.
+
+    The block can set or increment `items` of the yielded object to the number
+    of processed items.
+    """
+    measurement = _Measurement()
+    if not _enabled:
+        yield measurement
+        return
+    start = time.perf_counter()
+    try:
+        yield measurement
+    finally:
+        if (timing := timers.get(name)) is None:
+            timing = timers[name] = Timing()
+        timing.calls += 1
+        timing.items += measurement.items
+        timing.seconds += time.perf_counter() - start
+
+
+def timed(name: str, items: Callable[[object], int] | None = None):
+    """Decorator that measures every call of the function with timer `name`.
+
+    :param items: Function that returns the number of processed items from the
+    return value, e.g. `len`.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            with timer(name) as measurement:
+                ret = f(*args, **kwargs)
+                if items is not None:
+                    measurement.items = items(ret)
+                return ret
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, n: int = 1) -> None:
+    """Increment counter `name` by `n`."""
+    if _enabled:
+        counters[name] += n
+
+
+def take() -> tuple[dict[str, Timing], Counter[str]] | None:
+    """Return measurements of this process and reset them, `None` if profiling
+    is disabled."""
+    if not _enabled:
+        return None
+    ret = (dict(timers), Counter(counters))
+    timers.clear()
+    counters.clear()
+    return ret
+
+
+def merge(
+    measurements: tuple[dict[str, Timing], Counter[str]] | None
+) -> None:
+    """Add `measurements` returned by `take` in another process."""
+    if measurements is None or not _enabled:
+        return
+    other_timers, other_counters = measurements
+    for name, other in other_timers.items():
+        if (timing := timers.get(name)) is None:
+            timing = timers[name] = Timing()
+        timing.calls += other.calls
+        timing.items += other.items
+        timing.seconds += other.seconds
+    counters.update(other_counters)
+
+
+def report() -> dict:
+    """Return measurements together with the total wall time and peak resident
+    set size (in KiB) of this process and of its terminated worker
+    processes."""
+    return {
+        'wall_time': time.perf_counter() - _start,
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_rss_children': resource.getrusage(
+            resource.RUSAGE_CHILDREN
+        ).ru_maxrss,
+        'timers': {name: asdict(timing) for name, timing in timers.items()},
+        'counters': dict(counters),
+    }
+
+
+def write_report(result_dir: Path) -> None:
+    """Write `profile.json` and `profile.csv` with the report into
+    `result_dir`."""
+    data = report()
+    result_dir.mkdir(parents=True, exist_ok=True)
+    with open(result_dir / 'profile.json', 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+    with open(result_dir / 'profile.csv', 'w') as f:
+        f.write('kind,name,calls,items,seconds,kib\n')
+        f.write(f'total,wall_time,,,{data["wall_time"]:.6f},\n')
+        for name in ('peak_rss', 'peak_rss_children'):
+            f.write(f'memory,{name},,,,{data[name]}\n')
+        for name, timing in sorted(
+            timers.items(), key=lambda x: x[1].seconds, reverse=True
+        ):
+            f.write(
+                f'timer,{name},{timing.calls},{timing.items},'
+                f'{timing.seconds:.6f},\n'
+            )
+        for name, value in sorted(counters.items()):
+            f.write(f'counter,{name},,{value},,\n')
@@ -0,0 +1,229 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Tuned database session used during the evaluation.
+
+The evaluation sends a lot of small queries and inserts to the database.
+`DatabaseSession` wraps a `DatabaseRead` or `DatabaseWriter` and configures
+its connection for this workload: WAL journal, big page cache, memory-mapped
+I/O and temporary tables in memory. Scratch sessions also turn off
+synchronization with the disk, the database can be corrupted by a power loss,
+but not by a crash of the program.
+
+Writes of a whole evaluation case are grouped in one transaction with
+`transaction`. Time spent in every type of query can be measured, see
+`QueryStats`.
+"""
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import ContextManager, TextIO
+import sqlite3
+import sys
+import time
+
+CACHE_SIZE = -256 * 1024
+"""Size of the page cache, negative values are in KiB."""
+
+MMAP_SIZE = 1024**3
+"""Maximal size of the memory-mapped part of the database in bytes."""
+
+
+def configure_connection(
+    con: sqlite3.Connection, scratch: bool = False, write: bool = True
+) -> None:
+    """Set pragmas of `con` for the evaluation.
+
+    :param scratch: Don't wait for writes to reach the disk. The database
+    survives a crash of the program, but not a crash of the system.
+    :param write: Switch the database to the WAL journal. WAL is stored in the
+    database file, so connections that only read the database don't need to
+    set it.
+    """
+    if write:
+        if con.in_transaction:
+            # Journal mode can't be changed inside a transaction
+            con.commit()
+        con.execute('PRAGMA journal_mode = WAL')
+    con.execute(f'PRAGMA synchronous = {"OFF" if scratch else "NORMAL"}')
+    con.execute(f'PRAGMA cache_size = {CACHE_SIZE}')
+    con.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+    con.execute('PRAGMA temp_store = MEMORY')
+
+
+@dataclass
+class QueryTiming:
+    """Time spent in one type of query."""
+
+    calls: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+
+
+class QueryStats(dict[str, QueryTiming]):
+    """Timing of queries by their SQL statement (with normalized
+    whitespace)."""
+
+    def add(
+        self, sql: str, seconds: float, rows: int = 0, call: bool = True
+    ) -> None:
+        """Add a call of `sql` (or just fetched rows if `call` is `False`)."""
+        if (timing := self.get(sql)) is None:
+            timing = self[sql] = QueryTiming()
+        timing.calls += call
+        timing.rows += rows
+        timing.seconds += seconds
+
+    def print(self, file: TextIO = sys.stderr, width: int = 72) -> None:
+        """Print timing of queries, the slowest first."""
+        print('Database queries:', file=file)
+        for sql, timing in sorted(
+            self.items(), key=lambda x: x[1].seconds, reverse=True
+        ):
+            print(
+                f'{timing.seconds:10.3f}s {timing.calls:8} calls'
+                f' {timing.rows:10} rows  {sql[:width]}',
+                file=file,
+            )
+
+
+class TimedCursor:
+    """Cursor that measures time of its queries.
+
+    Time of fetching rows is added to the last executed statement.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor, stats: QueryStats):
+        self.cursor = cursor
+        self.stats = stats
+        self._sql = ''
+
+    def __getattr__(self, name):
+        if name == 'cursor':
+            raise AttributeError(name)
+        return getattr(self.cursor, name)
+
+    def _timed(self, sql: str, method, *args) -> 'TimedCursor':
+        self._sql = ' '.join(sql.split())
+        start = time.perf_counter()
+        try:
+            method(sql, *args)
+        finally:
+            rowcount = max(self.cursor.rowcount, 0)
+            self.stats.add(self._sql, time.perf_counter() - start, rowcount)
+        return self
+
+    def execute(self, sql: str, parameters=()) -> 'TimedCursor':
+        return self._timed(sql, self.cursor.execute, parameters)
+
+    def executemany(self, sql: str, parameters) -> 'TimedCursor':
+        return self._timed(sql, self.cursor.executemany, parameters)
+
+    def executescript(self, script: str) -> 'TimedCursor':
+        return self._timed(script, self.cursor.executescript)
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        ret = method(*args)
+        rows = len(ret) if isinstance(ret, list) else int(ret is not None)
+        self.stats.add(self._sql, time.perf_counter() - start, rows, False)
+        return ret
+
+    def fetchone(self):
+        return self._fetch(self.cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self.cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(self.cursor.fetchall)
+
+    def __iter__(self):
+        while (row := self.fetchone()) is not None:
+            yield row
+
+
+class DatabaseSession:
+    """Database with a tuned connection, see `configure_connection`.
+
+    Methods that are not implemented here are forwarded to the wrapped
+    database, so the session can be used everywhere a `DatabaseRead` or
+    `DatabaseWriter` is expected.
+    """
+
+    def __init__(
+        self,
+        db,
+        scratch: bool = False,
+        write: bool = True,
+        timing: bool = False,
+    ):
+        """
+        :param db: `DatabaseRead` or `DatabaseWriter`.
+        :param timing: Measure time of queries in `stats`. Queries of the
+        wrapped database are measured too, its cursor is replaced by
+        `TimedCursor`.
+        """
+        self.db = db
+        self._depth = 0
+        configure_connection(db.cur.connection, scratch, write)
+        self.stats: QueryStats | None = None
+        if timing:
+            self.stats = QueryStats()
+            db.cur = TimedCursor(db.cur, self.stats)
+
+    def __getattr__(self, name):
+        if name == 'db':
+            raise AttributeError(name)
+        return getattr(self.db, name)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Execute the block in a single transaction.
+
+        Nested transactions are part of the outermost one, they don't commit.
+        Methods of fs2json that commit by themselves still end the transaction
+        early.
+        """
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+
+        self._depth = 1
+        try:
+            with self.db.cur.connection:
+                yield
+        finally:
+            self._depth = 0
+
+
+def transaction(db) -> ContextManager:
+    """Return context manager of a transaction on `db`.
+
+    If `db` is (or wraps) a `DatabaseSession`, the transaction is joined with
+    the open transaction of the session.
+    """
+    wrapped = db
+    while wrapped is not None:
+        if isinstance(wrapped, DatabaseSession):
+            return wrapped.transaction()
+        # `FsIndex` and sessions store the wrapped database in `db`
+        wrapped = getattr(wrapped, 'db', None)
+    return db.cur.connection
@@ -21,9 +21,14 @@ from . import (
     generalize_by_owner_directory,
 )
 from enum import Enum, auto
-from collections.abc import Iterable
+from collections import Counter
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from copy import copy
 from .helpers import prologue, epilogoue, TestCaseContext
 from fs2json.evaluation import Result
+from mpm.generalize.generalize import generalize_from_fhs_rules
+from mpm.tree import NpmTree
+from mpm.profiling import count, timer
 
 
 test_case_funcs = {}
@@ -47,6 +52,38 @@ test_case_funcs[
 test_case_funcs[TestCase.MULTIPLE_RUNS] = generalize_multiple_runs.test_core
 test_case_funcs[TestCase.NONEXISTENT] = generalize_nonexistent.test_core
 
+NO_GENERALIZATION_NAME = 'no generalization'
+"""Name of the evaluation case without any generalization."""
+
+test_case_codes = {
+    'T': TestCase.STANDARD,
+    'O': TestCase.OWNER,
+    'OD': TestCase.OWNER_DIRECTORY,
+    'N': TestCase.NONEXISTENT,
+    'M': TestCase.MULTIPLE_RUNS,
+}
+"""Codes of test cases used in names of evaluation cases, e.g. `M+T`."""
+
+DEFAULT_EVAL_CASES = (
+    NO_GENERALIZATION_NAME,
+    'T',
+    'O',
+    'OD',
+    'N',
+    'M',
+    # pairs
+    'M+T',
+    'N+T',
+    'O+T',
+    'OD+T',
+    'OD+O',
+    'O+N',
+    'M+O',
+    'OD+N',
+    'M+OD',
+    'M+N',
+)
+
 
 def execute_tests(
     test_cases: Iterable[TestCase], ctx: TestCaseContext
@@ -55,3 +92,98 @@ def execute_tests(
     for test in test_cases:
         test_case_funcs[test](ctx)
     return epilogoue(ctx)
+
+
+def parse_eval_case(name: str) -> tuple[TestCase, ...]:
+    """Return test cases of evaluation case `name`.
+
+    Name consists of test case codes from `test_case_codes` joined by `+`. Test
+    cases are executed in the same order as in the name. Whitespace around
+    codes is ignored.
+
+    :raises ValueError: if the name contains an unknown code.
+    """
+    if name.strip() == NO_GENERALIZATION_NAME:
+        return (TestCase.NO_GENERALIZATION,)
+    try:
+        return tuple(
+            test_case_codes[code.strip()] for code in name.split('+')
+        )
+    except KeyError as e:
+        raise ValueError(f'Unknown test case {e} in {name}') from None
+
+
+def parse_eval_cases(
+    names: Iterable[str],
+) -> dict[str, tuple[TestCase, ...]]:
+    """Return dictionary of evaluation cases for `execute_eval_cases`.
+
+    Names are stripped of whitespace, so they can be parsed from a
+    comma-separated list like `T, O`.
+
+    :raises ValueError: if a name contains an unknown code.
+    """
+    return {name.strip(): parse_eval_case(name) for name in names}
+
+
+def generalize_eval_cases(
+    eval_cases: Mapping[str, Sequence[TestCase]], ctx: TestCaseContext
+) -> Iterator[tuple[str, NpmTree]]:
+    """Run generalizers of every evaluation case followed by the FHS rules,
+    but don't evaluate the resulting trees.
+
+    Trees generalized by common prefixes of test cases are computed only once.
+    For example, `M` is executed only once for evaluation cases `M`, `M+T` and
+    `M+O`. Trees are memoized only until the last evaluation case that needs
+    them is generalized. The key of the memoized tree is the prefix of test
+    cases, because the input tree and configuration are the same for all
+    evaluation cases.
+
+    :returns: Iterator of evaluation case names and generalized trees, in the
+    order of `eval_cases`.
+    """
+    # Number of evaluation cases that will use a prefix of test cases
+    uses = Counter(
+        tuple(test_cases[:i])
+        for test_cases in eval_cases.values()
+        for i in range(1, len(test_cases) + 1)
+    )
+    cache: dict[tuple[TestCase, ...], NpmTree] = {}
+
+    for eval_case, test_cases in eval_cases.items():
+        test_cases = tuple(test_cases)
+        case_ctx = copy(ctx)
+        case_ctx.eval_case = eval_case
+
+        done = len(test_cases)
+        while done and test_cases[:done] not in cache:
+            done -= 1
+        if done:
+            case_ctx.tree = cache[test_cases[:done]]
+        # Copy the input tree, so it's not modified
+        prologue(case_ctx)
+
+        for i, test in enumerate(test_cases):
+            prefix = test_cases[: i + 1]
+            uses[prefix] -= 1
+            if i < done:
+                count('memoized generalizers')
+                if not uses[prefix]:
+                    # The last user of this prefix
+                    cache.pop(prefix, None)
+                continue
+            # Items of generalizers are nodes they added or removed
+            size = len(case_ctx.tree)
+            with timer(f'generalizer {test.name}') as measurement:
+                test_case_funcs[test](case_ctx)
+                measurement.items = abs(len(case_ctx.tree) - size)
+            if uses[prefix]:
+                cache[prefix] = NpmTree(tree=case_ctx.tree, deep=True)
+
+        size = len(case_ctx.tree)
+        with timer('generalize_from_fhs_rules') as measurement:
+            generalize_from_fhs_rules(
+                case_ctx.fhs_path, case_ctx.tree, case_ctx.medusa_domains
+            )
+            measurement.items = abs(len(case_ctx.tree) - size)
+        yield eval_case, case_ctx.tree
@@ -19,9 +19,12 @@ from fs2json.db import DatabaseWriter, DatabaseRead
 from fs2json.evaluation import Result
 from collections.abc import Iterable
 from mpm.tree import NpmTree
+from mpm.confusion import load_confusion
 from pathlib import Path
 from mpm.generalize.generalize import generalize_from_fhs_rules
 from dataclasses import dataclass, field
+from itertools import repeat
+from mpm.profiling import timed
 
 
 @dataclass
@@ -61,16 +64,26 @@ def prepare_selinux_accesses(
         )
 
 
-def populate_accesses(
+@timed('insert_accesses')
+def insert_accesses(
     tree: NpmTree,
     db: DatabaseWriter,
     case: str,
     eval_case: str,
     subject_context_groups: Iterable[Iterable[str]],
     medusa_domain_groups: Iterable[set[tuple[tuple]]],
+    medusa_result_groups: Iterable[dict[int, tuple[int, int]]] = None,
 ) -> None:
-    for subject_contexts, medusa_domains in zip(
-        subject_context_groups, medusa_domain_groups
+    """Insert Medusa results of paths covered by `tree` into the database.
+
+    :param medusa_result_groups: Results for every subject context group
+    computed in advance by `NpmTree.get_medusa_results`. If `None`, they are
+    computed here.
+    """
+    if medusa_result_groups is None:
+        medusa_result_groups = repeat(None)
+    for subject_contexts, medusa_domains, medusa_results in zip(
+        subject_context_groups, medusa_domain_groups, medusa_result_groups
     ):
         tree.insert_medusa_accesses(
             db,
@@ -78,12 +91,21 @@ def populate_accesses(
             eval_case,
             subject_contexts,
             medusa_domains,
+            medusa_results,
         )
 
-    db.fill_missing_selinux_accesses(
-        case,
-        verbose=False,
-    )
+
+@timed('fill_missing_accesses')
+def fill_missing_accesses(
+    tree: NpmTree,
+    db: DatabaseWriter,
+    case: str,
+    eval_case: str,
+    subject_context_groups: Iterable[Iterable[str]],
+    medusa_domain_groups: Iterable[set[tuple[tuple]]],
+) -> None:
+    """Insert Medusa results for accesses that are in the database, but were
+    not inserted by `insert_accesses` for this `eval_case`."""
     for subject_contexts, medusa_domains in zip(
         subject_context_groups, medusa_domain_groups
     ):
@@ -96,6 +118,40 @@ def populate_accesses(
         )
 
 
+@timed('populate_accesses')
+def populate_accesses(
+    tree: NpmTree,
+    db: DatabaseWriter,
+    case: str,
+    eval_case: str,
+    subject_context_groups: Iterable[Iterable[str]],
+    medusa_domain_groups: Iterable[set[tuple[tuple]]],
+    medusa_result_groups: Iterable[dict[int, tuple[int, int]]] = None,
+) -> None:
+    insert_accesses(
+        tree,
+        db,
+        case,
+        eval_case,
+        subject_context_groups,
+        medusa_domain_groups,
+        medusa_result_groups,
+    )
+    db.fill_missing_selinux_accesses(
+        case,
+        verbose=False,
+    )
+    fill_missing_accesses(
+        tree,
+        db,
+        case,
+        eval_case,
+        subject_context_groups,
+        medusa_domain_groups,
+    )
+
+
+@timed('export_results')
 def export_results(
     case_name: str,
     eval_case: str,
@@ -139,6 +195,27 @@ def evaluate(
     fhs_path: str,
 ) -> Result:
     generalize_from_fhs_rules(fhs_path, tree, medusa_domain_groups)
+    return evaluate_generalized(
+        tree,
+        case_name,
+        eval_case,
+        subject_context_groups,
+        medusa_domain_groups,
+        db,
+    )
+
+
+def evaluate_generalized(
+    tree: NpmTree,
+    case_name: str,
+    eval_case: str,
+    subject_context_groups: Iterable[Iterable[str]],
+    medusa_domain_groups: Iterable[Iterable[tuple[tuple]]],
+    db: DatabaseRead,
+    medusa_result_groups: Iterable[dict[int, tuple[int, int]]] = None,
+) -> Result:
+    """Evaluate `tree` that has already been generalized by all generalizers
+    including the FHS rules."""
     populate_accesses(
         tree,
         db,
@@ -146,10 +223,31 @@ def evaluate(
         eval_case,
         subject_context_groups,
         medusa_domain_groups,
+        medusa_result_groups,
     )
-    confusion = db.get_permission_confusion(
-        case_name, subject_context_groups, eval_case
+    return evaluate_populated(
+        tree, case_name, eval_case, subject_context_groups, db
     )
+
+
+def evaluate_populated(
+    tree: NpmTree,
+    case_name: str,
+    eval_case: str,
+    subject_context_groups: Iterable[Iterable[str]],
+    db: DatabaseRead,
+    confusion: Result = None,
+) -> Result:
+    """Compute and export confusion of `eval_case` whose accesses have already
+    been inserted into the database.
+
+    :param confusion: Confusion computed in advance by
+    `mpm.confusion.load_confusion`. If `None`, it's computed here.
+    """
+    if confusion is None:
+        confusion = load_confusion(
+            db, case_name, subject_context_groups, [eval_case]
+        ).result(eval_case)
     export_results(
         case_name, eval_case, subject_context_groups, db, confusion, tree
     )
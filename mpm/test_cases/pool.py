@@ -0,0 +1,239 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Parallel execution of evaluation cases.
+
+Generalization of an evaluation case doesn't depend on other evaluation cases
+and it only reads the database. It is therefore executed on a process pool.
+Every worker opens its own connection to the database and returns the
+generalized tree together with a buffer of Medusa results. The main process
+merges the buffers of all evaluation cases into the database and then evaluates
+the cases one after another in the original order. Writes of every evaluation
+case are done in a single transaction.
+
+Generalizers may add accesses that are not in the reference. Since the buffers
+of all cases are merged before the evaluation, every case is evaluated against
+all accesses in a single pass. All generalized trees are kept in memory until
+the evaluation is finished.
+"""
+
+from mpm.test_cases import TestCase, generalize_eval_cases
+from mpm.test_cases.helpers import (
+    TestCaseContext,
+    insert_accesses,
+    fill_missing_accesses,
+    evaluate_populated,
+)
+from mpm.tree import NpmTree
+from mpm.fs_index import FsIndex
+from mpm.confusion import load_confusion
+from mpm.session import DatabaseSession, transaction
+import mpm.profiling
+from fs2json.db import DatabaseRead
+from fs2json.evaluation import Result
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections import defaultdict
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from dataclasses import replace
+from pathlib import Path
+
+GeneralizedCase = tuple[NpmTree, list[dict[int, tuple[int, int]]]]
+"""Generalized tree and Medusa results for every subject context group."""
+
+_worker_ctx: TestCaseContext | None = None
+"""Context of the worker process, see `_init_worker`."""
+
+
+def _init_worker(
+    ctx: TestCaseContext, db_path: str, fs_index: bool, profile: bool
+) -> None:
+    global _worker_ctx
+    if profile:
+        mpm.profiling.enable()
+    # The main process sets the journal mode of the database
+    db = DatabaseSession(DatabaseRead(db_path), write=False)
+    if fs_index:
+        db = FsIndex(db)
+    _worker_ctx = replace(ctx, db=db)
+
+
+def _generalize_cases(
+    ctx: TestCaseContext, eval_cases: Mapping[str, Sequence[TestCase]]
+) -> Iterator[GeneralizedCase]:
+    for _, tree in generalize_eval_cases(eval_cases, ctx):
+        medusa_results = [
+            tree.get_medusa_results(ctx.db, medusa_domains)
+            for medusa_domains in ctx.medusa_domains
+        ]
+        yield tree, medusa_results
+
+
+def _worker(
+    eval_cases: Mapping[str, Sequence[TestCase]]
+) -> tuple[list[GeneralizedCase], tuple | None]:
+    """Generalize `eval_cases` and return them together with measurements of
+    the worker, see `mpm.profiling.take`."""
+    ret = list(_generalize_cases(_worker_ctx, eval_cases))
+    return ret, mpm.profiling.take()
+
+
+def _evaluate_cases(
+    eval_cases: Iterable[str],
+    generalized: Iterable[GeneralizedCase],
+    ctx: TestCaseContext,
+) -> dict[str, Result]:
+    # Accesses of all evaluation cases are inserted first. Every case is then
+    # evaluated against the union of accesses created by all generalizers, so
+    # a second pass over all evaluation cases isn't necessary.
+    trees: dict[str, NpmTree] = {}
+    # Generalized cases must be exhausted, so that measurements of workers are
+    # merged
+    for eval_case, (tree, medusa_results) in zip(
+        eval_cases, generalized, strict=True
+    ):
+        # Writes of every evaluation case are committed at once
+        with transaction(ctx.db):
+            insert_accesses(
+                tree,
+                ctx.db,
+                ctx.case_name,
+                eval_case,
+                ctx.subject_contexts,
+                ctx.medusa_domains,
+                medusa_results,
+            )
+        trees[eval_case] = tree
+
+    with transaction(ctx.db):
+        ctx.db.fill_missing_selinux_accesses(ctx.case_name, verbose=False)
+
+    for eval_case, tree in trees.items():
+        with transaction(ctx.db):
+            fill_missing_accesses(
+                tree,
+                ctx.db,
+                ctx.case_name,
+                eval_case,
+                ctx.subject_contexts,
+                ctx.medusa_domains,
+            )
+
+    # Confusion of all evaluation cases is computed at once, it's also broken
+    # down by directories
+    confusion = load_confusion(
+        ctx.db, ctx.case_name, ctx.subject_contexts, list(trees)
+    )
+    results: dict[str, Result] = {}
+    for eval_case, tree in trees.items():
+        results[eval_case] = evaluate_populated(
+            tree,
+            ctx.case_name,
+            eval_case,
+            ctx.subject_contexts,
+            ctx.db,
+            confusion.result(eval_case),
+        )
+    # Directory of the case is created by `evaluate_populated`
+    confusion.write_csv(Path(f'results/{ctx.case_name}'))
+    return results
+
+
+def generalize_cases(
+    eval_cases: Mapping[str, Sequence[TestCase]],
+    ctx: TestCaseContext,
+    db_path: str,
+    jobs: int = 1,
+    fs_index: bool = False,
+) -> Iterator[GeneralizedCase]:
+    """Generalize every evaluation case from `eval_cases` and compute its
+    Medusa results, but don't write anything to the database.
+
+    Parameters are the same as in `execute_eval_cases`. The result doesn't
+    depend on the number of `jobs`.
+
+    :returns: Iterator of generalized cases in the order of `eval_cases`.
+    Measurements of worker processes are merged after the last case is
+    returned.
+    """
+    if jobs == 1:
+        yield from _generalize_cases(ctx, eval_cases)
+        return
+
+    # Evaluation cases that start with the same test case share memoized
+    # trees, so they are generalized by the same worker.
+    partitions: defaultdict[
+        TestCase | None, dict[str, Sequence[TestCase]]
+    ] = defaultdict(dict)
+    for eval_case, test_cases in eval_cases.items():
+        partitions[test_cases[0] if test_cases else None][
+            eval_case
+        ] = test_cases
+
+    # Database connection can't be sent to other processes and dictionary views
+    # can't be pickled
+    worker_ctx = replace(
+        ctx,
+        db=None,
+        medusa_domains=[list(domains) for domains in ctx.medusa_domains],
+    )
+    with ProcessPoolExecutor(
+        jobs,
+        initializer=_init_worker,
+        initargs=(
+            worker_ctx,
+            db_path,
+            fs_index,
+            mpm.profiling.is_enabled(),
+        ),
+    ) as executor:
+        # Maps evaluation case to the future of its partition and its index in
+        # the partition. The biggest partitions are started first.
+        futures: dict[str, tuple[Future, int]] = {}
+        for partition in sorted(partitions.values(), key=len, reverse=True):
+            future = executor.submit(_worker, partition)
+            for i, eval_case in enumerate(partition):
+                futures[eval_case] = (future, i)
+        for eval_case in eval_cases:
+            future, i = futures[eval_case]
+            yield future.result()[0][i]
+        for future in {future for future, _ in futures.values()}:
+            mpm.profiling.merge(future.result()[1])
+
+
+def execute_eval_cases(
+    eval_cases: Mapping[str, Sequence[TestCase]],
+    ctx: TestCaseContext,
+    db_path: str,
+    jobs: int = 1,
+    fs_index: bool = False,
+) -> dict[str, Result]:
+    """Generalize and evaluate every evaluation case from `eval_cases`.
+
+    :param eval_cases: Maps name of the evaluation case to test cases
+    (generalizers) that will be executed in the given order, see
+    `parse_eval_cases`. Trees generalized by common prefixes of test cases are
+    shared, see `generalize_eval_cases`.
+    :param ctx: Context shared by all evaluation cases. `ctx.db` is used to
+    write the results.
+    :param db_path: Path to the database `ctx.db` for worker processes.
+    :param jobs: Number of worker processes. If 1, everything is executed in
+    the current process.
+    :param fs_index: Use `FsIndex` in worker processes.
+    """
+    return _evaluate_cases(
+        eval_cases.keys(),
+        generalize_cases(eval_cases, ctx, db_path, jobs, fs_index),
+        ctx,
+    )
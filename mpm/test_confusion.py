@@ -0,0 +1,146 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from mpm.confusion import confusion_counts, load_confusion
+from mpm.db import insert_medusa_results
+from mpm.test_fs_index import SqlFs
+from mpm.test_pool import DOMAIN, create_tree
+from mpm.tree import Permission
+import numpy as np
+
+
+class TestConfusionCounts(unittest.TestCase):
+    def test_counts(self):
+        reference = np.array([1, 1, 0, 0, -1])
+        medusa = np.array([[1, 0, 1, 0, 1], [1, 1, -1, 0, 0]])
+        self.assertEqual(
+            confusion_counts(reference, medusa).tolist(),
+            [[1, 1, 1, 1], [2, 0, 0, 1]],
+        )
+        groups = np.array([0, 1, 1, 0, 0])
+        self.assertEqual(
+            confusion_counts(reference, medusa, groups).tolist(),
+            [
+                [[1, 0, 0, 1], [0, 1, 1, 0]],
+                [[1, 0, 0, 1], [1, 0, 0, 0]],
+            ],
+        )
+
+
+class EvaluationDb(SqlFs):
+    """Filesystem snapshot with results of a single case and subject
+    context."""
+
+    def __init__(self):
+        super().__init__()
+        self.cur.executescript(
+            """CREATE TABLE accesses
+                   (case_id INTEGER, subject_cid INTEGER, node_rowid INTEGER);
+               CREATE TABLE results
+                   (access_id INTEGER, operation_id INTEGER,
+                    reference_result INTEGER);
+               CREATE TABLE medusa_results
+                   (result_id INTEGER, eval_case_id INTEGER,
+                    medusa_result INTEGER);"""
+        )
+        self.eval_cases: dict[str, int] = {}
+
+    def get_case_id(self, case):
+        return 1
+
+    def get_context_id(self, context):
+        return 1
+
+    def insert_or_select_eval_case(self, eval_case):
+        return self.eval_cases.setdefault(eval_case, len(self.eval_cases) + 1)
+
+
+class TestLoadConfusion(unittest.TestCase):
+    # Path rowid from `FS`, path and reference results of read and write
+    reference = [
+        (3, '/etc/shadow', 1, 0),
+        (4, '/etc/passwd', 1, 0),
+        (8, '/home/alice/notes', 1, 1),
+        (9, '/home/bob/notes', 0, 0),
+        (10, '/home/bob/todo', 1, 0),
+    ]
+
+    def test_same_as_tree(self):
+        read, write = Permission.READ, Permission.WRITE
+        trees = {
+            'A': create_tree(
+                [
+                    ('/etc/passwd', read),
+                    ('/etc/shadow', read | write),
+                    ('/home/alice/notes', write),
+                ]
+            ),
+            'B': create_tree(
+                [
+                    ('/etc/passwd', read | write),
+                    ('/home/bob/todo', read),
+                    ('/home/bob/notes', read),
+                ]
+            ),
+        }
+        db = EvaluationDb()
+        access_ids = {}
+        for rowid, _, reference_read, reference_write in self.reference:
+            access_ids[rowid] = db.cur.execute(
+                'INSERT INTO accesses VALUES (1, 1, ?)', (rowid,)
+            ).lastrowid
+            db.cur.executemany(
+                'INSERT INTO results VALUES (?, ?, ?)',
+                [
+                    (access_ids[rowid], 1, reference_read),
+                    (access_ids[rowid], 2, reference_write),
+                ],
+            )
+        for eval_case, tree in trees.items():
+            results = tree.get_medusa_results(db, {DOMAIN})
+            insert_medusa_results(
+                db,
+                (1, 2),
+                db.insert_or_select_eval_case(eval_case),
+                [
+                    (access_id, results.get(rowid, (0, 0)))
+                    for rowid, access_id in access_ids.items()
+                ],
+            )
+
+        confusion = load_confusion(db, 'case', [['ctx']], list(trees))
+        b = [(path, r, w) for _, path, r, w in self.reference]
+        self.assertEqual(
+            confusion.counts.tolist(),
+            [list(tree.test_accesses(b, {DOMAIN})) for tree in trees.values()],
+        )
+        # Directories are ordered by their rowids
+        self.assertEqual(
+            confusion.directories, ['/etc', '/home/bob', '/home/alice']
+        )
+        self.assertEqual(
+            confusion.directory_counts.sum(axis=1).tolist(),
+            confusion.counts.tolist(),
+        )
+        for eval_case, counts in zip(trees, confusion.counts.tolist()):
+            result = confusion.result(eval_case)
+            self.assertEqual(
+                [result.tp, result.fn, result.fp, result.tn], counts
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
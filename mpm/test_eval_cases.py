@@ -0,0 +1,84 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from mpm import profiling
+from mpm.fs_index import FsIndex
+from mpm.test_cases import (
+    TestCase,
+    generalize_eval_cases,
+    parse_eval_case,
+    parse_eval_cases,
+)
+from mpm.test_fs_index import SqlFs
+from mpm.test_pool import create_context, dump
+
+
+class TestParseEvalCases(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(
+            parse_eval_case('no generalization'),
+            (TestCase.NO_GENERALIZATION,),
+        )
+        self.assertEqual(
+            parse_eval_case('M+OD'),
+            (TestCase.MULTIPLE_RUNS, TestCase.OWNER_DIRECTORY),
+        )
+        self.assertEqual(
+            parse_eval_cases('T, O + N ,no generalization'.split(',')),
+            {
+                'T': (TestCase.STANDARD,),
+                'O + N': (TestCase.OWNER, TestCase.NONEXISTENT),
+                'no generalization': (TestCase.NO_GENERALIZATION,),
+            },
+        )
+
+    def test_invalid(self):
+        for name in ('X', 'T+', '', 'T+X', 'TO', 'no'):
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError):
+                    parse_eval_case(name)
+        with self.assertRaises(ValueError):
+            parse_eval_cases(['T', 'M+Q'])
+
+
+class TestGeneralizeEvalCases(unittest.TestCase):
+    def test_memoization(self):
+        eval_cases = parse_eval_cases(
+            ['T', 'M', 'M+T', 'M+N', 'N', 'N+T', 'M+N+T', 'T+N']
+        )
+        db = FsIndex(SqlFs())
+        profiling.enable()
+        try:
+            memoized = dict(
+                generalize_eval_cases(eval_cases, create_context(db))
+            )
+            memoized_count = profiling.counters['memoized generalizers']
+        finally:
+            profiling.disable()
+        # M is reused by M+T, M+N and M+N+T, M+N by M+N+T, N by N+T and T by
+        # T+N
+        self.assertEqual(memoized_count, 6)
+
+        for eval_case, test_cases in eval_cases.items():
+            [(name, tree)] = generalize_eval_cases(
+                {eval_case: test_cases}, create_context(db)
+            )
+            self.assertEqual(name, eval_case)
+            self.assertEqual(dump(memoized[eval_case]), dump(tree))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from mpm.evaluator import CompiledTree
+from mpm.tree import NpmTree, NpmNode, Access, Permission
+
+
+class TestCompiledTree(unittest.TestCase):
+    @staticmethod
+    def access(permissions):
+        a = Access(permissions)
+        a.uid = 0
+        a.domain = (('/bin/a', 0),)
+        return a
+
+    def test_evaluate(self):
+        read = self.access(Permission.READ)
+        write = Access(Permission.WRITE)
+        write.uid = 0
+        write.domain = (('/bin/b', 0),)
+        tree = NpmTree()
+        tree._create_path('/etc/passwd').data = NpmNode([read, write])
+        tree.add_path_generalization(r'/tmp/\d+').data.add(write)
+        tree._create_path('/var').data = NpmNode([read])
+        tree.get_node_at_path('/var').data.is_recursive = True
+
+        compiled = CompiledTree(tree)
+        paths = ['/etc/passwd', '/etc/shadow', '/tmp/12', '/tmp/x', '/var/a/b']
+        r, w = compiled.evaluate(paths, [read.domain])
+        self.assertEqual(r.tolist(), [1, 0, 0, 0, 1])
+        self.assertEqual(w.tolist(), [0, 0, 0, 0, 0])
+        r, w = compiled.evaluate(paths, [read.domain, write.domain])
+        self.assertEqual(r.tolist(), [1, 0, 0, 0, 1])
+        self.assertEqual(w.tolist(), [1, 0, 1, 0, 0])
+
+    def test_accesses(self):
+        read = self.access(Permission.READ)
+        tree = NpmTree()
+        tree._create_path('/etc/passwd').data = NpmNode([read])
+        b = [('/etc/passwd', 1, 1), ('/etc/shadow', 0, 0), ('/tmp', 1, 0)]
+        self.assertEqual(tree.test_accesses(b, {read.domain}), (1, 2, 0, 3))
+
+    @staticmethod
+    def first_match(tree, b, domains):
+        """Evaluate `b` the way `NpmTree.test_accesses` did before trees were
+        compiled: permissions of the first access of one of `domains` in the
+        node found by `get_node_at_path`."""
+        results = []
+        for path, _, _ in b:
+            node = tree.get_node_at_path(
+                path, search_regexp=True, verbose=False
+            )
+            permissions = Permission(0)
+            if node is not None and node.data:
+                for access in node.data:
+                    if access.domain in domains:
+                        permissions = access.permissions
+                        break
+            results.append(
+                (
+                    int(bool(permissions & Permission.READ)),
+                    int(bool(permissions & Permission.WRITE)),
+                )
+            )
+        return results
+
+    def test_same_as_first_match(self):
+        read = self.access(Permission.READ)
+        write = Access(Permission.WRITE)
+        write.uid = 0
+        write.domain = (('/bin/b', 0),)
+        tree = NpmTree()
+        tree._create_path('/etc/passwd').data = NpmNode([read])
+        tree._create_path('/etc/shadow').data = NpmNode([write])
+        tree.add_path_generalization(r'/tmp/\d+').data.add(read)
+        tree._create_path('/both').data = NpmNode([read, write])
+        b = [
+            ('/etc/passwd', 1, 0),
+            ('/etc/shadow', 0, 1),
+            ('/etc/group', 0, 0),
+            ('/tmp/12', 1, 1),
+            ('/tmp/x', 0, 0),
+        ]
+        compiled = CompiledTree(tree)
+        for domains in [
+            {read.domain},
+            {write.domain},
+            {read.domain, write.domain},
+        ]:
+            with self.subTest(domains=domains):
+                r, w = compiled.evaluate((p for p, _, _ in b), domains)
+                self.assertEqual(
+                    list(zip(r.tolist(), w.tolist())),
+                    self.first_match(tree, b, domains),
+                )
+
+        # Permissions of all accesses of the evaluated domains are joined,
+        # the first match allowed only one of them
+        domains = {read.domain, write.domain}
+        r, w = compiled.evaluate(['/both'], domains)
+        self.assertEqual((r.tolist(), w.tolist()), ([1], [1]))
+        self.assertIn(
+            self.first_match(tree, [('/both', 1, 1)], domains),
+            [[(1, 0)], [(0, 1)]],
+        )
+
+        # Recursive markers apply to nodes under them
+        marker = tree.create_node('.*', parent=tree.get_node_at_path('/etc'))
+        marker.data = NpmNode([write])
+        marker.data.is_regexp = True
+        marker.data.is_recursive = True
+        b = [('/etc/passwd', 1, 1)]
+        self.assertEqual(self.first_match(tree, b, domains), [(1, 0)])
+        r, w = CompiledTree(tree).evaluate(['/etc/passwd'], domains)
+        self.assertEqual((r.tolist(), w.tolist()), ([1], [1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,277 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from mpm import fhs
+from mpm.evaluator import CompiledTree
+from mpm.tree import NpmTree, NpmNode, Access, Permission
+from mpm.mpm_types import FHSConfigRule
+from contextlib import redirect_stdout
+import io
+from pathlib import Path
+import tempfile
+
+
+class TestFhsRules(unittest.TestCase):
+    rules = [
+        FHSConfigRule('/usr/bin/.*', Permission.READ, False, True),
+        FHSConfigRule('/usr/bin/sudo', Permission.WRITE, False, False),
+        FHSConfigRule('/usr/lib/locale', Permission.READ, True, False),
+        FHSConfigRule('/usr/lib/locale/en/x', Permission.WRITE, False, False),
+        FHSConfigRule('/tmp/\\.X.+-lock', Permission.READ, False, True),
+    ]
+
+    @staticmethod
+    def create_tree():
+        tree = NpmTree()
+        for path in ['/usr/bin/ls', '/usr/lib/locale/en', '/tmp/.X1-lock']:
+            tree._create_path(path).data = NpmNode()
+        return tree
+
+    @staticmethod
+    def dump(tree):
+        return sorted(
+            (
+                tree.get_path(n),
+                n.data is not None
+                and (
+                    sorted((a.permissions, a.uid) for a in n.data),
+                    n.data.is_regexp,
+                    n.data.is_recursive,
+                ),
+            )
+            for n in tree.all_nodes()
+        )
+
+    def test_expected_tree(self):
+        read, write = Permission.READ, Permission.WRITE
+        expected = [
+            ('', False),
+            ('/tmp', False),
+            ('/tmp/.X1-lock', ([(read, 0)], False, False)),
+            ('/tmp/\\.X.+-lock', ([(read, 0)], True, False)),
+            ('/usr', False),
+            ('/usr/bin', False),
+            ('/usr/bin/.*', ([(read, 0)], True, False)),
+            ('/usr/bin/ls', ([(read, 0)], False, False)),
+            # Created by a literal rule after the regexp rule was applied
+            ('/usr/bin/sudo', ([(write, 0)], False, False)),
+            ('/usr/lib', False),
+            ('/usr/lib/locale', ([(read, 0)], False, False)),
+            ('/usr/lib/locale/.*', ([(read, 0)], True, True)),
+            # Covered by the recursive marker of `/usr/lib/locale`
+            ('/usr/lib/locale/en', ([], False, False)),
+            ('/usr/lib/locale/en/x', ([(write, 0)], False, False)),
+        ]
+        access_info = [(0, (('/bin/a', 0),))]
+        batch = self.create_tree()
+        single = self.create_tree()
+        with redirect_stdout(io.StringIO()):
+            batch.generalize_fhs_rules(self.rules, access_info)
+            for rule in self.rules:
+                single.generalize_fhs_rule(rule, access_info)
+        self.assertEqual(self.dump(batch), expected)
+        self.assertEqual(self.dump(single), expected)
+
+    def test_recursive_marker(self):
+        access_info = [(0, (('/bin/a', 0),))]
+        tree = self.create_tree()
+        with redirect_stdout(io.StringIO()):
+            tree.generalize_fhs_rules(self.rules, access_info)
+        locale = tree.get_node_at_path('/usr/lib/locale')
+        markers = [
+            n for n in tree.children(locale.identifier) if n.tag == '.*'
+        ]
+        self.assertEqual(len(markers), 1)
+        self.assertIs(tree.get_recursive_marker(locale), markers[0])
+        # Existing subtree isn't stamped with markers
+        en = tree.get_node_at_path('/usr/lib/locale/en')
+        self.assertIsNone(tree.get_recursive_marker(en))
+
+        path = '/usr/lib/locale/de/LC_MESSAGES/x.mo'
+        node = tree.get_node_at_path(path, search_regexp=True)
+        self.assertIs(node, markers[0])
+        compiled = CompiledTree(tree)
+        read, write = compiled.evaluate(
+            [path, '/usr/lib/locale/en/x', '/usr/lib/other'],
+            [(('/bin/a', 0),)],
+        )
+        self.assertEqual(read.tolist(), [1, 1, 0])
+        self.assertEqual(write.tolist(), [0, 1, 0])
+
+    def test_existing_star(self):
+        read, write = Permission.READ, Permission.WRITE
+        domain = (('/bin/a', 0),)
+        generalized = (('/bin/b', 1),)
+        tree = NpmTree()
+        tree._create_path('/usr/lib/locale/en').data = NpmNode()
+        # `.*` nodes created by generalizers before the rules are applied
+        for path in ['/usr/lib/locale/.*', '/var/.*']:
+            node = tree.add_path_generalization(path)
+            access = Access(write)
+            access.uid = 1
+            access.domain = generalized
+            node.data.add_access(access)
+        rules = [
+            FHSConfigRule('/usr/lib/locale', read, True, False),
+            FHSConfigRule('/var/.*', read, True, True),
+            FHSConfigRule('/var/.*', write, True, True),
+        ]
+        with redirect_stdout(io.StringIO()):
+            tree.generalize_fhs_rules(rules, [(0, domain)])
+        self.assertEqual(
+            self.dump(tree),
+            [
+                ('', False),
+                ('/usr', False),
+                ('/usr/lib', False),
+                ('/usr/lib/locale', ([(read, 0)], False, False)),
+                # Generalized accesses stay non-recursive, the marker holds
+                # just the accesses of the rule
+                ('/usr/lib/locale/.*', ([(read, 0)], True, True)),
+                ('/usr/lib/locale/.*', ([(write, 1)], True, False)),
+                ('/usr/lib/locale/en', ([], False, False)),
+                ('/var', ([], False, False)),
+                ('/var/.*', ([(write, 1)], True, False)),
+                ('/var/.*', ([(read | write, 0)], True, True)),
+            ],
+        )
+        for node in tree.all_nodes():
+            if node.tag == '.*' and node.data.is_recursive:
+                parent = tree.parent(node.identifier)
+                self.assertIs(tree.get_recursive_marker(parent), node)
+
+        compiled = CompiledTree(tree)
+        paths = [
+            '/usr/lib/locale/de',
+            '/usr/lib/locale/de/x',
+            '/var/log',
+            '/var/log/x',
+        ]
+        for domains, expected_read, expected_write in [
+            ([domain], [1, 1, 1, 1], [0, 0, 1, 1]),
+            ([generalized], [0, 0, 0, 0], [1, 0, 1, 0]),
+        ]:
+            read_results, write_results = compiled.evaluate(paths, domains)
+            self.assertEqual(read_results.tolist(), expected_read)
+            self.assertEqual(write_results.tolist(), expected_write)
+
+
+class TestFhsLoader(unittest.TestCase):
+    def test_parse(self):
+        lines = [
+            '# comment\n',
+            '\n',
+            '/usr/bin/.*\tR\treg\n',
+            '/usr/bin/sudo\n',
+            '/usr/lib/locale\t\trR\n',
+        ]
+        rules = NpmTree.load_fhs_config(lines)
+        self.assertEqual(
+            rules,
+            [
+                FHSConfigRule('/usr/bin/.*', Permission.READ, False, True),
+                FHSConfigRule('/usr/bin/sudo', Permission(0), False, False),
+                FHSConfigRule('/usr/lib/locale', Permission.READ, True, False),
+            ],
+        )
+
+    def test_invalid(self):
+        for line in [
+            'usr/bin\tR',
+            '/usr//bin\tR',
+            '/usr/bin\tX',
+            '/usr/bin\tR\tregexp',
+            '/usr/(bin\tR\treg',
+            '/usr/bin\tR\treg\tx',
+        ]:
+            with self.assertRaises(fhs.FHSConfigError):
+                fhs.parse_fhs_rules(['# comment', line], 'rules')
+
+    def test_include_and_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            (d / 'lib.txt').write_text('/usr/lib\tR\n')
+            (d / 'rules.txt').write_text('/usr/bin\tR\ninclude\tlib.txt\n')
+            cache_dir = d / 'cache'
+            rules = fhs.load_fhs_rules(
+                str(d / 'rules.txt'), cache_dir=cache_dir
+            )
+            self.assertEqual([r.path for r in rules], ['/usr/bin', '/usr/lib'])
+            self.assertEqual(len(list(cache_dir.iterdir())), 1)
+            cache_file = next(cache_dir.iterdir())
+            self.assertIsNotNone(fhs._read_cache(cache_file))
+
+            self.assertEqual(cache_file.suffix, '.json')
+            self.assertIsNotNone(fhs._read_cache(cache_file))
+
+            # Change of an included file invalidates the cache and rules
+            # loaded earlier in this run
+            (d / 'lib.txt').write_text('/usr/lib64\tR\n')
+            self.assertIsNone(fhs._read_cache(cache_file))
+            rules = fhs.load_fhs_rules(
+                str(d / 'rules.txt'), cache_dir=cache_dir
+            )
+            self.assertEqual(
+                [r.path for r in rules], ['/usr/bin', '/usr/lib64']
+            )
+
+    def test_corrupted_cache(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            (d / 'rules.txt').write_text('/usr/bin\tR\n')
+            cache_dir = d / 'cache'
+            fhs.load_fhs_rules(str(d / 'rules.txt'), cache_dir=cache_dir)
+            cache_file = next(cache_dir.iterdir())
+            for contents in [
+                '',
+                '[]',
+                '{"dependencies": {}, "rules": [["/usr/bin", 1]]}',
+                '{"dependencies": {}, "rules": [["usr/bin", 1, 0, 0]]}',
+            ]:
+                cache_file.write_text(contents)
+                self.assertIsNone(fhs._read_cache(cache_file))
+
+    def test_include_diamond(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            (d / 'common.txt').write_text('/usr/lib\tR\n')
+            (d / 'a.txt').write_text('/usr/a\tR\ninclude\tcommon.txt\n')
+            (d / 'b.txt').write_text('include\tcommon.txt\n/usr/b\tR\n')
+            (d / 'rules.txt').write_text('include\ta.txt\ninclude\tb.txt\n')
+            rules = fhs.load_fhs_rules(str(d / 'rules.txt'), cache_dir=None)
+            self.assertEqual(
+                [r.path for r in rules],
+                ['/usr/a', '/usr/lib', '/usr/lib', '/usr/b'],
+            )
+            # Separate top-level files can include the same file too
+            rules = fhs.load_fhs_rules(
+                str(d / 'a.txt'), str(d / 'b.txt'), cache_dir=None
+            )
+            self.assertEqual(len(rules), 4)
+
+    def test_include_cycle(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            (d / 'a.txt').write_text('/usr/a\tR\ninclude\tb.txt\n')
+            (d / 'b.txt').write_text('include\tsub/../a.txt\n')
+            (d / 'self.txt').write_text('include\tself.txt\n')
+            for name in ('a.txt', 'self.txt'):
+                with self.assertRaises(fhs.FHSConfigError):
+                    fhs.load_fhs_rules(str(d / name), cache_dir=None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from fs2json.db import DatabaseRead
+from mpm.fs_index import FsIndex
+from mpm.tree import NpmTree, Access, Permission
+from pathlib import Path
+import sqlite3
+import stat
+import tempfile
+
+DIR = stat.S_IFDIR | 0o755
+FILE = stat.S_IFREG | 0o644
+
+# rowid, parent, name, type, uid, gid, mode
+FS = [
+    (1, None, '/', 'dir', 0, 0, DIR),
+    (2, 1, 'etc', 'dir', 0, 0, DIR),
+    (3, 2, 'shadow', 'file', 0, 42, FILE),
+    (4, 2, 'passwd', 'file', 0, 0, FILE),
+    (5, 1, 'home', 'dir', 0, 0, DIR),
+    (6, 5, 'bob', 'dir', 1001, 100, DIR),
+    (7, 5, 'alice', 'dir', 1000, 1000, DIR),
+    (8, 7, 'notes', 'file', 1000, 1000, FILE),
+    (9, 6, 'notes', 'file', 1001, 100, FILE),
+    (10, 6, 'todo', 'file', 1001, 100, FILE),
+]
+
+
+def create_fs(con: sqlite3.Connection, rows=FS) -> None:
+    """Create the `fs` table with `rows`."""
+    con.execute(
+        'CREATE TABLE fs (parent INTEGER, name TEXT, type TEXT,'
+        ' uid INTEGER, gid INTEGER, mode INTEGER)'
+    )
+    con.executemany(
+        'INSERT INTO fs (rowid, parent, name, type, uid, gid, mode)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+        rows,
+    )
+    con.commit()
+
+
+class SqlFs:
+    """Database that answers queries of the tree with SQL, like fs2json."""
+
+    def __init__(self):
+        con = sqlite3.connect(':memory:')
+        create_fs(con)
+        self.cur = con.cursor()
+
+    def get_specific_child(self, parent, name):
+        row = self.cur.execute(
+            'SELECT rowid FROM fs WHERE parent = ? AND name = ?',
+            (parent, name),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def get_children_rowids_and_names(self, parent):
+        return self.cur.execute(
+            'SELECT rowid, name FROM fs WHERE parent = ?', (parent,)
+        ).fetchall()
+
+    def get_uid_from_name(self, name):
+        return {'alice': 1000, 'bob': 1001}[name]
+
+
+class TestFsIndex(unittest.TestCase):
+    def setUp(self):
+        self.db = SqlFs()
+        self.index = FsIndex(self.db)
+
+    def test_children(self):
+        self.assertEqual(self.index.get_specific_child(1, 'etc'), 2)
+        self.assertIsNone(self.index.get_specific_child(1, 'var'))
+        self.assertIsNone(self.index.get_specific_child(100, 'etc'))
+        # Children are sorted by their names
+        self.assertEqual(
+            self.index.get_children_rowids_and_names(2),
+            [(4, 'passwd'), (3, 'shadow')],
+        )
+        self.assertEqual(self.index.get_children_rowids_and_names(8), [])
+        self.assertEqual(self.index.get_matching_children(5, 'a.*'), [7])
+        self.assertEqual(self.index.get_matching_children(2, 'a'), [])
+        self.assertEqual(self.index.get_matching_children(6, '.*'), [9, 10])
+
+    def test_paths(self):
+        self.assertEqual(self.index.resolve('/'), 1)
+        self.assertEqual(self.index.resolve('/home/alice/notes'), 8)
+        self.assertEqual(self.index.resolve('/home/alice/'), 7)
+        self.assertIsNone(self.index.resolve('/home/carol'))
+        self.assertEqual(self.index.get_path(9), '/home/bob/notes')
+        self.assertEqual(self.index.get_path(1), '/')
+        self.assertTrue(self.index.search_path('/etc/shadow'))
+        self.assertFalse(self.index.search_path('/etc/group'))
+
+    def test_attributes(self):
+        self.assertTrue(self.index.is_directory('/home/bob'))
+        self.assertFalse(self.index.is_directory('/home/bob/todo'))
+        self.assertFalse(self.index.is_directory('/nonexistent'))
+        self.assertEqual(self.index.get_owner('/home/alice'), 1000)
+        self.assertIsNone(self.index.get_owner('/nonexistent'))
+        self.assertEqual(self.index.get_num_children('/home/bob'), 2)
+        self.assertEqual(self.index.get_num_children('/etc/passwd'), 0)
+        self.assertEqual(self.index.get_num_children('/nonexistent'), 0)
+        self.assertEqual(
+            self.index.get_directories_by_id([1000], [100]),
+            [('/home/bob', DIR), ('/home/alice', DIR)],
+        )
+
+    def test_forwarding(self):
+        self.assertEqual(self.index.get_uid_from_name('bob'), 1001)
+
+    def test_node_to_db_paths(self):
+        tree = NpmTree()
+        nodes = {
+            path: tree.add_path_generalization(path)
+            for path in ('/etc/passwd', r'/home/.+/notes', r'/home/b.*/.*')
+        }
+        # Nodes without accesses are not recognized as regexps
+        for node in tree.all_nodes_itr():
+            if node.data is not None:
+                node.data.add(Access(Permission.READ))
+        for node in nodes.values():
+            self.assertEqual(
+                sorted(tree.node_to_db_paths(self.index, node)),
+                sorted(tree.node_to_db_paths(self.db, node)),
+            )
+        node = nodes[r'/home/.+/notes']
+        self.assertEqual(tree.node_to_db_paths(self.index, node), [8, 9])
+
+    def test_owner_queries(self):
+        # Group and other bits are the same, group membership doesn't matter
+        rows = FS + [
+            (11, 6, 'secret', 'file', 1001, 100, stat.S_IFREG | 0o600),
+            (12, 6, 'shared', 'file', 1001, 100, stat.S_IFREG | 0o666),
+            (13, 6, 'readonly', 'file', 1001, 100, stat.S_IFREG | 0o444),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            db_path = str(Path(d) / 'fs.db')
+            con = sqlite3.connect(db_path)
+            create_fs(con, rows)
+            con.close()
+            db = DatabaseRead(db_path)
+            index = FsIndex(db)
+            for path in ['/home/bob', '/home/alice', '/etc', '/nonexistent']:
+                for uid in (1000, 1001):
+                    with self.subTest(path=path, uid=uid):
+                        results = [
+                            sorted(
+                                (
+                                    ino.uid,
+                                    ino.mode,
+                                    source.can_read(ino, uid),
+                                    source.can_write(ino, uid),
+                                )
+                                for ino in source.get_children_inodes(path)
+                            )
+                            for source in (db, index)
+                        ]
+                        self.assertEqual(results[0], results[1])
+            db.close()
+
+        inodes = {
+            ino.rowid: ino for ino in index.get_children_inodes('/home/bob')
+        }
+        self.assertEqual(sorted(inodes), [9, 10, 11, 12, 13])
+        self.assertEqual(inodes[11].uid, 1001)
+        self.assertFalse(index.can_read(inodes[11], 1000))
+        self.assertTrue(index.can_write(inodes[11], 1001))
+        self.assertTrue(index.can_write(inodes[12], 1000))
+        self.assertFalse(index.can_write(inodes[13], 1001))
+        self.assertTrue(index.can_write(inodes[13], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,7 +14,9 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import unittest
-from mpm.generalize import generalize, runs, lcs
+from mpm.generalize import generalize, runs, lcs, grouping, template
+from re import fullmatch
+from mpm.tree import NpmTree, NpmNode, Access, Permission
 
 
 class TestProcGeneralization(unittest.TestCase):
@@ -74,6 +76,293 @@ class TestPrefixPostfixRegexp(unittest.TestCase):
             lcs.prefix_postfix_regexp(inp), r'/usr/sbin/.*?post.*?'
         )
 
+    def test_overlap(self):
+        # Prefix and postfix overlap in the shortest string
+        inp = ['ab', 'abb', 'abab']
+        reg = lcs.prefix_postfix_regexp(inp)
+        self.assertEqual(reg, 'ab.*?')
+        for s in inp:
+            self.assertTrue(fullmatch(reg, s), s)
+
+    def test_escape(self):
+        inp = ['/tmp/a.b+c', '/tmp/x.b+y']
+        self.assertEqual(lcs.prefix_postfix_regexp(inp), r'/tmp/.*?\.b\+.*?')
+
+
+class TestLongestCommonSubstrings(unittest.TestCase):
+    @staticmethod
+    def find(*strings):
+        suffix_tree = lcs.SuffixTree()
+        for s in strings:
+            suffix_tree.append_string(s)
+        return suffix_tree.find_longest_common_substrings()
+
+    def test_digits(self):
+        self.assertEqual(self.find('x123y', 'z123w'), ['123'])
+
+    def test_ties(self):
+        self.assertEqual(self.find('abyd', 'dbxa'), ['a', 'b', 'd'])
+
+    def test_single(self):
+        self.assertEqual(self.find('abc'), ['abc'])
+
+    def test_none(self):
+        self.assertEqual(self.find('abc', 'xyz'), [''])
+
+
+class TestGroupSimilarStrings(unittest.TestCase):
+    def test_groups(self):
+        inp = [
+            '/tmp/session123.log',
+            '/etc/passwd',
+            '/tmp/session456.log',
+            '/etc/shadow',
+            '/tmp/session789.log',
+        ]
+        self.assertEqual(
+            grouping.group_similar_strings(inp, 0.425, ignore_case=False),
+            [
+                [
+                    '/tmp/session123.log',
+                    '/tmp/session456.log',
+                    '/tmp/session789.log',
+                ],
+                ['/etc/passwd'],
+                ['/etc/shadow'],
+            ],
+        )
+
+    def test_ignore_case(self):
+        inp = ['abc', 'ABC']
+        self.assertEqual(grouping.group_similar_strings(inp), [['abc', 'ABC']])
+        self.assertEqual(
+            grouping.group_similar_strings(inp, ignore_case=False),
+            [['abc'], ['ABC']],
+        )
+
+    def test_empty(self):
+        self.assertEqual(grouping.group_similar_strings([]), [])
+
+    def test_sparse(self):
+        # Enough strings to be grouped with sparse matrices
+        inp = [
+            f'/var/{d}/{name}{i}{ext}'
+            for d in ('spool', 'lib/postfix', 'log')
+            for name in ('queue', 'active', 'pid')
+            for ext in ('', '.db', '.log')
+            for i in (1, 23, 456, 7890)
+        ]
+        self.assertGreaterEqual(len(inp), grouping.SPARSE_MIN_STRINGS)
+        groups = grouping.group_similar_strings(inp, ignore_case=False)
+        self.assertEqual(sorted(sum(groups, [])), sorted(inp))
+        self.assertGreater(len(groups), 1)
+        vectors, df = grouping._tf_idf_vectors(inp, False)
+        for min_similarity in (0.425, 0.8):
+            with self.subTest(min_similarity=min_similarity):
+                sparse = grouping._sparse_components(vectors, min_similarity)
+                indexed = grouping._indexed_components(
+                    vectors, df, min_similarity
+                )
+                # Same partitions, labels may differ
+                self.assertEqual(
+                    len(set(zip(sparse, indexed))), len(set(indexed))
+                )
+                self.assertEqual(len(set(sparse)), len(set(indexed)))
+
+
+class TestTemplateRegexp(unittest.TestCase):
+    def assertTemplate(self, inp, expected):
+        reg = template.template_regexp(inp)
+        self.assertEqual(reg, expected)
+        for path in inp:
+            self.assertTrue(fullmatch(reg, path), path)
+
+    def test_columns(self):
+        self.assertTemplate(
+            ['/proc/12/fd/3', '/proc/4567/fd/10'], r'/proc/\d+/fd/\d+'
+        )
+        self.assertTemplate(
+            ['/tmp/session123.log', '/tmp/session456.log'],
+            r'/tmp/session\d+\.log',
+        )
+        self.assertTemplate(['/tmp/abc-1', '/tmp/xy-1'], r'/tmp/[^\W\d_]+\-1')
+
+    def test_letters(self):
+        self.assertTemplate(
+            ['/usr/sbin/postconf', '/usr/sbin/postsuper'],
+            r'/usr/sbin/post[^\W\d_]+',
+        )
+        self.assertTemplate(
+            ['/etc/mail.conf', '/etc/smail.conf', '/etc/mail2.conf'],
+            r'/etc/.*?mail.*?\.conf',
+        )
+        self.assertTemplate(
+            ['/lib/libfoo-1', '/lib/libbar-22', '/lib/libbaz-3'],
+            r'/lib/lib[^\W\d_]+\-\d+',
+        )
+        self.assertTemplate(
+            ['/bin/post', '/bin/postfix', '/bin/postx'],
+            r'/bin/post[^\W\d_]*',
+        )
+
+    def test_anchors(self):
+        self.assertTemplate(
+            [
+                '/usr/sbin/postconfx',
+                '/usr/sbin/semndmail.postfix',
+                '/usr/sbin/postsuperx',
+                '/usr/sbin/postlogx',
+            ],
+            r'/usr/sbin/.*?post.*?x',
+        )
+        self.assertTemplate(
+            ['/var/lib/a-1.db', '/var/lib/b_xyz-2.db'],
+            r'/var/lib/.*?\-.*?\.db',
+        )
+
+    def test_different_depth(self):
+        with self.assertRaises(ValueError):
+            template.template_regexp(['/a/b', '/a'])
+
+
+class TestUniquePaths(unittest.TestCase):
+    @staticmethod
+    def create_tree(*paths):
+        tree = NpmTree()
+        for path in paths:
+            tree._create_path(path).data = NpmNode()
+        return tree
+
+    def test_unique(self):
+        trees = [
+            self.create_tree('/etc/passwd', '/tmp/a', '/tmp/all'),
+            self.create_tree('/etc/passwd', '/tmp/b', '/tmp/all'),
+            self.create_tree('/tmp/c/d', '/tmp/all'),
+        ]
+        uniq = runs._unique_paths(trees)
+        self.assertEqual(sorted(uniq), ['/tmp/a', '/tmp/b', '/tmp/c/d'])
+        self.assertIs(uniq['/tmp/b'], trees[1].get_node_at_path('/tmp/b'))
+
+
+class TestPathGeneralizations(unittest.TestCase):
+    def test_same_as_single(self):
+        paths = [r'/tmp/a\d+', '/tmp/b.*?', r'/tmp/a\d+', r'/var/\d+/x']
+        single = NpmTree()
+        nodes = [single.add_path_generalization(p) for p in paths]
+        batch = NpmTree()
+        batch_nodes = batch.add_path_generalizations(paths)
+        self.assertEqual(
+            [single.get_path(n) for n in nodes],
+            [batch.get_path(n) for n in batch_nodes],
+        )
+        self.assertIs(batch_nodes[0], batch_nodes[2])
+        self.assertEqual(
+            sorted((n.tag, n.data is not None) for n in single.all_nodes()),
+            sorted((n.tag, n.data is not None) for n in batch.all_nodes()),
+        )
+        self.assertEqual(
+            [n.data.is_regexp for n in nodes],
+            [n.data.is_regexp for n in batch_nodes],
+        )
+
+
+class TestMergeTree(unittest.TestCase):
+    domain = (('/usr/sbin/master', 0),)
+
+    def create_tree(self, paths):
+        tree = NpmTree()
+        for path, uid, permissions, regexp, recursive in paths:
+            if regexp:
+                node = tree.add_path_generalization(path)
+            else:
+                node = tree._create_path(path)
+            if node.data is None:
+                node.data = NpmNode()
+            node.data.is_regexp = regexp
+            node.data.is_recursive |= recursive
+            access = Access(permissions)
+            access.uid = uid
+            access.domain = self.domain
+            node.data.add_access(access)
+        return tree
+
+    @staticmethod
+    def dump(tree):
+        return [
+            (
+                tree.get_path(n),
+                n.identifier,
+                n.data is not None
+                and (
+                    sorted((a.uid, a.permissions) for a in n.data),
+                    n.data.is_regexp,
+                    n.data.is_recursive,
+                ),
+            )
+            for n in (tree[nid] for nid in tree.expand_tree(sorting=False))
+        ]
+
+    def test_same_as_pairwise(self):
+        read, write = Permission.READ, Permission.WRITE
+        trees = [
+            self.create_tree(
+                [
+                    ('/etc/passwd', 0, read, False, False),
+                    (r'/tmp/.*\.log', 0, write, True, False),
+                    ('/var/lib/x', 0, read, False, False),
+                ]
+            ),
+            self.create_tree(
+                [
+                    ('/etc/passwd', 0, write, False, False),
+                    ('/etc/passwd', 1, read, False, False),
+                    ('/var/lib', 0, read | write, False, True),
+                    ('/home/a', 1, read, False, False),
+                ]
+            ),
+            self.create_tree(
+                [
+                    (r'/tmp/.*\.log', 0, read, True, False),
+                    (r'/tmp/.*\.log', 1, write, True, False),
+                    ('/etc/shadow', 0, read, False, False),
+                    ('/var/lib', 1, read, False, False),
+                ]
+            ),
+        ]
+        before = [self.dump(tree) for tree in trees]
+
+        merged = runs.merge_tree(*trees)
+        pairwise = trees[0]
+        for tree in trees[1:]:
+            pairwise = runs.merge_tree(pairwise, tree)
+        self.assertEqual(self.dump(merged), self.dump(pairwise))
+        # Input trees are not modified
+        self.assertEqual([self.dump(tree) for tree in trees], before)
+
+        nodes = {merged.get_path(n): n for n in merged.all_nodes()}
+
+        def permissions(path):
+            node = nodes[path]
+            return (
+                sorted((a.uid, a.permissions) for a in node.data),
+                node.data.is_regexp,
+                node.data.is_recursive,
+            )
+
+        self.assertEqual(
+            permissions('/etc/passwd'),
+            ([(0, read | write), (1, read)], False, False),
+        )
+        self.assertEqual(
+            permissions(r'/tmp/.*\.log'),
+            ([(0, read | write), (1, write)], True, False),
+        )
+        # Attributes of an empty node are taken from the next tree
+        self.assertEqual(
+            permissions('/var/lib'),
+            ([(0, read | write), (1, read)], False, True),
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,311 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from mpm import policy, profiling
+import io
+from mpm.tree import NpmTree, NpmNode, Access, Permission
+from mpm.mpm_types import FHSConfigRule
+from contextlib import redirect_stdout
+
+
+class TestMinimizeSpaces(unittest.TestCase):
+    @staticmethod
+    def access(permissions):
+        a = Access(permissions)
+        a.uid = 0
+        a.domain = (('/bin/a', 0),)
+        return a
+
+    def test_subsumed(self):
+        read = self.access(Permission.READ)
+        spaces = {
+            read: {
+                '/etc/passwd': False,
+                '/tmp/.*': False,
+                '/tmp/x': False,
+                '/tmp/x/y': False,
+                '/var': True,
+                '/var/log/.*': False,
+                '/var/log': False,
+            }
+        }
+        self.assertEqual(
+            policy.minimize_spaces(spaces),
+            [
+                (
+                    {
+                        '/etc/passwd': False,
+                        '/tmp/.*': False,
+                        '/tmp/x/y': False,
+                        '/var': True,
+                    },
+                    [read],
+                )
+            ],
+        )
+
+    def test_merge(self):
+        read = self.access(Permission.READ)
+        write = self.access(Permission.WRITE)
+        see = self.access(Permission.SEE)
+        spaces = {
+            read: {'/tmp/.*': False, '/tmp/x': False},
+            write: {'/etc/passwd': False},
+            see: {'/tmp/.*': False},
+        }
+        self.assertEqual(
+            policy.minimize_spaces(spaces),
+            [
+                ({'/tmp/.*': False}, [read, see]),
+                ({'/etc/passwd': False}, [write]),
+            ],
+        )
+
+    def test_recursive_marker(self):
+        read = self.access(Permission.READ)
+        write = self.access(Permission.WRITE)
+        tree = NpmTree()
+        for path, access in [
+            ('/usr/lib/locale/en/x', read),
+            ('/usr/lib/locale/de', read),
+            ('/usr/lib/locale/fr', write),
+            ('/usr/lib/other', read),
+        ]:
+            node = tree._create_path(path)
+            if node.data is None:
+                node.data = NpmNode()
+            node.data.add_access(access)
+        rule = FHSConfigRule('/usr/lib/locale', Permission.READ, True, False)
+        with redirect_stdout(io.StringIO()):
+            tree.generalize_fhs_rules([rule], [(read.uid, read.domain)])
+        spaces = policy.collect_spaces(tree)
+        self.assertEqual(spaces[read]['/usr/lib/locale/.*'], True)
+        self.assertEqual(
+            dict(policy.minimize_spaces(spaces)[0][0]),
+            {
+                '/usr/lib/locale': False,
+                '/usr/lib/locale/.*': True,
+                '/usr/lib/other': False,
+            },
+        )
+        # Members of other accesses aren't affected by the marker
+        self.assertEqual(
+            policy.minimize_spaces({write: spaces[write]}),
+            [({'/usr/lib/locale/fr': False}, [write])],
+        )
+        # A recursive member of a parent directory matches the marker
+        self.assertEqual(
+            policy.minimize_spaces(
+                {read: {'/usr': True, '/usr/lib/locale/.*': True}}
+            ),
+            [({'/usr': True}, [read])],
+        )
+
+
+class TestIncrementalPolicy(unittest.TestCase):
+    def test_update(self):
+        read = TestMinimizeSpaces.access(Permission.READ)
+        write = TestMinimizeSpaces.access(Permission.WRITE)
+        tree = NpmTree()
+        tree._create_path('/etc/passwd').data = NpmNode([read])
+        tree._create_path('/tmp/x').data = NpmNode([write])
+        incremental = policy.IncrementalPolicy()
+        self.assertEqual(incremental.policy, '')
+        profiling.enable()
+        try:
+            incremental.update(tree, {})
+            self.assertEqual(
+                incremental.policy, policy.create_constable_policy(tree, {})
+            )
+            self.assertEqual(profiling.counters['dirty policy accesses'], 2)
+            self.assertEqual(incremental.update(tree, {}), '')
+
+            profiling.enable()
+            tree._create_path('/etc/group').data = NpmNode([read])
+            changes = incremental.update(tree, {})
+            # Only the space of the changed access is generated again
+            self.assertEqual(profiling.counters['dirty policy accesses'], 1)
+            self.assertEqual(
+                profiling.counters['regenerated policy spaces'], 1
+            )
+            self.assertEqual(
+                profiling.counters['regenerated policy domains'], 0
+            )
+        finally:
+            profiling.disable()
+        self.assertIn('"/etc/group"', changes)
+        self.assertNotIn('/tmp/x', changes)
+        self.assertNotIn('primary space', changes)
+        self.assertEqual(
+            incremental.policy, policy.create_constable_policy(tree, {})
+        )
+
+    def test_not_minimized(self):
+        tree, transitions = TestConstablePolicy.create_tree()
+        incremental = policy.IncrementalPolicy(minimize=False)
+        incremental.update(tree, transitions)
+        self.assertEqual(
+            incremental.policy,
+            policy.create_constable_policy(tree, transitions, minimize=False),
+        )
+        self.assertEqual(incremental.update(tree, transitions), '')
+
+    def test_removal(self):
+        read = TestMinimizeSpaces.access(Permission.READ)
+        write = TestMinimizeSpaces.access(Permission.WRITE)
+        tree = NpmTree()
+        tree._create_path('/etc/passwd').data = NpmNode([read])
+        tree._create_path('/tmp/x').data = NpmNode([write])
+        incremental = policy.IncrementalPolicy()
+        incremental.update(tree, {})
+
+        tree.remove_node(tree.get_node_at_path('/tmp/x').identifier)
+        diff = incremental.patch(tree, {})
+        self.assertEqual(
+            incremental.policy, policy.create_constable_policy(tree, {})
+        )
+        # Unused space is removed only by the diff
+        self.assertIn('\n-space _bin_a0_W = "/tmp/x";\n', diff)
+        self.assertIn('\n-        WRITE _bin_a0_W,\n', diff)
+class TestConstablePolicy(unittest.TestCase):
+    @staticmethod
+    def create_tree():
+        domain = (('/usr/sbin/master', 0),)
+        child_domain = domain + (('/usr/lib/pickup', 89),)
+        tree = NpmTree()
+        for path, uid, d, permissions in [
+            ('/etc/passwd', 0, domain, Permission.READ),
+            ('/etc/postfix/main.cf', 0, domain, Permission.READ),
+            ('/var/spool/postfix', 89, child_domain, Permission.WRITE),
+            ('/var/spool/postfix/maildrop', 89, child_domain, Permission.READ),
+            ('/proc/12/stat', 0, domain, Permission.READ),
+            ('/proc/34/stat', 0, domain, Permission.READ),
+        ]:
+            access = Access(permissions)
+            access.uid = uid
+            access.domain = d
+            node = tree._create_path(path)
+            if node.data is None:
+                node.data = NpmNode()
+            node.data.add_access(access)
+        tree.get_node_at_path('/var/spool/postfix').data.is_recursive = True
+        transitions = {
+            (domain, 'exec', '/usr/lib/pickup'): child_domain,
+            (child_domain, 'setresuid', 0): domain,
+        }
+        return tree, transitions
+
+    def test_streamed(self):
+        tree, transitions = self.create_tree()
+        for minimize in (True, False):
+            with self.subTest(minimize=minimize):
+                expected = policy.create_constable_policy(
+                    tree, transitions, minimize=minimize
+                )
+                self.assertEqual(
+                    ''.join(
+                        policy.constable_policy_chunks(
+                            tree, transitions, minimize
+                        )
+                    ),
+                    expected,
+                )
+                out = io.StringIO()
+                self.assertIsNone(
+                    policy.create_constable_policy(
+                        tree, transitions, out, minimize
+                    )
+                )
+                self.assertEqual(out.getvalue(), expected)
+        self.assertIn('recursive "/var/spool/postfix"', expected)
+        self.assertIn('"/proc/[0-9]+/stat"', expected)
+        self.assertNotIn('"/proc/12/stat"', expected)
+
+
+class TestNameAllocator(unittest.TestCase):
+    def test_unique(self):
+        names = policy.NameAllocator()
+        allocated = [
+            names.allocate(name) for name in ['a', 'a', 'a0', 'a', 'a1', 'a']
+        ]
+        self.assertEqual(allocated, ['a', 'a0', 'a00', 'a1', 'a10', 'a2'])
+
+    def test_sanitized_collisions(self):
+        # Domains with different names that are the same after sanitizing
+        domains = [
+            (('/bin/a b', 0),),
+            (('/bin/ab', 0),),
+            (('/bin_ab', 0),),
+            (('/bin/ab', 0),),
+        ]
+        names = policy.NameAllocator()
+        allocated = []
+        for domain in domains:
+            for uid in (0, 1):
+                access = Access(Permission.READ)
+                access.uid = uid
+                access.domain = domain
+                base = policy.get_access_name(access)
+                allocated += [(base, names.allocate(base)) for _ in range(2)]
+        self.assertEqual(len({name for _, name in allocated}), len(allocated))
+        # Same names as allocated by `make_unique`
+        existing = {}
+        for base, name in allocated:
+            self.assertEqual(policy.make_unique(base, existing), name)
+            existing[name] = None
+
+
+class TestCollectSpaces(unittest.TestCase):
+    def test_members(self):
+        read = TestMinimizeSpaces.access(Permission.READ)
+        write = TestMinimizeSpaces.access(Permission.WRITE)
+        tree = NpmTree()
+        for path in ['/proc/12/stat', '/proc/34/stat', '/proc/self/status']:
+            tree._create_path(path).data = NpmNode([read])
+        tree.add_path_generalization(r'/tmp/.*\.log').data.add(write)
+        tree._create_path('/var/lib').data = NpmNode([read, write])
+        tree.get_node_at_path('/var/lib').data.is_recursive = True
+        tree._create_path('/home').data = NpmNode()
+        tree.get_node_at_path('/home').data.generalized.add(read)
+
+        spaces = policy.collect_spaces(tree)
+        self.assertEqual(
+            spaces,
+            {
+                read: {
+                    '/home/.*': False,
+                    '/proc/[0-9]+/stat': False,
+                    '/proc/self/status': False,
+                    '/var/lib': True,
+                },
+                write: {'/tmp/.*\\.log': False, '/var/lib': True},
+            },
+        )
+        # Members are in the order of the depth-first walk, children are
+        # walked in the order of their creation
+        self.assertEqual(
+            list(spaces[read]),
+            [
+                '/proc/[0-9]+/stat',
+                '/proc/self/status',
+                '/var/lib',
+                '/home/.*',
+            ],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
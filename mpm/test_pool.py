@@ -0,0 +1,113 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from mpm.fs_index import FsIndex
+from mpm.test_cases import parse_eval_cases
+from mpm.test_cases.helpers import TestCaseContext
+from mpm.test_cases.pool import generalize_cases
+from mpm.test_fs_index import create_fs
+from mpm.tree import NpmTree, NpmNode, Access, Permission
+from pathlib import Path
+from types import SimpleNamespace
+import sqlite3
+import tempfile
+
+DOMAIN = (('/usr/sbin/master', 0),)
+FHS_PATH = str(Path(__file__).parent.parent / 'fhs_rules.txt')
+
+
+def create_tree(paths):
+    tree = NpmTree()
+    for path, permissions in paths:
+        access = Access(permissions)
+        access.uid = 0
+        access.domain = DOMAIN
+        node = tree._create_path(path)
+        if node.data is None:
+            node.data = NpmNode()
+        node.data.add_access(access)
+    return tree
+
+
+def create_context(db) -> TestCaseContext:
+    """Return context with two runs of a service that differ in the names of
+    files in `/home`."""
+    common = [
+        ('/etc/passwd', Permission.READ),
+        ('/etc/shadow', Permission.READ),
+        ('/nonexistent/x', Permission.WRITE),
+    ]
+    trees = [
+        create_tree(common + [('/home/alice/notes', Permission.WRITE)]),
+        create_tree(common + [('/home/bob/notes', Permission.WRITE)]),
+    ]
+    ctx = TestCaseContext(
+        trees[0], 'case', '', [['ctx']], [[]], [[DOMAIN]], db, FHS_PATH
+    )
+    ctx.trees = trees
+    return ctx
+
+
+def dump(tree: NpmTree) -> list:
+    """Return comparable representation of `tree`."""
+    return sorted(
+        (
+            tree.get_path(n),
+            n.data is not None
+            and (
+                sorted((a.permissions, a.uid, a.domain) for a in n.data),
+                n.data.is_regexp,
+                n.data.is_recursive,
+            ),
+        )
+        for n in tree.all_nodes()
+    )
+
+
+class TestPool(unittest.TestCase):
+    def test_jobs(self):
+        eval_cases = parse_eval_cases(
+            ['no generalization', 'T', 'N', 'M', 'M+T', 'N+T', 'M+N']
+        )
+        with tempfile.TemporaryDirectory() as d:
+            db_path = str(Path(d) / 'test.db')
+            con = sqlite3.connect(db_path)
+            create_fs(con)
+            db = FsIndex(SimpleNamespace(cur=con.cursor()))
+
+            serial = list(
+                generalize_cases(eval_cases, create_context(db), db_path)
+            )
+            parallel = list(
+                generalize_cases(
+                    eval_cases, create_context(db), db_path, 2, True
+                )
+            )
+            con.close()
+
+        self.assertEqual(len(serial), len(eval_cases))
+        self.assertEqual(len(parallel), len(eval_cases))
+        for (tree1, results1), (tree2, results2) in zip(serial, parallel):
+            self.assertEqual(dump(tree1), dump(tree2))
+            self.assertEqual(results1, results2)
+        # Files of both runs are covered by the multiple runs generalizer
+        results = dict(zip(eval_cases, serial))['M'][1][0]
+        self.assertEqual(results[8], (0, 1))
+        self.assertEqual(results[9], (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from mpm import profiling
+from pathlib import Path
+import tempfile
+import json
+
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        profiling.disable()
+
+    def test_disabled(self):
+        profiling.disable()
+        with profiling.timer('x'):
+            pass
+        self.assertIsNone(profiling.take())
+
+    def test_report(self):
+        profiling.enable()
+        double = profiling.timed('double', items=len)(lambda l: l * 2)
+        double([1, 2])
+        double([3])
+        with profiling.timer('block') as measurement:
+            measurement.items += 5
+        profiling.count('events', 2)
+        double_timing = profiling.timers['double']
+        self.assertEqual((double_timing.calls, double_timing.items), (2, 6))
+
+        worker = profiling.take()
+        self.assertEqual(profiling.timers, {})
+        profiling.merge(worker)
+        profiling.merge(worker)
+        self.assertEqual(profiling.timers['block'].items, 10)
+        self.assertEqual(profiling.counters['events'], 4)
+
+        with tempfile.TemporaryDirectory() as d:
+            profiling.write_report(Path(d) / 'case')
+            with open(Path(d) / 'case' / 'profile.json') as f:
+                report = json.load(f)
+            self.assertEqual(report['timers']['double']['calls'], 4)
+            self.assertGreater(report['peak_rss'], 0)
+            with open(Path(d) / 'case' / 'profile.csv') as f:
+                self.assertIn('timer,double,4,12,', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#  Copyright (C) 2023 Roderik Ploszek
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+from mpm import session
+from pathlib import Path
+import tempfile
+import sqlite3
+from types import SimpleNamespace
+
+
+class TestDatabaseSession(unittest.TestCase):
+    def test_transaction(self):
+        with tempfile.TemporaryDirectory() as d:
+            con = sqlite3.connect(Path(d) / 'test.db')
+            con.execute('CREATE TABLE t (x INTEGER)')
+            db = session.DatabaseSession(
+                SimpleNamespace(cur=con.cursor()), scratch=True, timing=True
+            )
+            mode = db.cur.execute('PRAGMA journal_mode').fetchone()
+            self.assertEqual(mode, ('wal',))
+
+            with session.transaction(db):
+                # Nested transactions don't commit
+                with session.transaction(db):
+                    db.cur.execute('INSERT INTO t VALUES (1)')
+                self.assertTrue(con.in_transaction)
+                db.cur.executemany('INSERT INTO t VALUES (?)', [(2,), (3,)])
+            self.assertFalse(con.in_transaction)
+
+            self.assertEqual(
+                [x for x, in db.cur.execute('SELECT x FROM t')], [1, 2, 3]
+            )
+            timing = db.stats['INSERT INTO t VALUES (?)']
+            self.assertEqual((timing.calls, timing.rows), (1, 2))
+            self.assertEqual(db.stats['SELECT x FROM t'].rows, 3)
+            con.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,14 +18,16 @@ from treelib import Tree
 from treelib.exceptions import NodeIDAbsentError
 from treelib.node import Node
 from typing import Callable, Self
-from collections import Counter
+from collections import Counter, defaultdict
 from pprint import pprint
-from collections.abc import Iterable
+from collections.abc import Container, Iterable
 from mpm.permission import Permission
 from mpm.mpm_types import AuditEntry, FHSConfigRule
+from mpm.fhs import compile_fhs_rules, load_fhs_rules, parse_fhs_rules
 from mpm.generalize.generalize import generalize_nonexistent
 from mpm.domain import get_current_euid
 from fs2json.db import DatabaseRead, DatabaseWriter
+import mpm.db
 
 from mpm.config import (
     OwnerGeneralizationStrategy,
@@ -35,8 +37,10 @@ from mpm.config import (
 )
 import sys
 from copy import copy
-from re import search, fullmatch, split
-from bitarray import bitarray as Bitarray
+from re import search, fullmatch
+from mpm.evaluator import CompiledTree
+from mpm.fs_index import FsIndex
+from mpm.profiling import timed
 
 
 class Access:
@@ -77,6 +81,12 @@ class Access:
             )
         return repr
 
+    def with_permissions(self, permissions: Permission) -> Self:
+        """Return copy of this access with different `permissions`."""
+        access = copy(self)
+        access.permissions = permissions
+        return access
+
     def full_repr(self) -> str:
         return f'<{self.domain} ({self.uid}): {self.permissions}>'
 
@@ -121,6 +131,9 @@ class NpmNode(set):
         `add_access` is called with another access with the same uid and domain,
         but with WRITE permission, the new permissions will be set to
         `READ|WRITE`.
+
+        The existing access is replaced by a new `Access` object, it's never
+        modified. `Access` objects can therefore be shared by multiple trees.
         """
         for a in s:
             if access.uid == a.uid and access.domain == a.domain:
@@ -134,8 +147,7 @@ class NpmNode(set):
                     print("Obsah:")
                     pprint(s)
                     sys.exit(-1)
-                a.permissions = access.permissions | a.permissions
-                s.add(a)
+                s.add(a.with_permissions(access.permissions | a.permissions))
                 return
         s.add(access)
 
@@ -158,8 +170,22 @@ class NpmNode(set):
         This should be used on NpmNodes that belong to a `Node` with the same
         tag!
         """
+        # Same as `add_access` for every access from `other`, but accesses are
+        # looked up by their uid and domain
+        subjects: dict[tuple, Access] = {}
+        for a in self:
+            subjects.setdefault((a.uid, a.domain), a)
         for access in other:
-            self.add_access(access)
+            key = (access.uid, access.domain)
+            if (a := subjects.get(key)) is None:
+                self.add(access)
+                subjects[key] = access
+                continue
+            self.remove(a)
+            a = subjects[key] = a.with_permissions(
+                access.permissions | a.permissions
+            )
+            self.add(a)
 
 
 class GenericTree(Tree):
@@ -231,6 +257,7 @@ class NpmTree(GenericTree):
         entries = filter(lambda x: bool(x), path.split('/'))
         return GenericTree._create_path(self, entries)
 
+    @timed('NpmTree.load_log')
     def load_log(self, log: Iterable[AuditEntry]):
         # TODO: Also normalize accesses. If someone requests write, it should
         # get the highest priority.
@@ -261,46 +288,17 @@ class NpmTree(GenericTree):
         )
 
     @staticmethod
-    def _parse_raw_perms(raw_perms: str) -> tuple[Permission, bool]:
-        perms = Permission(0)
-        recursive = False
-        for c in raw_perms:
-            match c:
-                case 'r':
-                    recursive = True
-                case 'R':
-                    perms |= Permission.READ
-                case 'W':
-                    perms |= Permission.WRITE
-                case 'S':
-                    perms |= Permission.SEE
-        return perms, recursive
+    def load_fhs_config(f) -> list[FHSConfigRule]:
+        """Parse FHS config and return FHS rules, see `mpm.fhs`."""
+        return [
+            c.rule
+            for c in parse_fhs_rules(f, getattr(f, 'name', '<string>'))
+        ]
 
     @staticmethod
-    def load_fhs_config(f) -> list[FHSConfigRule]:
-        """Parse FHS config and return FHS rules."""
-        # TODO: Probably move this to the parser module
-        ret: list[FHSConfigRule] = []
-        for l in f:
-            if l[0] == '#' or l == '\n':
-                # This is a comment or an empty line
-                continue
-            match split(r'\t+', l.rstrip()):
-                case (path, raw_perms, regexp):
-                    perms, recursive = NpmTree._parse_raw_perms(raw_perms)
-                    if regexp == 'reg':
-                        regexp = True
-                    else:
-                        raise RuntimeError(f'Invalid value: {regexp}')
-                case (path, raw_perms):
-                    perms, recursive = NpmTree._parse_raw_perms(raw_perms)
-                    regexp = False
-                case [path]:
-                    perms, recursive = NpmTree._parse_raw_perms(raw_perms)
-                    regexp = False
-            rule = FHSConfigRule(path, perms, recursive, regexp)
-            ret.append(rule)
-        return ret
+    def load_fhs_file(*paths: str) -> tuple[FHSConfigRule, ...]:
+        """Load FHS config files at `paths`, see `mpm.fhs.load_fhs_rules`."""
+        return load_fhs_rules(*paths)
 
     def get_parent(self, node: Node) -> Node:
         """Return parent Node object for node"""
@@ -333,10 +331,10 @@ class NpmTree(GenericTree):
     def is_regexp(s: str) -> bool:
         """Return `True` if `s` is a regexp.
 
-        Currently support just `.`. Needs to be updated to support more types of
-        regexps.
+        Currently support just `.` and escape sequences (`\\d`, escaped
+        characters). Needs to be updated to support more types of regexps.
         """
-        return '.' in s
+        return '.' in s or '\\' in s
 
     def _add_path_generalization(
         self, parent: Node, entries: list[str]
@@ -392,6 +390,39 @@ class NpmTree(GenericTree):
         parent = self.npm_root
         return self._add_path_generalization(parent, entries)
 
+    def add_path_generalizations(self, paths: Iterable[str]) -> list[Node]:
+        """Add multiple regexp generalizations to the tree.
+
+        Same as calling `add_path_generalization` for every path, but children
+        of every node are looked up by their tag in a dictionary instead of
+        searching all successors for every path component.
+
+        :returns: Nodes of `paths` in the same order.
+        """
+        # Maps identifier of a node to its children by their tags
+        children: dict[str, dict[str, Node]] = {}
+        ret = []
+        for path in paths:
+            assert path[0] == '/'
+            if len(path) > 1:
+                assert path[-1] != '/'
+            parent = self.npm_root
+            for e in filter(lambda x: bool(x), path.split('/')):
+                if (tags := children.get(parent.identifier)) is None:
+                    tags = children[parent.identifier] = {
+                        child.tag: child
+                        for child in self.children(parent.identifier)
+                    }
+                if (node := tags.get(e)) is None:
+                    data = NpmNode()
+                    data.is_regexp = self.is_regexp(e)
+                    node = tags[e] = self.create_node(
+                        e, parent=parent.identifier, data=data
+                    )
+                parent = node
+            ret.append(parent)
+        return ret
+
     def generalize(self, node: Node, verbose=False) -> None:
         """Do a recursive depth-first search and on the way up TODO:
         finish
@@ -620,8 +651,13 @@ class NpmTree(GenericTree):
             if not generalized:
                 continue
 
-            # Search if it doesn't exist already
-            children = self.search_children_by_tag(node, '.*')
+            # Search if it doesn't exist already, recursive markers are kept
+            # separate
+            children = [
+                child
+                for child in self.search_children_by_tag(node, '.*')
+                if child.data is None or not child.data.is_recursive
+            ]
             assert len(children) <= 1
 
             if not children:
@@ -636,51 +672,92 @@ class NpmTree(GenericTree):
 
             node.data.generalized.clear()
 
-    def test_accesses(self, b, medusa_domains: Iterable, verbose: bool = False):
+    def test_accesses(
+        self,
+        b,
+        medusa_domains: Iterable,
+        verbose: bool = False,
+        compiled: CompiledTree | None = None,
+    ):
         """
         :param b: Input reference table of accesses.
         :param medusa_domains: `Iterable` of domains to be checked for.
+        :param compiled: This tree compiled by `CompiledTree`. Pass it when
+        testing the same tree multiple times, so it's compiled only once.
+
+        Permissions of all accesses of `medusa_domains` that cover a path are
+        joined, see `mpm.evaluator`.
         """
         # This is still a work in progress, but I plan `B` to be an iterable
         # containing tuples in the form of (path, read, write)
-        results = []
-        for path, read, write in b:
-            node = self.get_node_at_path(
-                path, search_regexp=True, verbose=False
-            )
-            if node is None or not node.data:
-                # Path not found or no permissions for the node
-                results.append((0, 0))
-                continue
-            for access in node.data:
-                if access.domain in medusa_domains:
-                    result = (
-                        1 if access.permissions & Permission.READ else 0,
-                        1 if access.permissions & Permission.WRITE else 0,
-                    )
-                    results.append(result)
-                    break
-            else:
-                results.append((0, 0))
+        if compiled is None:
+            compiled = CompiledTree(self)
+        return compiled.test_accesses(b, medusa_domains)
 
-        # true_positive = 0
-        # false_negative = 0
-        # true_negative = 0
-        print(len(b), len(results))
-        assert len(b) == len(results)
+    def get_medusa_results(
+        self, db: DatabaseRead, medusa_domains: set[tuple[tuple]]
+    ) -> dict[int, tuple[int, int]]:
+        """Compute Medusa results for paths from the database covered by the
+        tree.
 
-        reference_results = Bitarray((read for _, read, _ in b))
-        reference_results.extend((write for _, _, write in b))
+        This only reads the database, so it can be executed in parallel for
+        different trees.
 
-        medusa_results = Bitarray((read for read, _ in results))
-        medusa_results.extend((write for _, write in results))
+        :param medusa_domains: Domains that will be used to determine access. If
+        *at least one* domain enables the operation, the access is considered
+        allowed.
+        :returns: Dictionary that maps path rowid to the tuple of read and write
+        results. If more nodes cover the same path, the last one wins.
+        """
+        # Permissions of recursive markers that apply to all nodes under a
+        # node, by identifier of the node
+        below: dict[str, Permission] = {}
+
+        def below_permissions(node: Node) -> Permission:
+            nid = node.identifier
+            if (ret := below.get(nid)) is None:
+                parent = self.parent(nid)
+                ret = Permission(0) if parent is None else below_permissions(parent)
+                if (marker := self.get_recursive_marker(node)) is not None:
+                    ret |= self._domain_permissions(marker.data, medusa_domains)
+                below[nid] = ret
+            return ret
+
+        results: dict[int, tuple[int, int]] = {}
+        for node in self.all_nodes_itr():
+            parent = self.parent(node.identifier)
+            permissions = (
+                Permission(0) if parent is None else below_permissions(parent)
+            )
+            if data := node.data:
+                permissions |= self._domain_permissions(data, medusa_domains)
+            elif not permissions:
+                continue
 
-        tp = (reference_results & medusa_results).count()
-        tn = (~reference_results & ~medusa_results).count()
-        overpermission = (~reference_results & medusa_results).count()
-        underpermission = (reference_results & ~medusa_results).count()
+            result = (
+                1 if permissions & Permission.READ else 0,
+                1 if permissions & Permission.WRITE else 0,
+            )
+            # Get all path_rowids that apply to this node
+            for path_rowid in self.node_to_db_paths(db, node):
+                results[path_rowid] = result
+        return results
 
-        return (tp, underpermission, overpermission, tn)
+    @staticmethod
+    def _domain_permissions(
+        data: NpmNode, medusa_domains: Container[tuple[tuple]]
+    ) -> Permission:
+        """Return permissions of accesses from `data` of all `medusa_domains`
+        together."""
+        # TODO: Linear search bottleneck
+        permissions = Permission(0)
+        for access in data:
+            if access.domain in medusa_domains:
+                # Add all permissions together
+                # This lowers the precision, but it's impossible to compare
+                # multiple domains with just one reference domain
+                permissions |= access.permissions
+        return permissions
 
     def insert_medusa_accesses(
         self,
@@ -689,6 +766,7 @@ class NpmTree(GenericTree):
         eval_case: str,
         subject_contexts: Iterable[str],
         medusa_domains: set[tuple[tuple]],
+        results: dict[int, tuple[int, int]] | None = None,
     ) -> None:
         """Insert Medusa accesses into accesses table.
 
@@ -701,6 +779,8 @@ class NpmTree(GenericTree):
         :param medusa_domains: Domains that will be used to determine access. If
         *at least one* domain enables the operation, the access is considered
         allowed.
+        :param results: Results computed in advance by `get_medusa_results`. If
+        `None`, they are computed here.
         """
         case_id = db.get_case_id(case)
         subject_cids = [
@@ -711,36 +791,12 @@ class NpmTree(GenericTree):
         perms = ('read', 'write')
         perms_id = db.get_operations_id(perms)
 
-        for node in self.all_nodes_itr():
-            if not (data := node.data):
-                continue
-            # TODO: Linear search bottleneck
-            permissions = Permission(0)
-            for access in data:
-                if access.domain in medusa_domains:
-                    # Add all permissions together
-                    # This lowers the precision, but it's impossible to compare
-                    # multiple domains with just one reference domain
-                    permissions |= access.permissions
+        if results is None:
+            results = self.get_medusa_results(db, medusa_domains)
 
-            # Get all path_rowids that apply to this node
-            path_rowids = self.node_to_db_paths(db, node)
-
-            # This needs to go into a loop
-            for path_rowid in path_rowids:
-                # print(f'inserting {path_rowid} {node.tag}')
-                results = (
-                    1 if permissions & Permission.READ else 0,
-                    1 if permissions & Permission.WRITE else 0,
-                )
-                for subject_cid in subject_cids:
-                    access_id = db.insert_or_select_access(
-                        case_id, subject_cid, path_rowid
-                    )
-                    for perm_id, result in zip(perms_id, results):
-                        db.insert_result(
-                            access_id, perm_id, None, eval_case_id, result
-                        )
+        mpm.db.insert_medusa_accesses(
+            db, case_id, subject_cids, perms_id, eval_case_id, results
+        )
 
     def fill_missing_medusa_accesses(
         self,
@@ -770,119 +826,24 @@ class NpmTree(GenericTree):
         perms = ('read', 'write')
         perms_id = db.get_operations_id(perms)
         eval_case_id = db.insert_or_select_eval_case(eval_case)
-        res = db.cur.execute(
-            f"""WITH RECURSIVE child AS
-  (SELECT accesses.rowid AS access_rowid,
-          accesses.node_rowid,
-          accesses.subject_cid,
-          contexts.name AS subject_context,
-          fs.rowid,
-          fs.parent,
-          fs.name,
-          type,
-          fs.selinux_user,
-          fs.selinux_role,
-          fs.selinux_type,
-          fs.selinux_category,
-          fs.selinux_sensitivity,
-          operations.rowid AS operation_id,
-          operation,
-          results.reference_result,
-          medusa_results.medusa_result
-   FROM accesses
-   JOIN contexts ON subject_cid = contexts.rowid
-   JOIN fs ON node_rowid = fs.rowid
-   LEFT JOIN results ON accesses.ROWID = results.access_id
-   LEFT JOIN operations ON results.operation_id = operations.rowid
-   JOIN eval_cases
-   LEFT JOIN medusa_results ON results.rowid = medusa_results.result_id AND eval_cases.rowid = medusa_results.eval_case_id
-   WHERE case_id = ?
-     AND subject_cid IN ({','.join(str(x) for x in subject_cids)})
-     AND eval_cases.rowid = ?
-     AND medusa_result IS NULL
-   UNION ALL SELECT access_rowid,
-                    node_rowid,
-                    subject_cid,
-                    subject_context,
-                    fs.rowid,
-                    fs.parent,
-                    fs.name || '/' || child.name,
-                    child.type,
-                    child.selinux_user,
-                    child.selinux_role,
-                    child.selinux_type,
-                    child.selinux_category,
-                    child.selinux_sensitivity,
-                    operation_id,
-                    operation,
-                    reference_result,
-                    medusa_result
-   FROM fs,
-        child
-   WHERE child.parent = fs.rowid )
-SELECT access_rowid,
-       subject_cid,
-       subject_context,
-       node_rowid,
-       name AS path,
-       TYPE,
-       selinux_user || ':' || selinux_role || ':' || selinux_type || ':' || selinux_sensitivity || COALESCE(':' || selinux_category, '') AS selinux_context,
-       operation_id,
-       operation,
-       reference_result,
-       medusa_result
-FROM child
-WHERE rowid = 1
-        """,
-            (case_id, eval_case_id),
+
+        mpm.db.create_path_table(db)
+        accesses = mpm.db.get_missing_medusa_accesses(
+            db, case_id, subject_cids, eval_case_id
         )
-        accesses = res.fetchall()
-        for (
-            access_id,
-            subject_cid,
-            subject_context,
-            path_rowid,
-            path,
-            _type,
-            selinux_context,
-            operation_id,
-            operation,
-            reference_result,
-            medusa_result,
-        ) in accesses:
-
-            # Get node applicable for this path
-            node = self.get_node_at_path(
-                path, search_regexp=True, verbose=True, search_recursive=True
-            )
 
-            if node is None or not (data := node.data):
-                # TODO: What if it's a visited folder??? Needs to have at least
-                # read.
-                #
-                # Permission not allowed
-                for perm_id, result in zip(perms_id, (0, 0)):
-                    db.insert_result(
-                        access_id, perm_id, None, eval_case_id, result
-                    )
-                continue
+        # Paths are evaluated against the compiled tree, which includes
+        # accesses of recursive markers
+        read, write = CompiledTree(self).evaluate(
+            (path for _, path in accesses), medusa_domains
+        )
+        # TODO: What if it's a visited folder??? Needs to have at least read.
+        results: list[tuple[int, tuple[int, int]]] = [
+            (access_id, (r, w))
+            for (access_id, _), r, w in zip(accesses, read, write)
+        ]
 
-            # TODO: Linear search bottleneck
-            permissions = Permission(0)
-            for access in data:
-                if access.domain in medusa_domains:
-                    # Add all permissions together
-                    # This lowers the precision, but it's impossible to compare
-                    # multiple domains with just one reference domain
-                    permissions |= access.permissions
-
-            # print(f'inserting {path_rowid} {node.tag}')
-            results = (
-                1 if permissions & Permission.READ else 0,
-                1 if permissions & Permission.WRITE else 0,
-            )
-            for perm_id, result in zip(perms_id, results):
-                db.insert_result(access_id, perm_id, None, eval_case_id, result)
+        mpm.db.insert_medusa_results(db, perms_id, eval_case_id, results)
 
     # TODO: override this function without copying so much stuff from the
     # library
@@ -1029,6 +990,13 @@ WHERE rowid = 1
                     return parent
                 parent = exists
             else:
+                if (
+                    search_regexp
+                    and (marker := self.get_nearest_recursive_marker(parent))
+                    is not None
+                ):
+                    # Path is under a recursive marker
+                    return marker
                 if verbose:
                     print(f'Path {path} is not in the tree.', file=sys.stderr)
                 return None
@@ -1064,10 +1032,14 @@ WHERE rowid = 1
 
         # Handle regexp node
         ret = []
-        children = db.get_children_rowids_and_names(parent)
-        children = [
-            a[0] for a in filter(lambda x: fullmatch(node.tag, x[1]), children)
-        ]
+        if isinstance(db, FsIndex):
+            children = db.get_matching_children(parent, node.tag)
+        else:
+            children = db.get_children_rowids_and_names(parent)
+            children = [
+                a[0]
+                for a in filter(lambda x: fullmatch(node.tag, x[1]), children)
+            ]
 
         for child in children:
             ret.extend(NpmTree._node_to_db_paths(db, nodes[1:], child))
@@ -1100,111 +1072,217 @@ WHERE rowid = 1
         # caller
         return parent
 
-    def _create_missing_star_nodes(self, parent: Node) -> None:
-        """Create `.*` regexp nodes under `parent` (inclusive)."""
-        nodes = [
-            self[y] for y in self.expand_tree(parent.identifier, sorting=False)
-        ]
-        for node in nodes:
-            star_nodes = self.search_children_by_tag(node, '.*')
-            assert len(star_nodes) <= 1
-            if star_nodes:
-                print('star nodes:', star_nodes)
-                continue
-            # We have to create a new '.*' node
-            # TODO: refactor into a procedure in `generalize_by_owner_directory`
+    def get_recursive_marker(self, node: Node) -> Node | None:
+        """Return recursive regexp node under `node` or `None`.
+
+        The marker stands for everything under `node`: its accesses apply to
+        all nodes under `node` and to paths under `node` that are not in the
+        tree, see `get_node_at_path`.
+        """
+        for nid in node.successors(self.identifier):
+            child = self[nid]
+            if (
+                (data := child.data)
+                and data.is_regexp
+                and data.is_recursive
+            ):
+                return child
+        return None
+
+    def get_nearest_recursive_marker(self, node: Node) -> Node | None:
+        """Return recursive marker of `node` or of its nearest ancestor that
+        has one."""
+        while node is not None:
+            if (marker := self.get_recursive_marker(node)) is not None:
+                return marker
+            node = self.parent(node.identifier)
+        return None
+
+    @staticmethod
+    def _add_fhs_accesses(
+        node: Node,
+        rule: FHSConfigRule,
+        access_info: Iterable[tuple[int, tuple]],
+    ) -> None:
+        """Add accesses of `rule` to `node`."""
+        if (data := node.data) is None:
+            node.data = NpmNode()
+            data = node.data
+
+        if rule.recursive and node.tag == '.*':
+            # `.*` nodes of recursive rules are recursive markers, they
+            # should have `is_recursive` attribute set so that permission
+            # computation will work correctly.
+            data.is_recursive = True
+
+        for uid, domain in access_info:
+            access = Access(rule.permissions)
+            access.uid = uid
+            access.domain = domain
+
+            data.add_access(access)
+
+    def _add_recursive_fhs_accesses(
+        self,
+        node: Node,
+        rule: FHSConfigRule,
+        access_info: Iterable[tuple[int, tuple]],
+    ) -> None:
+        """Add accesses of recursive `rule` to `node` and its recursive
+        marker.
+
+        The marker is a separate `.*` node. A non-recursive `.*` node that
+        was created by generalizers isn't reused, otherwise its accesses would
+        apply to the whole subtree.
+        """
+        if node.tag == '.*' and (data := node.data) and not data.is_recursive:
+            # The rule ends with `.*` that has accesses of other rules or
+            # generalizers, mark its parent instead
+            node = self.parent(node.identifier)
+        else:
+            self._add_fhs_accesses(node, rule, access_info)
+            if node.tag == '.*':
+                # `_add_fhs_accesses` made it recursive already
+                return
+        if (marker := self.get_recursive_marker(node)) is None:
             regex_node = NpmNode()
             regex_node.is_regexp = True
+            regex_node.is_recursive = True
+            marker = self.create_node('.*', parent=node, data=regex_node)
+        self._add_fhs_accesses(marker, rule, access_info)
 
-            print(f'creating under {node.tag}')
-            self.create_node('.*', parent=node, data=regex_node)
+    def _add_rule_accesses(
+        self,
+        node: Node,
+        rule: FHSConfigRule,
+        access_info: Iterable[tuple[int, tuple]],
+    ) -> None:
+        """Add accesses of `rule` to `node`, which is the last node of the
+        rule's path."""
+        if rule.recursive:
+            self._add_recursive_fhs_accesses(node, rule, access_info)
+        else:
+            self._add_fhs_accesses(node, rule, access_info)
 
-    def _generalize_fhs_rule(
+    def _generalize_fhs_rules(
         self,
-        parent_node: Node,
-        children: list[str],
-        regexp: bool,
-        recursive: bool,
-    ) -> list[Node]:
-        """Recursive method for searching nodes according to children.
-
-        Order of method calls is important! Since this function transforms
-        recursive rules into regexps (only according to the `children` path),
-        this method should be called last when fixing underpermissions.
+        node: Node,
+        batch: list[tuple[int, int]],
+        rules: tuple[tuple[FHSConfigRule, tuple[str, ...], tuple], ...],
+        access_info: list[tuple[int, tuple]],
+    ) -> None:
+        """Apply rules that reached `node`.
+
+        Rules are processed in their order, so nodes created by a rule are
+        visible only to the following rules, the same way as if the rules were
+        applied one by one. Rules that continue to the same child are collected
+        and the child is processed once for all of them.
+
+        Order of method calls is important! Since recursive rules are
+        transformed into recursive regexp markers (only according to their
+        path), this method should be called last when fixing underpermissions.
+
+        :param batch: List of `(rule index, number of matched components)`
+        sorted by rule index.
+        :param rules: Rules compiled by `compile_fhs_rules`.
         """
-        if not children:
-            if recursive:
-                # Create missing .* regexp nodes. These nodes will have
-                # `is_regexp` attribute set in their `data` `NpmNode`.
-                self._create_missing_star_nodes(parent_node)
-                # We have to return `parent_node` and recursively all its
-                # children
-                return [
-                    self[i]
-                    for i in self.expand_tree(
-                        parent_node.identifier, sorting=False
-                    )
-                ]
-            # Final component, this should be returned
-            return [parent_node]
+        # Rules that continue to children, by identifier of the child
+        pending: defaultdict[str, list[tuple[int, int]]] = defaultdict(list)
+
+        for i, depth in batch:
+            rule, components, patterns = rules[i]
+            if depth == len(components):
+                # Rule for the root. Accesses of rules that end in other nodes
+                # are added by their parents.
+                self._add_rule_accesses(node, rule, access_info)
+                continue
 
-        ret: list[Node] = []
-        child = children[0]
-        if regexp:
-            regexp_found = False
-        for y in parent_node.successors(self.identifier):
-            node = self[y]
-            if node.data and node.data.is_regexp:
-                # This is a regexp node
-                if regexp:
-                    if node.tag == child:
+            child = components[depth]
+            last = depth + 1 == len(components)
+            matched: list[Node] = []
+            if rule.regexp:
+                regexp_found = False
+            for y in node.successors(self.identifier):
+                n = self[y]
+                if (data := n.data) and data.is_regexp:
+                    # This is a regexp node
+                    if data.is_recursive and not (rule.recursive and last):
+                        # Recursive markers cover the whole subtree, only
+                        # recursive rules can add accesses to them
+                        continue
+                    if rule.regexp and n.tag == child:
                         # Regexp pattern is the same, we take this node.
                         regexp_found = True
-                        ret.extend(
-                            self._generalize_fhs_rule(
-                                node, children[1:], regexp, recursive
-                            )
-                        )
-                # We are not searching for regexp nodes, but for a specific
-                # path. Therefore we continue with the next successor.
-                continue
-            # It is a literal node
-            if regexp:
-                # `child` is a regexp pattern, `node.tag` is literal.
-                if fullmatch(child, node.tag):
-                    ret.extend(
-                        self._generalize_fhs_rule(
-                            node, children[1:], regexp, recursive
-                        )
-                    )
-                if child == node.tag:
-                    # This is a special case when regexp is the same as the
-                    # literal node. This means that `child` is a literal string
-                    # without expanding characters. We consider this situation
-                    # the same as if the regex has been found.
-                    regexp_found = True
-            elif node.tag == child:
-                # Literal node was found
-                ret.extend(
-                    self._generalize_fhs_rule(
-                        node, children[1:], regexp, recursive
-                    )
+                        matched.append(n)
+                    # We are not searching for regexp nodes, but for a
+                    # specific path. Therefore we continue with the next
+                    # successor.
+                    continue
+                # It is a literal node
+                if rule.regexp:
+                    # `child` is a regexp pattern, `n.tag` is literal.
+                    if patterns[depth].fullmatch(n.tag):
+                        matched.append(n)
+                    if child == n.tag:
+                        # This is a special case when regexp is the same as
+                        # the literal node. This means that `child` is a
+                        # literal string without expanding characters. We
+                        # consider this situation the same as if the regex
+                        # has been found.
+                        regexp_found = True
+                elif n.tag == child:
+                    # Literal node was found
+                    matched.append(n)
+
+            for n in matched:
+                if last:
+                    # Following rules have to see the accesses (regexp nodes
+                    # without accesses are considered literal)
+                    self._add_rule_accesses(n, rule, access_info)
+                else:
+                    pending[n.identifier].append((i, depth + 1))
+
+            if rule.regexp and not regexp_found:
+                # Create the missing regexp
+                created = self._create_path_regexp(
+                    node, list(components[depth:])
                 )
-        if regexp and not regexp_found:
-            # Create the missing regexp
-            ret.extend([self._create_path_regexp(parent_node, children)])
-        if not ret:
-            # If we went this far, regexp should have been created. If not, it's
-            # necessary to examine the situation
-            assert not regexp
-            # We haven't found the node. Let's construct a path from what's left
-            # of `children`.
-            return [self._create_path_generic(children, parent_node)]
-        return ret
+            elif not matched:
+                # We haven't found the node. Let's construct a path from
+                # what's left of `components`.
+                created = self._create_path_generic(components[depth:], node)
+            else:
+                continue
+            self._add_rule_accesses(created, rule, access_info)
+
+        for nid, child_batch in pending.items():
+            self._generalize_fhs_rules(self[nid], child_batch, rules, access_info)
+
+    def generalize_fhs_rules(
+        self,
+        rules: Iterable[FHSConfigRule],
+        access_info: Iterable[tuple[int, tuple]],
+    ) -> None:
+        """Generalize `rules` in the tree in one traversal.
+
+        The result is the same as if `generalize_fhs_rule` was called for every
+        rule in the given order.
+
+        :param access_info: Iterable of tuples that consist of:
+        uid: eUID of the domain
+        domain: domain tuple
+        """
+        compiled = compile_fhs_rules(rules)
+        self._generalize_fhs_rules(
+            self.npm_root,
+            [(i, 0) for i in range(len(compiled))],
+            compiled,
+            list(access_info),
+        )
 
     def generalize_fhs_rule(
-        self, rule: FHSConfigRule, access_info: Iterable[tuple[int, str, tuple]]
-    ) -> list[Node]:
+        self, rule: FHSConfigRule, access_info: Iterable[tuple[int, tuple]]
+    ) -> None:
         """Generalize rule in the tree.
 
         :param rule: `FHSConfigRule` object containing the path and information
@@ -1214,33 +1292,7 @@ WHERE rowid = 1
         uid: eUID of the domain
         domain: domain tuple
         """
-        path = rule.path
-        permissions = rule.permissions
-        recursive = rule.recursive
-        regexp = rule.regexp
-        assert path[0] == '/'
-        if len(path) > 1:
-            assert path[-1] != '/'
-        entries = list(filter(lambda x: bool(x), path.split('/')))
-        parent = self.npm_root
-        nodes = self._generalize_fhs_rule(parent, entries, regexp, recursive)
-        for node in nodes:
-            if (data := node.data) is None:
-                node.data = NpmNode()
-                data = node.data
-
-            if recursive and node.tag == '.*':
-                # All `.*` nodes under a recursive node should have
-                # `is_recursive` attribute set so that permission computation
-                # will work correctly.
-                data.is_recursive = True
-
-            for uid, domain in access_info:
-                access = Access(permissions)
-                access.uid = uid
-                access.domain = domain
-
-                data.add_access(access)
+        self.generalize_fhs_rules([rule], access_info)
 
     def print_backend(
         self,
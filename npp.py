@@ -20,10 +20,14 @@ from mpm.policy import create_constable_policy
 from mpm.parser import parse_log
 from pprint import pprint
 from fs2json.db import DatabaseWriter
+from mpm.fs_index import FsIndex
+from mpm.session import DatabaseSession, transaction
 from more_itertools import split_at
 from mpm.contexts.objects import get_object_types_by_name
 from mpm.contexts.subjects import get_subject_context_by_name
 import mpm.test_cases
+import mpm.test_cases.pool
+import mpm.profiling
 from fs2json.evaluation import Result
 from getopt import getopt, GetoptError
 from typing import Any
@@ -35,6 +39,8 @@ from mpm.test_cases import TestCase
 from copy import copy
 from itertools import chain
 
+DB_PATH = 'fs.db'
+
 
 def usage():
     print(
@@ -54,6 +60,22 @@ Options:
       --subject=CONTEXT    Name of the subject context as defined in
                            subjects.py
       --object=CONTEXT     Name of the object context as defined in objects.py
+      --fs-index           Load the filesystem snapshot into memory once and
+                           query it instead of the database
+      --jobs=N             Number of processes used to generalize evaluation
+                           cases in parallel (default 1)
+      --scratch-db         Don't wait for database writes to reach the disk.
+                           Faster, but the database may be corrupted if the
+                           system crashes
+      --db-timing          Print time spent in every type of database query
+      --profile            Write time, calls and processed items of every
+                           stage of the pipeline and peak memory usage into
+                           results/CASE_NAME/profile.{json,csv}
+      --eval-cases=CASES   Comma separated list of evaluation cases. A case is
+                           a '+' separated list of generalizers (T, O, OD, N,
+                           M) executed in the given order, or 'no
+                           generalization'. All single generalizers and
+                           selected pairs are evaluated by default.
  """,
         file=stderr,
     )
@@ -65,7 +87,21 @@ def main():
         return usage()
     try:
         optlist, args = getopt(
-            argv[1:], '', ['user=', 'group=', 'subject=', 'object=', 'help']
+            argv[1:],
+            '',
+            [
+                'user=',
+                'group=',
+                'subject=',
+                'object=',
+                'fs-index',
+                'jobs=',
+                'scratch-db',
+                'db-timing',
+                'profile',
+                'eval-cases=',
+                'help',
+            ],
         )
     except GetoptError as e:
         print(e, file=sys.stderr)
@@ -76,6 +112,14 @@ def main():
 
     subject_context_groups: list[list[str, ...]] = []
     object_type_groups: list[list[str, ...]] = []
+    use_fs_index = False
+    jobs = 1
+    scratch_db = False
+    db_timing = False
+    profile = False
+    eval_cases = mpm.test_cases.parse_eval_cases(
+        mpm.test_cases.DEFAULT_EVAL_CASES
+    )
 
     for opt, value in optlist:
         match opt:
@@ -101,6 +145,29 @@ def main():
                         )
                     )
                 )
+            case '--fs-index':
+                use_fs_index = True
+            case '--jobs':
+                try:
+                    jobs = int(value)
+                except ValueError:
+                    return usage()
+                if jobs < 1:
+                    return usage()
+            case '--scratch-db':
+                scratch_db = True
+            case '--db-timing':
+                db_timing = True
+            case '--profile':
+                profile = True
+            case '--eval-cases':
+                try:
+                    eval_cases = mpm.test_cases.parse_eval_cases(
+                        value.split(',')
+                    )
+                except ValueError as e:
+                    print(e, file=sys.stderr)
+                    return usage()
             case '--help':
                 return usage()
             case _:
@@ -119,6 +186,9 @@ def main():
         for i in range(len(gid_name_groups) - len(uid_name_groups)):
             uid_name_groups.append([])
 
+    if profile:
+        mpm.profiling.enable()
+
     case = args[0]
     args = args[1:]
     # runs contains individual services: [[service1 log1, service1 log2],
@@ -154,13 +224,16 @@ def main():
             log = parse_log(log_path, None, domain_transition_groups[j][i])
             trees[i].load_log(log)
 
-    db = DatabaseWriter('fs.db')
-
-    results: dict[str, Result] = {}
-
-    mpm.test_cases.helpers.prepare_selinux_accesses(
-        db, case, subject_context_groups, object_type_groups
+    db = DatabaseSession(
+        DatabaseWriter(DB_PATH), scratch=scratch_db, timing=db_timing
     )
+    if use_fs_index:
+        db = FsIndex(db)
+
+    with transaction(db):
+        mpm.test_cases.helpers.prepare_selinux_accesses(
+            db, case, subject_context_groups, object_type_groups
+        )
 
     fhs_path = 'fhs_rules.txt'
 
@@ -187,96 +260,11 @@ def main():
         for gid_names in gid_name_groups
     ]
 
-    # Double pass because reference items may be added to the database through
-    # generalization
-    for _ in range(2):
-        ctx.eval_case = 'no generalization'
-        test_cases = (TestCase.NO_GENERALIZATION,)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-
-        ctx.eval_case = 'T'
-        test_cases = (TestCase.STANDARD,)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-
-        ctx.eval_case = 'O'
-        test_cases = (TestCase.OWNER,)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-
-        ctx.eval_case = 'OD'
-        test_cases = (TestCase.OWNER_DIRECTORY,)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-
-        ctx.eval_case = 'N'
-        test_cases = (TestCase.NONEXISTENT,)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-
-        ctx.eval_case = 'M'
-        test_cases = (TestCase.MULTIPLE_RUNS,)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-
-        # pairs
-        ctx.eval_case = 'M+T'
-        test_cases = (TestCase.MULTIPLE_RUNS, TestCase.STANDARD)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'N+T'
-        test_cases = (TestCase.NONEXISTENT, TestCase.STANDARD)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'O+T'
-        test_cases = (TestCase.OWNER, TestCase.STANDARD)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'OD+T'
-        test_cases = (TestCase.OWNER_DIRECTORY, TestCase.STANDARD)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'OD+O'
-        test_cases = (TestCase.OWNER_DIRECTORY, TestCase.OWNER)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'O+N'
-        test_cases = (TestCase.OWNER, TestCase.NONEXISTENT)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'M+O'
-        test_cases = (TestCase.MULTIPLE_RUNS, TestCase.OWNER)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'OD+N'
-        test_cases = (TestCase.OWNER_DIRECTORY, TestCase.NONEXISTENT)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'M+OD'
-        test_cases = (TestCase.MULTIPLE_RUNS, TestCase.OWNER_DIRECTORY)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
-        ctx.eval_case = 'M+N'
-        test_cases = (TestCase.MULTIPLE_RUNS, TestCase.NONEXISTENT)
-        results[ctx.eval_case] = mpm.test_cases.execute_tests(
-            test_cases, copy(ctx)
-        )
+    results = mpm.test_cases.pool.execute_eval_cases(
+        eval_cases, ctx, DB_PATH, jobs, use_fs_index
+    )
+    if db.stats is not None:
+        db.stats.print()
     db.close()
 
     summary_buf = io.StringIO()
@@ -312,6 +300,9 @@ def main():
 
     summary_buf.close()
 
+    if profile:
+        mpm.profiling.write_report(result_dir)
+
     return 0
 
 